@@ -0,0 +1,38 @@
+from typing import List
+
+from fastapi import HTTPException, Query
+from sqlalchemy import Integer, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+
+from .settings import settings
+
+
+def batch_ids(ids: List[int] = Query(..., description="repeated for every requested id")) -> List[int]:
+    """
+    Requested ids without duplicates, in the order they were given.
+    """
+    unique = list(dict.fromkeys(ids))
+    if len(unique) > settings.MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.MAX_BATCH_SIZE} ids can be requested at once.",
+        )
+    return unique
+
+
+def any_id(column, ids: List[int]):
+    """
+    column = ANY($1) with the ids bound as one array, so every batch size shares one prepared statement.
+    """
+    return column == any_(bindparam("ids", ids, type_=ARRAY(Integer)))
+
+
+def group_by_id(rows, ids: List[int]) -> dict:
+    """
+    Groups rows by their id column and lists the requested ids without any row.
+    """
+    items = {}
+    for row in rows:
+        items.setdefault(row.id, []).append(row)
+    return {"items": items, "missing": [id for id in ids if id not in items]}
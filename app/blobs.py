@@ -0,0 +1,156 @@
+"""
+Content-addressed blob storage for images.
+
+A blob is named by the sha256 of its content, so identical uploads are stored once. How many rows
+point at a blob is counted in blob_table, inside the transaction that adds or removes the rows:
+store_blobs counts a blob before its content is written, release_blobs uncounts it and
+collect_blobs, run after the commit, removes the blobs nobody references any more.
+The storage itself is pluggable, settings.BLOB_BACKEND selects it.
+"""
+
+import asyncio
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Blob
+from .settings import settings
+
+
+class BlobStore(ABC):
+    """
+    Keeps blob contents, reference counting is left to the functions of this module.
+    Methods block, async code calls them through a worker thread.
+    """
+
+    @abstractmethod
+    def write(self, digest: str, data: bytes):
+        """
+        Stores data under digest, readers never see a partially written blob.
+        """
+
+    @abstractmethod
+    def read(self, digest: str) -> bytes:
+        """
+        Raises FileNotFoundError for a missing blob.
+        """
+
+    @abstractmethod
+    def remove(self, digest: str):
+        """
+        Removes a blob, missing blobs are ignored.
+        """
+
+    def path(self, digest: str) -> Optional[str]:
+        """
+        Local file of a blob, lets it be served straight from disk. None when the backend has none.
+        """
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Stores blobs as files sharded by the leading hex digits of the digest, e.g. ab/cd/abcd...,
+    which keeps directories small.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def write(self, digest: str, data: bytes):
+        path = self.path(digest)
+        if os.path.exists(path):  # same digest, same content
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # written under a temporary name in the same directory, then renamed into place atomically
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def read(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as file:
+            return file.read()
+
+    def remove(self, digest: str):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+def create_blob_store() -> BlobStore:
+    if settings.BLOB_BACKEND == "local":
+        return LocalBlobStore(settings.BLOB_ROOT)
+    raise ValueError(f"Unknown blob backend {settings.BLOB_BACKEND!r}.")
+
+
+blob_store = create_blob_store()
+
+
+async def run_blocking(function, *arguments):
+    return await asyncio.get_running_loop().run_in_executor(None, function, *arguments)
+
+
+def count_statement(digest: str, references: int = 1):
+    upsert = insert(Blob).values(content_hash=digest, refcount=references)
+    return upsert.on_conflict_do_update(index_elements=[Blob.content_hash],
+                                        set_={"refcount": Blob.refcount + references})
+
+
+def uncount_statement(digest: str):
+    return update(Blob).filter(Blob.content_hash == digest).values(refcount=Blob.refcount - 1)
+
+
+def collect_statement(digests):
+    return delete(Blob).filter(Blob.content_hash.in_(digests), Blob.refcount <= 0).returning(Blob.content_hash)
+
+
+async def store_blobs(db: AsyncSession, blobs: dict, references: Counter):
+    """
+    Writes the missing contents of blobs, digest -> data, and counts references[digest] more
+    references to every one, one per row that will point at it, as release_blobs uncounts one per row.
+    Counting first holds the blob's row lock, so a concurrent collect_blobs cannot remove the content
+    until this transaction ends, and then it sees the references.
+    """
+    for digest in sorted(blobs):  # one locking order for all writers
+        await db.execute(count_statement(digest, references[digest]))
+    for digest, data in blobs.items():
+        await run_blocking(blob_store.write, digest, data)
+
+
+async def release_blobs(db: AsyncSession, digests):
+    """
+    Uncounts one reference per digest, pass the digest of every removed row, repeated ones included.
+    """
+    for digest in sorted(digests):
+        await db.execute(uncount_statement(digest))
+
+
+async def collect_blobs(db: AsyncSession, digests):
+    """
+    Removes the released blobs nobody references any more, call it after the release was committed.
+    Contents are removed while their rows are locked, before the rows are gone for good.
+    """
+    if not digests:
+        return
+    unreferenced = (await db.execute(collect_statement(list(digests)))).scalars().all()
+    for digest in unreferenced:
+        await run_blocking(blob_store.remove, digest)
+    await db.commit()
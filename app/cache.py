@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+
+# every cache registers here under its name, /monitoring/cache reports them all
+caches = {}
+
+
+class LRUCache:
+    """
+    Bounded mapping that drops the least recently used entry when full
+    and treats entries older than ttl seconds as missing.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # bumped by every invalidation, a value loaded before it is not stored afterwards
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        caches[name] = self
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, generation: int = None, ttl: float = None):
+        """
+        Stores a value, unless generation was taken before an invalidation that happened since.
+        """
+        if self.maxsize <= 0 or (generation is not None and generation != self.generation):
+            return
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        self.generation += 1
+        return self._entries.pop(key, (None, None))[1]
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def statistics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+def cache_statistics() -> dict:
+    return {name: cache.statistics() for name, cache in caches.items()}
@@ -0,0 +1,140 @@
+"""
+Bookkeeping of open websockets.
+
+The manager caps sockets per worker and per user, pings every socket regularly and closes
+sockets whose client stopped answering or stopped searching. A socket holds no database
+connection of its own, queries check one out of the pool only while they run.
+"""
+
+import asyncio
+import json
+import time
+
+from fastapi import WebSocket
+from starlette.status import WS_1001_GOING_AWAY, WS_1013_TRY_AGAIN_LATER
+
+from .settings import settings
+
+PING = {"type": "ping"}
+PONG = {"type": "pong"}
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.last_seen = self.last_active = time.monotonic()
+        self.closed = False
+
+    def is_pong(self, text: str) -> bool:
+        """
+        Records a received message, returns True for a heartbeat answer, which is not a search.
+        """
+        self.last_seen = time.monotonic()
+        if text.startswith("{"):
+            try:
+                if json.loads(text) == PONG:
+                    return True
+            except ValueError:
+                pass
+        self.last_active = self.last_seen
+        return False
+
+    async def send_json(self, data) -> bool:
+        """
+        Sends unless the socket is closed already, returns whether the message went out.
+        """
+        if self.closed:
+            return False
+        try:
+            await self.websocket.send_json(data)
+            return True
+        except Exception:  # the client is gone, the receiving loop learns it too
+            self.closed = True
+            return False
+
+    async def close(self, code: int):
+        if not self.closed:
+            self.closed = True
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass
+
+
+class ConnectionManager:
+    def __init__(self, max_sockets: int, max_per_user: int,
+                 ping_interval: float, pong_timeout: float, idle_timeout: float):
+        self.max_sockets = max_sockets
+        self.max_per_user = max_per_user
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.idle_timeout = idle_timeout
+        self._by_user = {}  # user id -> set of Connection
+        self.active = 0
+        self.opened = 0
+        self.rejected = 0
+        self.reaped_idle = 0
+        self.reaped_dead = 0
+
+    async def connect(self, websocket: WebSocket, user_id: int):
+        """
+        Registers an accepted socket, or tells the client to come back later and closes it
+        when a limit is reached. Returns the Connection or None.
+        """
+        user_connections = self._by_user.get(user_id, set())
+        if self.active >= self.max_sockets or len(user_connections) >= self.max_per_user:
+            self.rejected += 1
+            await websocket.send_json({"status_code": 429,
+                                       "message": "Too many open connections."})
+            await websocket.close(code=WS_1013_TRY_AGAIN_LATER)
+            return None
+
+        connection = Connection(websocket, user_id)
+        self._by_user.setdefault(user_id, set()).add(connection)
+        self.active += 1
+        self.opened += 1
+        return connection
+
+    def disconnect(self, connection: Connection):
+        connection.closed = True
+        user_connections = self._by_user.get(connection.user_id)
+        if user_connections is not None and connection in user_connections:
+            user_connections.discard(connection)
+            self.active -= 1
+            if not user_connections:
+                del self._by_user[connection.user_id]
+
+    async def keep_alive(self, connection: Connection):
+        """
+        Runs next to the receiving loop of a socket: pings it every ping_interval and closes it once
+        the client has not answered for pong_timeout after a ping or has not searched for idle_timeout.
+        Closing makes the receiving loop end with a disconnect.
+        """
+        while not connection.closed:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            if now - connection.last_active > self.idle_timeout:
+                self.reaped_idle += 1
+                await connection.close(WS_1001_GOING_AWAY)
+            elif now - connection.last_seen > self.ping_interval + self.pong_timeout:
+                self.reaped_dead += 1
+                await connection.close(WS_1001_GOING_AWAY)
+            else:
+                await connection.send_json(PING)
+
+    def statistics(self) -> dict:
+        return {
+            "active": self.active,
+            "users": len(self._by_user),
+            "max_sockets": self.max_sockets,
+            "max_per_user": self.max_per_user,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "reaped_idle": self.reaped_idle,
+            "reaped_dead": self.reaped_dead,
+        }
+
+
+socket_manager = ConnectionManager(settings.WS_MAX_SOCKETS, settings.WS_MAX_SOCKETS_PER_USER,
+                                   settings.WS_PING_INTERVAL, settings.WS_PONG_TIMEOUT, settings.WS_IDLE_TIMEOUT)
@@ -0,0 +1,54 @@
+"""
+Brings the database schema up to date by running the migrations in app/db/migrations.
+
+Usage: python -m app.db.create_schema   (the same as: alembic upgrade head)
+
+A database created from app.models before the migrations existed gets the tables it is
+missing, as create_schema used to add them, and is stamped with the baseline revision, so
+only the later migrations run on it. Photos of such a database are moved into the blob store
+by revision 0004, the search and pagination indexes of the baseline are built by revision 0006.
+New migration: alembic revision -m "what it changes"
+
+When the rating aggregate tables are created next to existing reviews,
+fill them in with python -m app.db.recompute_stats.
+"""
+
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+
+from app.db.base import Base
+from app.db.init_db import engine
+from app import models  # registers all tables on Base.metadata
+
+ALEMBIC_INI = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "alembic.ini")
+BASELINE = "0001"
+
+
+def migration_config(bind=engine) -> Config:
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "migrations"))
+    config.attributes["engine"] = bind
+    return config
+
+
+def predates_migrations(bind) -> bool:
+    tables = inspect(bind)
+    return tables.has_table("user_table") and not tables.has_table("alembic_version")
+
+
+def create_schema(bind=engine):
+    """
+    Runs the migrations that are missing from the database.
+    """
+    config = migration_config(bind)
+    if predates_migrations(bind):
+        Base.metadata.create_all(bind)  # only missing tables, e.g. from an earlier photo layout
+        command.stamp(config, BASELINE)
+    command.upgrade(config, "head")
+
+
+if __name__ == "__main__":
+    create_schema()
@@ -1,30 +1,63 @@
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from app.db import init_db
+from app.db.replicas import ReplicaSet
+
+# process-wide session factories, built once instead of on every request
+session_local = sessionmaker(bind=init_db.engine, autocommit=False)
+# expire_on_commit is disabled, so objects stay readable after commit without an implicit (blocking) refresh
+async_session = sessionmaker(bind=init_db.async_engine, class_=AsyncSession, autocommit=False,
+                             expire_on_commit=False)
+# read-only sessions, on the replicas when there are healthy ones
+replica_set = ReplicaSet(init_db.replica_engines, async_session)
+
+READ_METHODS = ("GET", "HEAD")
 
 
 def create_connection():
     """
         Creates a connection to database and returns a Session variable.
     """
-    session = sessionmaker(autocommit=False, bind=init_db.engine)
-    db = session()
+    db = session_local()
     try:
         yield db
     finally:
         db.close()
 
 
-async def async_create_connection():
+async def async_create_connection(request: Request):
     """
-        Creates a connection to database and returns a Session variable.
+        Creates an asyncio connection to database and returns an AsyncSession variable.
+        The connection is returned to the pool once the request is finished, even if it failed.
+        A client's write is recorded as it starts and ends, so its next reads go to the primary.
     """
-    session = sessionmaker(autocommit=False, bind=init_db.engine)
-    db = session()
+    writer = request.headers.get("authorization") if request.method not in READ_METHODS else None
+    replica_set.record_write(writer)
     try:
-        return db
-    except Exception:
-        return None
+        async with async_session() as db:
+            yield db
+    finally:  # the handler may have committed before it failed
+        replica_set.record_write(writer)
+
+
+def read_session(authorization: Optional[str] = None) -> AsyncSession:
+    """
+        Creates a read-only AsyncSession for the client sending the given Authorization header.
+    """
+    return replica_set.session_factory(authorization)()
+
+
+async def async_read_connection(request: Request):
+    """
+        Creates an asyncio connection for a read-only route, to a read replica unless the client
+        wrote lately or no replica is healthy. Writes through it fail on a replica.
+    """
+    async with read_session(request.headers.get("authorization")) as db:
+        yield db
 
 
 def get_database(session):
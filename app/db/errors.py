@@ -0,0 +1,14 @@
+from sqlalchemy.exc import IntegrityError
+
+FOREIGN_KEY_VIOLATION = "23503"
+
+
+def violates_foreign_key(error: IntegrityError, column) -> bool:
+    """
+    Whether the statement failed because column referenced a missing row. Constraints carry
+    the names Postgres gives them by default, <table>_<column>_fkey.
+    """
+    if getattr(error.orig, "pgcode", None) != FOREIGN_KEY_VIOLATION:
+        return False
+    constraint = getattr(error.orig.__cause__, "constraint_name", None)
+    return constraint is None or constraint == f"{column.table.name}_{column.name}_fkey"
@@ -1,6 +1,66 @@
 from app.settings import settings
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import metrics
+from app.db import query_log
+from app.db.pool import TimedQueuePool, TimedAsyncAdaptedQueuePool
 
 database_url = f"postgresql://{settings.DB_USERNAME}:{settings.DB_PASSWORD}" \
                f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
-engine = create_engine(database_url)  # creates database engine from given environment variables
+async_database_url = f"postgresql+asyncpg://{settings.DB_USERNAME}:{settings.DB_PASSWORD}" \
+                     f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
+
+pool_options = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+}
+
+# creates database engine from given environment variables
+engine = create_engine(database_url, poolclass=TimedQueuePool, **pool_options)
+# asyncpg engine used by the async route handlers
+async_engine = create_async_engine(async_database_url, poolclass=TimedAsyncAdaptedQueuePool, **pool_options)
+# asyncpg engines of the read replicas, their transactions are read only even if a DSN names the primary
+replica_engines = [
+    create_async_engine(make_url(dsn.strip()).set(drivername="postgresql+asyncpg"),
+                        poolclass=TimedAsyncAdaptedQueuePool,
+                        connect_args={"server_settings": {"default_transaction_read_only": "on"}},
+                        **pool_options)
+    for dsn in settings.DB_REPLICA_URLS.split(",") if dsn.strip()
+]
+
+
+def pool_statistics():
+    """
+    Returns live statistics of the primary's connection pools and of every replica's pool.
+    """
+    statistics = {
+        "sync": engine.pool.statistics(),
+        "async": async_engine.pool.statistics(),
+    }
+    for index, replica_engine in enumerate(replica_engines):
+        statistics[f"replica{index}"] = replica_engine.pool.statistics()
+    return statistics
+
+
+def pool_connections():
+    statistics = pool_statistics()
+    return {(pool, state): values[state] for pool, values in statistics.items()
+            for state in ("checked_in", "checked_out")}
+
+
+# every engine as the sync engine event listeners are registered on
+sync_engines = [engine, async_engine.sync_engine] + [replica.sync_engine for replica in replica_engines]
+
+if settings.METRICS_ENABLED:
+    for instrumented in sync_engines:
+        metrics.instrument_engine(instrumented)
+    metrics.Gauge("db_pool_connections", "Pooled database connections by state.", ("pool", "state"), pool_connections)
+
+if settings.SLOW_QUERY_SECONDS or settings.REPEATED_QUERY_THRESHOLD:
+    for instrumented in sync_engines:
+        query_log.instrument_engine(instrumented)
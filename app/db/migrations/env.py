@@ -0,0 +1,46 @@
+"""
+Alembic environment, migrations run against the database configured in .env.
+
+python -m app.db.create_schema passes its engine in config.attributes["engine"] and keeps
+the application's logging, the alembic command line configures logging from alembic.ini.
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+
+from app.db.base import Base
+from app.db.init_db import database_url, engine
+from app import models  # registers all tables on Base.metadata
+
+config = context.config
+
+if config.config_file_name is not None and "engine" not in config.attributes:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """
+    Writes the SQL of the migrations instead of running it (alembic upgrade head --sql).
+    """
+    context.configure(url=database_url, target_metadata=target_metadata, literal_binds=True,
+                      transaction_per_migration=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # a transaction per migration, so concurrent index builds can commit around themselves
+    with config.attributes.get("engine", engine).connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata,
+                          transaction_per_migration=True)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,146 @@
+"""
+Baseline, the schema create_schema built from app.models before migrations were introduced.
+
+A database created that way is stamped with this revision instead of running it.
+
+Revision ID: 0001
+Revises:
+Create Date: 2022-06-01 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+EMPTY_HISTOGRAM = sa.text("'{0,0,0,0,0,0,0,0,0,0}'")
+
+# expression indexes of the search, written out as their expressions must match app.search.trigram
+SEARCH_INDEXES = [
+    "CREATE INDEX ix_user_table_name_trgm ON user_table "
+    "USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)",
+    "CREATE INDEX ix_user_table_name_prefix ON user_table "
+    "(lower(first_name || ' ' || last_name) text_pattern_ops)",
+    "CREATE INDEX ix_professor_table_name_trgm ON professor_table "
+    "USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)",
+    "CREATE INDEX ix_professor_table_name_prefix ON professor_table "
+    "(lower(first_name || ' ' || last_name) text_pattern_ops)",
+    "CREATE INDEX ix_subject_table_name_trgm ON subject_table USING gin (lower(name) gin_trgm_ops)",
+    "CREATE INDEX ix_subject_table_code_trgm ON subject_table USING gin (lower(code) gin_trgm_ops)",
+    "CREATE INDEX ix_subject_table_name_prefix ON subject_table (lower(name) text_pattern_ops)",
+    "CREATE INDEX ix_subject_table_code_prefix ON subject_table (lower(code) text_pattern_ops)",
+]
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.create_table(
+        "user_table",
+        sa.Column("id", sa.Integer, primary_key=True, nullable=False),
+        sa.Column("email", sa.VARCHAR(30), nullable=False, unique=True),
+        sa.Column("first_name", sa.VARCHAR(20), nullable=False),
+        sa.Column("last_name", sa.VARCHAR(20), nullable=False),
+        sa.Column("pwd", sa.VARCHAR(30), nullable=False),
+        sa.Column("permission", sa.Boolean, nullable=False),
+        sa.Column("comments", sa.Integer, nullable=False),
+        sa.Column("reg_date", sa.TIMESTAMP(timezone=False), nullable=False, server_default=sa.text("now()")),
+        sa.Column("study_year", sa.SmallInteger, nullable=False),
+    )
+    op.create_table(
+        "professor_table",
+        sa.Column("id", sa.Integer, primary_key=True, nullable=False),
+        sa.Column("first_name", sa.VARCHAR(30), nullable=False),
+        sa.Column("last_name", sa.VARCHAR(30), nullable=False),
+    )
+    op.create_table(
+        "subject_table",
+        sa.Column("id", sa.Integer, primary_key=True, nullable=False),
+        sa.Column("name", sa.VARCHAR(50), nullable=False, unique=True),
+        sa.Column("code", sa.VARCHAR(10), nullable=False, unique=True),
+        sa.Column("prof_id", sa.Integer, sa.ForeignKey("professor_table.id", ondelete="CASCADE"), nullable=False),
+    )
+    op.create_table(
+        "blob_table",
+        sa.Column("content_hash", sa.VARCHAR(64), primary_key=True, nullable=False),
+        sa.Column("refcount", sa.Integer, nullable=False, server_default=sa.text("0")),
+    )
+    op.create_table(
+        "user_photo_table",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("size", sa.SmallInteger, primary_key=True, nullable=False, server_default=sa.text("0")),
+        sa.Column("media_type", sa.VARCHAR(20), nullable=False),
+        sa.Column("content_hash", sa.VARCHAR(64), nullable=False),
+    )
+    op.create_table(
+        "relation_table",
+        sa.Column("subj_id", sa.Integer, sa.ForeignKey("subject_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("prof_id", sa.Integer, sa.ForeignKey("professor_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+    )
+    op.create_table(
+        "subj_review_table",
+        sa.Column("subj_id", sa.Integer, sa.ForeignKey("subject_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("message", sa.TEXT, nullable=False),
+        sa.Column("review_date", sa.TIMESTAMP(timezone=False), nullable=False, server_default=sa.text("now()")),
+        sa.Column("difficulty", sa.SmallInteger, nullable=False),
+        sa.Column("usability", sa.SmallInteger, nullable=False),
+        sa.Column("prof_avg", sa.SmallInteger, nullable=False),
+    )
+    op.create_table(
+        "prof_review_table",
+        sa.Column("prof_id", sa.Integer, sa.ForeignKey("professor_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("message", sa.TEXT, nullable=False),
+        sa.Column("review_date", sa.TIMESTAMP(timezone=False), nullable=False, server_default=sa.text("now()")),
+        sa.Column("rating", sa.SmallInteger, nullable=False),
+    )
+    op.create_table(
+        "prof_stats_table",
+        sa.Column("prof_id", sa.Integer, sa.ForeignKey("professor_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("review_count", sa.Integer, nullable=False, server_default=sa.text("0")),
+        sa.Column("rating_sum", sa.BigInteger, nullable=False, server_default=sa.text("0")),
+        sa.Column("rating_histogram", postgresql.ARRAY(sa.Integer), nullable=False, server_default=EMPTY_HISTOGRAM),
+    )
+    op.create_table(
+        "subj_stats_table",
+        sa.Column("subj_id", sa.Integer, sa.ForeignKey("subject_table.id", ondelete="CASCADE"),
+                  primary_key=True, nullable=False),
+        sa.Column("review_count", sa.Integer, nullable=False, server_default=sa.text("0")),
+        sa.Column("difficulty_sum", sa.BigInteger, nullable=False, server_default=sa.text("0")),
+        sa.Column("difficulty_histogram", postgresql.ARRAY(sa.Integer), nullable=False,
+                  server_default=EMPTY_HISTOGRAM),
+        sa.Column("usability_sum", sa.BigInteger, nullable=False, server_default=sa.text("0")),
+        sa.Column("usability_histogram", postgresql.ARRAY(sa.Integer), nullable=False,
+                  server_default=EMPTY_HISTOGRAM),
+        sa.Column("prof_avg_sum", sa.BigInteger, nullable=False, server_default=sa.text("0")),
+        sa.Column("prof_avg_histogram", postgresql.ARRAY(sa.Integer), nullable=False,
+                  server_default=EMPTY_HISTOGRAM),
+    )
+
+    for index in SEARCH_INDEXES:
+        op.execute(index)
+    # keyset pagination of an entity's reviews, newest first
+    op.create_index("ix_prof_review_table_prof_id_review_date", "prof_review_table",
+                    ["prof_id", "review_date", "user_id"])
+    op.create_index("ix_subj_review_table_subj_id_review_date", "subj_review_table",
+                    ["subj_id", "review_date", "user_id"])
+
+
+def downgrade():
+    for table in ("subj_stats_table", "prof_stats_table", "prof_review_table", "subj_review_table",
+                  "relation_table", "user_photo_table", "blob_table", "subject_table", "professor_table",
+                  "user_table"):
+        op.drop_table(table)
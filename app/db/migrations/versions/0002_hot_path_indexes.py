@@ -0,0 +1,43 @@
+"""
+Hot path indexes: reviews by author, relations and subjects by professor.
+
+- reviews are found by user_id alone when a profile is deleted, by app.stats.remove_user_reviews
+  and by the cascade, the review_date column lets an author's reviews be listed newest first
+  from the same index
+- relation_table's primary key starts with subj_id, joins on prof_id had no index
+- subject_table.prof_id is joined to find a professor's guaranteed subjects
+
+Indexes are built CONCURRENTLY outside a transaction, so the tables stay writable meanwhile.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2022-06-01 00:00:01
+"""
+
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_prof_review_table_user_id_review_date", "prof_review_table", ["user_id", "review_date"]),
+    ("ix_subj_review_table_user_id_review_date", "subj_review_table", ["user_id", "review_date"]),
+    ("ix_relation_table_prof_id", "relation_table", ["prof_id"]),
+    ("ix_subject_table_prof_id", "subject_table", ["prof_id"]),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            # an interrupted concurrent build leaves an invalid index behind, it is built again
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,36 @@
+"""
+Widens user_table.pwd and user_table.email.
+
+pwd holds bcrypt hashes, which are 60 characters long, email the 40 characters registration accepts.
+
+Raising a varchar limit only changes the catalog, neither the table nor the unique index on email
+is rewritten.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2022-06-01 00:00:02
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = [("email", 30, 40), ("pwd", 30, 100)]  # name, old and new length
+
+
+def upgrade():
+    for name, old, new in COLUMNS:
+        op.alter_column("user_table", name, type_=sa.VARCHAR(new), existing_type=sa.VARCHAR(old),
+                        existing_nullable=False)
+
+
+def downgrade():
+    # fails while a longer value is stored, e.g. any bcrypt hash
+    for name, old, new in COLUMNS:
+        op.alter_column("user_table", name, type_=sa.VARCHAR(old), existing_type=sa.VARCHAR(new),
+                        existing_nullable=False)
@@ -0,0 +1,99 @@
+"""
+Moves profile photos of earlier layouts into the blob store.
+
+Replaces python -m app.db.migrate_photos and renders the variants of every photo on the way.
+Handles every layout from before the blob store: photos kept in user_table.photo,
+user_photo_table holding only the upload keyed by user_id, and user_photo_table keeping the
+variant bytes in its photo column. A database created from the baseline has none of them and
+is left as it is. The changes happen in the transaction of this revision; blobs written by a
+failed run are reused by the next one. Photos are read one at a time, so they are never all in
+memory. The rendered SQL (--sql) moves nothing, it only suits databases created from the baseline.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2022-06-01 00:00:03
+"""
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from app.blobs import blob_store, count_statement
+from app.models import UserPhoto
+from app.photos import ORIGINAL, Variant, content_hash, render_variants
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def store_blob(connection, digest: str, data: bytes):
+    connection.execute(count_statement(digest))
+    blob_store.write(digest, data)
+
+
+def store_variants(connection, user_id: int, photo: bytes):
+    try:
+        variants = render_variants(photo)
+    except (OSError, ValueError):  # unreadable upload, kept as it is so nothing is lost
+        variants = [Variant(ORIGINAL, "application/octet-stream", content_hash(photo), photo)]
+    connection.execute(sa.delete(UserPhoto).filter(UserPhoto.user_id == user_id))
+    for variant in variants:
+        store_blob(connection, variant.content_hash, variant.photo)
+        connection.execute(sa.insert(UserPhoto).values(user_id=user_id, size=variant.size,
+                                                       media_type=variant.media_type,
+                                                       content_hash=variant.content_hash))
+
+
+def select_ids(connection, source: str, key: str, condition: str):
+    return connection.exec_driver_sql(f"select {key} from {source} where {condition}").scalars().all()
+
+
+def select_photo(connection, source: str, condition: str, parameters: dict) -> bytes:
+    return connection.exec_driver_sql(f"select photo from {source} where {condition}", parameters).scalar()
+
+
+def upgrade():
+    if context.is_offline_mode():  # the baseline layout has nothing to move
+        op.execute("-- photos of layouts before the blob store are moved by running this revision online")
+        return
+    connection = op.get_bind()
+    photo_columns = {column["name"] for column in sa.inspect(connection).get_columns("user_photo_table")}
+    if "size" not in photo_columns:  # uploads only, keyed by user_id
+        connection.exec_driver_sql(
+            "alter table user_photo_table "
+            "add column size smallint not null default 0, "
+            "add column media_type varchar(20), "
+            "add column content_hash varchar(64), "
+            "alter column photo drop not null, "
+            "drop constraint user_photo_table_pkey, "
+            "add primary key (user_id, size)"
+        )
+        for user_id in select_ids(connection, "user_photo_table", "user_id", "media_type is null"):
+            photo = select_photo(connection, "user_photo_table", "user_id = %(id)s", {"id": user_id})
+            store_variants(connection, user_id, photo)
+
+    if "photo" in photo_columns:  # variants rendered, but their bytes are kept in the table
+        for user_id, size in connection.exec_driver_sql(
+                "select user_id, size from user_photo_table where photo is not null").all():
+            photo = select_photo(connection, "user_photo_table", "user_id = %(id)s and size = %(size)s",
+                                 {"id": user_id, "size": size})
+            store_blob(connection, content_hash(photo), photo)
+        connection.exec_driver_sql(
+            "alter table user_photo_table drop column photo, "
+            "alter column media_type set not null, "
+            "alter column content_hash set not null"
+        )
+
+    user_columns = {column["name"] for column in sa.inspect(connection).get_columns("user_table")}
+    if "photo" in user_columns:
+        for user_id in select_ids(connection, "user_table", "id",
+                                  "photo is not null and id not in (select user_id from user_photo_table)"):
+            store_variants(connection, user_id, select_photo(connection, "user_table", "id = %(id)s",
+                                                             {"id": user_id}))
+        connection.exec_driver_sql("alter table user_table drop column photo")
+
+
+def downgrade():
+    # the schema is the one of revision 0003 again, the earlier photo layouts are not restored
+    pass
@@ -0,0 +1,32 @@
+"""
+Recounts blob references from user_photo_table.
+
+Uploads used to count a blob once even when several variants of a picture, identical for
+pictures no larger than the smallest variant, referred to it, while deletes uncounted every
+row. Counts are set to the number of rows referring to each blob. Contents already removed
+by such an undercount cannot be restored, their rows answer 404 until the picture is uploaded again.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2022-06-01 00:00:04
+"""
+
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE blob_table SET refcount = 0 "
+               "WHERE content_hash NOT IN (SELECT content_hash FROM user_photo_table)")
+    op.execute("INSERT INTO blob_table (content_hash, refcount) "
+               "SELECT content_hash, count(*) FROM user_photo_table GROUP BY content_hash "
+               "ON CONFLICT (content_hash) DO UPDATE SET refcount = excluded.refcount")
+
+
+def downgrade():
+    # the recounted references are correct under every revision
+    pass
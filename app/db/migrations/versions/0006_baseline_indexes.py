@@ -0,0 +1,59 @@
+"""
+Search and keyset pagination indexes of the baseline, for stamped databases.
+
+create_schema stamps a database created from app.models before migrations existed with revision
+0001 without running it, and create_all adds no indexes to the tables such a database already has.
+The indexes revision 0001 creates are built here where they are missing, a database created from
+the baseline already has them and is left as it is.
+
+Indexes are built CONCURRENTLY outside a transaction, so the tables stay writable meanwhile.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2022-06-01 00:00:05
+"""
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+# the definitions of revision 0001, their expressions must match app.search.trigram
+INDEXES = [
+    ("ix_user_table_name_trgm", "user_table USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)"),
+    ("ix_user_table_name_prefix", "user_table (lower(first_name || ' ' || last_name) text_pattern_ops)"),
+    ("ix_professor_table_name_trgm",
+     "professor_table USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)"),
+    ("ix_professor_table_name_prefix", "professor_table (lower(first_name || ' ' || last_name) text_pattern_ops)"),
+    ("ix_subject_table_name_trgm", "subject_table USING gin (lower(name) gin_trgm_ops)"),
+    ("ix_subject_table_code_trgm", "subject_table USING gin (lower(code) gin_trgm_ops)"),
+    ("ix_subject_table_name_prefix", "subject_table (lower(name) text_pattern_ops)"),
+    ("ix_subject_table_code_prefix", "subject_table (lower(code) text_pattern_ops)"),
+    ("ix_prof_review_table_prof_id_review_date", "prof_review_table (prof_id, review_date, user_id)"),
+    ("ix_subj_review_table_subj_id_review_date", "subj_review_table (subj_id, review_date, user_id)"),
+]
+
+INVALID_INDEXES = sa.text(
+    "SELECT pg_class.relname FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+    "WHERE NOT pg_index.indisvalid AND pg_class.relname IN :names"
+).bindparams(sa.bindparam("names", expanding=True))
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        if not context.is_offline_mode():
+            # an interrupted concurrent build leaves an invalid index behind, it is built again
+            names = [name for name, _ in INDEXES]
+            for name in op.get_bind().execute(INVALID_INDEXES, {"names": names}).scalars().all():
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        for name, definition in INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+
+def downgrade():
+    # the indexes belong to revision 0001 and stay until it is downgraded
+    pass
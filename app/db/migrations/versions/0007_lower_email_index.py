@@ -0,0 +1,37 @@
+"""
+Index on lower(email): login and registration look users up by their email in any case.
+
+An earlier revision 0003 dropped the index, it is built again where it is missing.
+
+Indexes are built CONCURRENTLY outside a transaction, so the table stays writable meanwhile.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2022-06-01 00:00:06
+"""
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+INVALID_INDEX = sa.text(
+    "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+    "WHERE NOT pg_index.indisvalid AND pg_class.relname = 'ix_user_table_lower_email'"
+)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        # an interrupted concurrent build leaves an invalid index behind, it is built again
+        if not context.is_offline_mode() and op.get_bind().execute(INVALID_INDEX).first() is not None:
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_user_table_lower_email")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_table_lower_email ON user_table (lower(email))")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_user_table_lower_email", table_name="user_table", postgresql_concurrently=True)
@@ -0,0 +1,172 @@
+"""
+Slow query log and repeated query (N+1) detection.
+
+Statements slower than SLOW_QUERY_SECONDS are logged with the route that ran them and their
+parameters, redacted to types and sizes so no email, hash or review text reaches the log. A
+sample of slow SELECTs (SLOW_QUERY_EXPLAIN_RATE) is run again under EXPLAIN (ANALYZE, BUFFERS)
+and the plan is logged with them, unless the SELECT locks rows (FOR UPDATE, FOR SHARE, ...).
+A request running the same statement shape, the statement with its placeholders collapsed,
+more than REPEATED_QUERY_THRESHOLD times is logged once it finishes, as that is usually a loop
+issuing one query per item.
+"""
+
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import event
+
+from app.metrics import route_template
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# a run of placeholders, as in IN lists whose length changes between calls
+PLACEHOLDERS = re.compile(r"(?:\$\d+|%s|%\(\w+\)s)(?:\s*,\s*(?:\$\d+|%s|%\(\w+\)s))*")
+# row locking clauses, running such a SELECT again would take its locks in the caller's transaction
+LOCKING_CLAUSE = re.compile(r"\bFOR\s+(?:UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b", re.IGNORECASE)
+MAX_SHAPES = 1000  # statements whose shape is remembered, the cache is cleared beyond that
+MAX_LOGGED_STATEMENT = 2000  # characters of a statement written to the log
+
+EXPLAIN_SAVEPOINT = "query_log_explain"
+
+shapes = {}  # statement -> shape
+
+
+class RequestQueries:
+    __slots__ = ("app", "scope", "shapes")
+
+    def __init__(self, app, scope):
+        self.app = app
+        self.scope = scope
+        self.shapes = Counter()
+
+    @property
+    def route(self) -> str:
+        return f"{self.scope.get('method', 'WEBSOCKET')} {route_template(self.app, self.scope)}"
+
+
+# queries of the request the current task is answering, None outside requests
+current_queries: ContextVar[Optional[RequestQueries]] = ContextVar("current_queries", default=None)
+
+
+def shape(statement: str) -> str:
+    result = shapes.get(statement)
+    if result is None:
+        if len(shapes) >= MAX_SHAPES:
+            shapes.clear()
+        result = shapes[statement] = PLACEHOLDERS.sub("?", " ".join(statement.split()))
+    return result
+
+
+def redact(value):
+    """
+    Keeps numbers, flags and dates, which identify rows but hold nothing private, and reduces
+    anything else to its type and size.
+    """
+    if value is None or isinstance(value, (bool, int, float, date, datetime)):
+        return value
+    if isinstance(value, (str, bytes, list, tuple)):
+        return f"<{type(value).__name__} of {len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {name: redact(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return redact(parameters)
+
+
+def explain(conn, statement: str, parameters) -> str:
+    """
+    Runs the statement again under EXPLAIN ANALYZE on a new cursor of the same connection, so it
+    sees the request's transaction, inside a savepoint, so a failure leaves that transaction intact.
+    """
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f"SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        try:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception as error:
+            cursor.execute(f"ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}")
+            return f"EXPLAIN failed: {error}"
+        cursor.execute(f"RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        return plan
+    except Exception as error:  # e.g. no transaction to hold a savepoint
+        return f"EXPLAIN failed: {error}"
+    finally:
+        cursor.close()
+
+
+def explainable(statement: str, executemany: bool) -> bool:
+    """
+    EXPLAIN ANALYZE executes the statement, only reads that lock no rows can safely run twice.
+    """
+    return (not executemany and statement.lstrip()[:6].upper() == "SELECT"
+            and LOCKING_CLAUSE.search(statement) is None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_log_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_log_started"].pop()
+    queries = current_queries.get()
+    if queries is not None and settings.REPEATED_QUERY_THRESHOLD and queries.scope["type"] == "http":
+        queries.shapes[shape(statement)] += 1
+    if settings.SLOW_QUERY_SECONDS and duration >= settings.SLOW_QUERY_SECONDS:
+        plan = None
+        if explainable(statement, executemany) and random.random() < settings.SLOW_QUERY_EXPLAIN_RATE:
+            plan = explain(conn, statement, parameters)
+        logger.warning("Slow query, %.1f ms on %s: %s\nparameters: %s%s", duration * 1000,
+                       queries.route if queries is not None else "no request",
+                       statement[:MAX_LOGGED_STATEMENT], redact_parameters(parameters),
+                       f"\n{plan}" if plan is not None else "")
+
+
+def report_repeated(queries: RequestQueries):
+    for statement, count in queries.shapes.items():
+        if count > settings.REPEATED_QUERY_THRESHOLD:
+            logger.warning("Repeated query, %d times in one request on %s: %s", count, queries.route,
+                           statement[:MAX_LOGGED_STATEMENT])
+
+
+def instrument_engine(engine):
+    """
+    Watches the queries of a (sync) engine, pass async_engine.sync_engine for the async one.
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class QueryLogMiddleware:
+    """
+    Tells the query hooks which request or websocket runs a statement. Only requests count
+    their statement shapes, a socket answering many searches repeats its queries by design.
+    """
+
+    def __init__(self, app, root_app=None):
+        self.app = app
+        self.root_app = root_app  # the FastAPI application whose routes name the requests
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        queries = RequestQueries(self.root_app, scope)
+        token = current_queries.set(queries)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_queries.reset(token)
+            if scope["type"] == "http":
+                report_repeated(queries)
@@ -0,0 +1,23 @@
+"""
+Recomputes the rating aggregates of all professors and subjects from their reviews.
+
+Repairs aggregates that drifted, e.g. after reviews were changed directly in the database,
+and fills them in for reviews written before the aggregate tables existed.
+Review writes wait until the recomputation commits, so no change slips in between.
+
+Usage: python -m app.db.recompute_stats
+"""
+
+from app.db.init_db import engine
+from app.stats import recompute_professor_stats, recompute_subject_stats
+
+
+def recompute_stats(bind=engine):
+    with bind.begin() as connection:
+        connection.exec_driver_sql("lock table prof_review_table, subj_review_table in share mode")
+        connection.execute(recompute_professor_stats)
+        connection.execute(recompute_subject_stats)
+
+
+if __name__ == "__main__":
+    recompute_stats()
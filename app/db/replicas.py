@@ -0,0 +1,142 @@
+"""
+Routing of read-only sessions to the read replicas listed in DB_REPLICA_URLS.
+
+Sessions are handed out from the replicas in round robin, writes always stay on the primary.
+Every DB_REPLICA_CHECK_SECONDS each replica is asked how far its replay lags behind; an
+unreachable replica, or one more than DB_REPLICA_MAX_LAG_SECONDS behind, is skipped until a
+later check passes, and a connection error takes a replica out right away. Without a healthy
+replica, reads go to the primary.
+
+Read-your-writes: a client that wrote within READ_YOUR_WRITES_SECONDS reads from the primary.
+Clients are told apart by their access token and writes are remembered by the worker that
+served them.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.cache import LRUCache
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# seconds the replica's replay is behind the primary, 0 when it replayed everything it received
+LAG_QUERY = text("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                 "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END")
+
+RECENT_WRITERS = 10000  # clients remembered as having written lately
+
+
+def writer_key(authorization: str) -> str:
+    """
+    The token of an Authorization header, which websockets send without the Bearer scheme.
+    """
+    return authorization.rsplit(" ", 1)[-1]
+
+
+class Replica:
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.session = sessionmaker(bind=engine, class_=AsyncSession, autocommit=False, expire_on_commit=False)
+        self.healthy = True  # until a check tells otherwise
+        self.lag = None
+        self.failures = 0
+        self.reads = 0
+        event.listen(engine.sync_engine, "handle_error", self._failed)
+
+    def _failed(self, context):
+        if context.connection is None or context.is_disconnect:  # could not connect or lost the connection
+            self.healthy = False
+
+    async def _measure_lag(self) -> float:
+        async with self.engine.connect() as connection:
+            return float((await connection.execute(LAG_QUERY)).scalar() or 0)
+
+    async def check(self, timeout: float):
+        try:
+            self.lag = await asyncio.wait_for(self._measure_lag(), timeout)
+        except Exception:
+            self.failures += 1
+            if self.healthy:
+                logger.warning("Read replica %s failed its health check, reading elsewhere.", self.name,
+                               exc_info=True)
+            self.healthy = False
+            return
+        healthy = self.lag <= settings.DB_REPLICA_MAX_LAG_SECONDS
+        if healthy != self.healthy:
+            logger.warning("Read replica %s is %s, %.1f s behind.", self.name,
+                           "back in use" if healthy else "skipped", self.lag)
+        self.healthy = healthy
+
+    def statistics(self) -> dict:
+        return {
+            "host": self.engine.url.host,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "failed_checks": self.failures,
+            "reads": self.reads,
+        }
+
+
+class ReplicaSet:
+    def __init__(self, engines, primary_session):
+        self.replicas = [Replica(f"replica{index}", engine) for index, engine in enumerate(engines)]
+        self.primary_session = primary_session
+        self.primary_reads = 0
+        self.writers = LRUCache("recent_writers", RECENT_WRITERS if self.replicas else 0,
+                                settings.READ_YOUR_WRITES_SECONDS)
+        self._next = 0
+        self._check_task = None
+
+    def record_write(self, authorization: Optional[str]):
+        if authorization:
+            self.writers.set(writer_key(authorization), True)
+
+    def session_factory(self, authorization: Optional[str] = None):
+        """
+        Session factory of the next healthy replica, or of the primary for a client that wrote
+        lately or when no replica is healthy.
+        """
+        if self.replicas and not (authorization and self.writers.get(writer_key(authorization))):
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if replica.healthy:
+                    replica.reads += 1
+                    return replica.session
+        self.primary_reads += 1
+        return self.primary_session
+
+    async def check(self):
+        await asyncio.gather(*(replica.check(settings.DB_REPLICA_CHECK_SECONDS) for replica in self.replicas))
+
+    async def _check_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.check()
+
+    async def start(self, interval: float):
+        """
+        Checks the replicas once and keeps checking them every interval seconds.
+        """
+        if not self.replicas:
+            return
+        await self.check()
+        self._check_task = asyncio.create_task(self._check_periodically(interval))
+
+    async def stop(self):
+        if self._check_task is not None:
+            self._check_task.cancel()
+            self._check_task = None
+
+    def statistics(self) -> dict:
+        return {
+            "replicas": {replica.name: replica.statistics() for replica in self.replicas},
+            "primary_reads": self.primary_reads,
+        }
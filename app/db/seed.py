@@ -0,0 +1,298 @@
+"""
+Fills an empty database with a synthetic dataset for scale and load testing.
+
+At scale 1 the dataset has 200 000 users, 2 000 professors, 3 000 subjects with one to three
+teachers each, and 5 000 000 reviews of professors plus as many of subjects. Every table grows
+linearly with the scale. Popularity is skewed: the number of reviews of professors and subjects
+follows a Zipf distribution, so a few of them collect most reviews, like on the real service.
+The same seed and scale always produce the same rows.
+
+Rows are streamed to the server with COPY, table by table, in primary key order. Comment
+counts and rating aggregates are computed from the loaded reviews at the end. Seeded users
+sign in as user<id>@seed.test with the password SEED_PASSWORD.
+
+Usage: python -m app.db.seed [--scale 1] [--seed 0] [--zipf 1.0] [--photos 0.1] [--truncate]
+
+--photos gives that fraction of users a picture, drawn from PHOTO_VARIETY generated ones.
+--truncate empties every table first. Blob files of removed pictures stay on disk.
+"""
+
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+from app.blobs import blob_store
+from app.db.base import Base
+from app.db.create_schema import create_schema
+from app.db.init_db import engine
+from app.db.recompute_stats import recompute_stats
+from app.models import Blob, Professor, ProfessorReview, Relation, Subject, SubjectReview, User, UserPhoto
+from app.photos import render_variants
+from app.security.passwords import pwd_context
+
+USERS = 200_000
+PROFESSORS = 2_000
+SUBJECTS = 3_000
+MAX_TEACHERS = 3  # per subject, the garant included
+PROFESSOR_REVIEWS = 5_000_000
+SUBJECT_REVIEWS = 5_000_000
+
+SEED_PASSWORD = "password"
+PHOTO_VARIETY = 50  # distinct pictures shared by the users with a photo
+REVIEW_END = datetime(2022, 6, 1)  # a fixed date, so the dataset does not depend on the day it is loaded
+REVIEW_DAYS = 3 * 365  # reviews are spread over this many days before REVIEW_END
+DATE_POOL = 1 << 16  # distinct review timestamps to pick from
+SCORE_POOL = 1 << 6  # distinct score combinations per professor or subject
+
+COPY_CHUNK = 1 << 20
+
+FIRST_NAMES = ["Adam", "Adrian", "Alena", "Andrea", "Boris", "Dana", "David", "Eva", "Filip", "Hana",
+               "Igor", "Ivan", "Jana", "Juraj", "Katarina", "Lucia", "Marek", "Maria", "Martin", "Michal",
+               "Monika", "Natalia", "Ondrej", "Patrik", "Peter", "Roman", "Simona", "Tomas", "Viera", "Zuzana"]
+LAST_NAMES = ["Bartos", "Benko", "Hudak", "Kovac", "Kral", "Lukac", "Molnar", "Nagy", "Novak", "Olah",
+              "Polak", "Sebo", "Simko", "Stahovec", "Szacsko", "Toth", "Urban", "Varga", "Vlcek", "Zeman"]
+TOPICS = ["Algebra", "Algorithms", "Analysis", "Compilers", "Databases", "Graphics", "Logic", "Networks",
+          "Operating Systems", "Physics", "Probability", "Security", "Software Engineering", "Statistics"]
+LEVELS = ["Introduction to", "Advanced", "Applied", "Principles of", "Seminar in", "Topics in"]
+MESSAGES = ["Clear lectures and fair exams.", "Too much homework for the credits.", "Would take it again.",
+            "Hard, but you learn a lot.", "Slides are outdated.", "Very helpful during consultations.",
+            "The exam did not match the lectures.", "Interesting projects.", "Boring, but easy to pass.",
+            "One of the best courses of the programme."]
+
+
+class RowStream:
+    """
+    File-like reader over generated COPY text lines, so a table is never held in memory.
+    """
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        parts = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            parts.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = "".join(parts)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy(connection, table, columns, lines) -> int:
+    """
+    Streams lines of tab separated values into the columns of table, returns the number of rows.
+    """
+    counted = [0]
+
+    def counting():
+        for line in lines:
+            counted[0] += 1
+            yield line
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"copy {table.name} ({', '.join(columns)}) from stdin", RowStream(counting()),
+                           size=COPY_CHUNK)
+    return counted[0]
+
+
+def scaled(count: int, scale: float) -> int:
+    return max(1, round(count * scale))
+
+
+def zipf_counts(rng: random.Random, entities: int, total: int, exponent: float, cap: int) -> list:
+    """
+    Review count of every entity (index 0 is id 1). Ranks are shuffled, so popularity
+    does not follow the ids, and no entity gets more reviews than there are users.
+    """
+    ranks = list(range(1, entities + 1))
+    rng.shuffle(ranks)
+    weights = [rank ** -exponent for rank in ranks]
+    norm = total / sum(weights)
+    return [min(cap, round(weight * norm)) for weight in weights]
+
+
+def review_dates(rng: random.Random) -> list:
+    return [(REVIEW_END - timedelta(seconds=rng.randrange(REVIEW_DAYS * 86400))).isoformat(sep=" ")
+            for _ in range(DATE_POOL)]
+
+
+def user_lines(users: int, pwd: str):
+    for id in range(1, users + 1):
+        first_name = FIRST_NAMES[id % len(FIRST_NAMES)]
+        last_name = LAST_NAMES[id * 7 % len(LAST_NAMES)]
+        yield f"{id}\tuser{id}@seed.test\t{first_name}\t{last_name}\t{pwd}\tf\t0\t{id % 6}\n"
+
+
+def professor_lines(professors: int):
+    for id in range(1, professors + 1):
+        yield f"{id}\t{FIRST_NAMES[id * 3 % len(FIRST_NAMES)]}\t{LAST_NAMES[id % len(LAST_NAMES)]} {id}\n"
+
+
+def subject_lines(subjects: int, professors: int):
+    for id in range(1, subjects + 1):
+        name = f"{LEVELS[id % len(LEVELS)]} {TOPICS[id * 5 % len(TOPICS)]} {id}"
+        yield f"{id}\t{name}\tS{id}\t{(id - 1) % professors + 1}\n"
+
+
+def relation_lines(rng: random.Random, subjects: int, professors: int):
+    for subj_id in range(1, subjects + 1):
+        teachers = {(subj_id - 1) % professors + 1}  # the garant teaches the subject too
+        wanted = min(professors, rng.randint(1, MAX_TEACHERS))
+        while len(teachers) < wanted:
+            teachers.add(rng.randint(1, professors))
+        for prof_id in sorted(teachers):
+            yield f"{subj_id}\t{prof_id}\n"
+
+
+def review_lines(rng: random.Random, counts: list, users: int, dates: list, scores: int):
+    """
+    Reviews in (entity, user) order. Scores of an entity scatter around its own mean.
+    Messages, dates and scores come from pools indexed by one random number per row,
+    which keeps generation well ahead of COPY.
+    """
+    for entity_id, count in enumerate(counts, start=1):
+        mean = rng.uniform(20, 90)
+        score_pool = ["\t".join(str(min(100, max(0, round(rng.gauss(mean, 15))))) for _ in range(scores))
+                      for _ in range(SCORE_POOL)]
+        for user_id in sorted(rng.sample(range(1, users + 1), count)):
+            bits = rng.getrandbits(32)
+            yield (f"{entity_id}\t{user_id}\t{MESSAGES[(bits >> 24) % len(MESSAGES)]}\t"
+                   f"{dates[bits & (DATE_POOL - 1)]}\t{score_pool[(bits >> 16) & (SCORE_POOL - 1)]}\n")
+
+
+def sample_photo(rng: random.Random) -> bytes:
+    picture = Image.new("RGB", (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+    picture.paste(Image.frombytes("L", (320, 240), rng.randbytes(320 * 240)).convert("RGB"), (160, 120))
+    output = io.BytesIO()
+    picture.save(output, "JPEG", quality=85)
+    return output.getvalue()
+
+
+def photo_rows(rng: random.Random, users: int, fraction: float):
+    """
+    Writes the blobs of PHOTO_VARIETY pictures and assigns them to a fraction of the users.
+    Returns the user_photo_table lines and the refcount of every blob.
+    """
+    pictures = []
+    for _ in range(PHOTO_VARIETY):
+        variants = render_variants(sample_photo(rng))
+        for variant in variants:
+            blob_store.write(variant.content_hash, variant.photo)
+        pictures.append(variants)
+
+    lines = []
+    refcounts = {}
+    for user_id in sorted(rng.sample(range(1, users + 1), round(users * fraction))):
+        for variant in rng.choice(pictures):
+            lines.append(f"{user_id}\t{variant.size}\t{variant.media_type}\t{variant.content_hash}\n")
+            refcounts[variant.content_hash] = refcounts.get(variant.content_hash, 0) + 1
+    return lines, refcounts
+
+
+def truncate(connection):
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    connection.exec_driver_sql(f"truncate {tables} restart identity cascade")
+
+
+def is_empty(connection) -> bool:
+    return not connection.exec_driver_sql(
+        f"select exists (select from {User.__tablename__}) or exists (select from {Professor.__tablename__}) "
+        f"or exists (select from {Subject.__tablename__})").scalar()
+
+
+def count_comments(connection):
+    connection.exec_driver_sql(
+        f"update {User.__tablename__} u set comments = c.comments "
+        f"from (select user_id, count(*) as comments from ("
+        f"select user_id from {ProfessorReview.__tablename__} "
+        f"union all select user_id from {SubjectReview.__tablename__}) r group by user_id) c "
+        f"where u.id = c.user_id")
+
+
+def reset_sequences(connection):
+    for table in (User.__table__, Professor.__table__, Subject.__table__):
+        connection.exec_driver_sql(
+            f"select setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"coalesce((select max(id) from {table.name}), 1))")
+
+
+def seed(scale: float = 1, seed: int = 0, exponent: float = 1.0, photos: float = 0, clear: bool = False,
+         bind=engine):
+    rng = random.Random(seed)
+    users, professors, subjects = scaled(USERS, scale), scaled(PROFESSORS, scale), scaled(SUBJECTS, scale)
+
+    create_schema(bind)
+    with bind.begin() as connection:
+        if clear:
+            truncate(connection)
+        elif not is_empty(connection):
+            raise SystemExit("The database already holds users, professors or subjects, use --truncate.")
+
+    def load(table, columns, lines):
+        started = time.perf_counter()
+        connection = bind.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("set synchronous_commit to off")
+            rows = copy(connection, table, columns, lines)
+            connection.commit()
+        finally:
+            connection.close()
+        print(f"{table.name}: {rows} rows in {time.perf_counter() - started:.1f} s")
+
+    pwd = pwd_context.hash(SEED_PASSWORD)
+    dates = review_dates(rng)
+    load(User.__table__, ["id", "email", "first_name", "last_name", "pwd", "permission", "comments",
+                          "study_year"], user_lines(users, pwd))
+    load(Professor.__table__, ["id", "first_name", "last_name"], professor_lines(professors))
+    load(Subject.__table__, ["id", "name", "code", "prof_id"], subject_lines(subjects, professors))
+    load(Relation.__table__, ["subj_id", "prof_id"], relation_lines(rng, subjects, professors))
+
+    counts = zipf_counts(rng, professors, scaled(PROFESSOR_REVIEWS, scale), exponent, users)
+    load(ProfessorReview.__table__, ["prof_id", "user_id", "message", "review_date", "rating"],
+         review_lines(rng, counts, users, dates, 1))
+    counts = zipf_counts(rng, subjects, scaled(SUBJECT_REVIEWS, scale), exponent, users)
+    load(SubjectReview.__table__, ["subj_id", "user_id", "message", "review_date", "difficulty", "usability",
+                                   "prof_avg"], review_lines(rng, counts, users, dates, 3))
+
+    if photos:
+        lines, refcounts = photo_rows(rng, users, photos)
+        load(Blob.__table__, ["content_hash", "refcount"],
+             (f"{digest}\t{refcount}\n" for digest, refcount in sorted(refcounts.items())))
+        load(UserPhoto.__table__, ["user_id", "size", "media_type", "content_hash"], iter(lines))
+
+    started = time.perf_counter()
+    with bind.begin() as connection:
+        count_comments(connection)
+        reset_sequences(connection)
+    recompute_stats(bind)
+    with bind.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").exec_driver_sql("analyze")
+    print(f"comments, rating aggregates and planner statistics in {time.perf_counter() - started:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1, help="multiplies the size of every table")
+    parser.add_argument("--seed", type=int, default=0, help="the same seed produces the same dataset")
+    parser.add_argument("--zipf", type=float, default=1.0,
+                        help="exponent of the review popularity, higher concentrates reviews on fewer entities")
+    parser.add_argument("--photos", type=float, default=0, help="fraction of users with a picture")
+    parser.add_argument("--truncate", action="store_true", help="empty every table before seeding")
+    arguments = parser.parse_args()
+    seed(arguments.scale, arguments.seed, arguments.zipf, arguments.photos, arguments.truncate)
+
+
+if __name__ == "__main__":
+    main()
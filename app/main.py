@@ -1,20 +1,41 @@
 from fastapi import FastAPI
-from .routers import prof, subj, login, register, search, profile
+from fastapi.responses import PlainTextResponse
+from .routers import prof, subj, login, register, search, profile, monitoring
 from fastapi.middleware.cors import CORSMiddleware
 
+from . import metrics
+from .db.database import replica_set
+from .db.init_db import engine, async_engine, replica_engines
+from .db.query_log import QueryLogMiddleware
+from .pagination import CURSOR_HEADER
+from .photos import photo_executor
+from .response_cache import response_cache
+from .serialization import FastJSONResponse
+from .security.passwords import hashing_pool
+from .search.index import search_index
+from .settings import settings
+from .uploads import UploadLimitMiddleware, upload_limits
+
 # SOURCE: https://fastapi.tiangolo.com/tutorial/metadata/
 from app.metadata import *
 
 
-app = FastAPI(openapi_tags=tags_metadata)
+app = FastAPI(openapi_tags=tags_metadata, default_response_class=FastJSONResponse)
 
+app.add_middleware(UploadLimitMiddleware, limits=upload_limits())
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
     allow_origins=["*"],
+    expose_headers=[CURSOR_HEADER, "ETag"],
 )
+if settings.SLOW_QUERY_SECONDS or settings.REPEATED_QUERY_THRESHOLD:
+    app.add_middleware(QueryLogMiddleware, root_app=app)
+if settings.METRICS_ENABLED:
+    # added last so it is the outermost middleware and its timings include the others
+    app.add_middleware(metrics.MetricsMiddleware, root_app=app)
 
 app.include_router(prof.router)
 app.include_router(subj.router)
@@ -22,9 +43,44 @@ app.include_router(login.router)
 app.include_router(register.router)
 app.include_router(search.router)
 app.include_router(profile.router)
+app.include_router(monitoring.router)
 
 
 @app.get("/")
 async def root():
     return {"message": "MTAA Project by Adrian Szacsko and Marko Stahovec"}
 
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Prometheus scrape endpoint, counters are per worker.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.on_event("startup")
+async def load_search_index():
+    if settings.SEARCH_BACKEND == "index":
+        await search_index.start(settings.SEARCH_INDEX_REFRESH_SECONDS)
+
+
+@app.on_event("startup")
+async def check_replicas():
+    await replica_set.start(settings.DB_REPLICA_CHECK_SECONDS)
+
+
+@app.on_event("shutdown")
+async def dispose_engines():
+    """
+    Closes pooled connections and worker threads when the worker stops.
+    """
+    await search_index.stop()
+    await replica_set.stop()
+    photo_executor.shutdown(wait=False)
+    hashing_pool.shutdown()
+    await response_cache.close()
+    await async_engine.dispose()
+    for replica_engine in replica_engines:
+        await replica_engine.dispose()
+    engine.dispose()
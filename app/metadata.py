@@ -36,4 +36,8 @@ tags_metadata = [
         "name": "Profile",
         "description": "All endpoints related to user profiles."
     },
+    {
+        "name": "Monitoring",
+        "description": "Runtime statistics of the service, intended for monitoring tools."
+    },
 ]
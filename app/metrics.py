@@ -0,0 +1,240 @@
+"""
+Request and database metrics in the Prometheus text format, served at /metrics.
+
+MetricsMiddleware times every request by route template and status code and counts websocket
+messages. Engine events attribute the queries a request runs, their database time and rows,
+to that request through a context variable, which also reaches the greenlets the async
+engine runs its cursors in. Updating a metric is a few dictionary operations, cheap enough
+to stay enabled in production.
+"""
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+UNMATCHED = "unmatched"  # requests no route matched, kept apart to bound the number of series
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = {}  # label values -> value
+        registry.append(self)
+
+    def labels(self, values, names=None) -> str:
+        if not values:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+        pairs = zip(names or self.labelnames, escaped)
+        return "{" + ",".join(f"{name}=\"{value}\"" for name, value in pairs) + "}"
+
+    def samples(self):
+        for values, value in self.values.items():
+            yield f"{self.name}{self.labels(values)} {value}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, values=(), amount: float = 1):
+        self.values[values] = self.values.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labelnames=(), collect=None):
+        super().__init__(name, description, labelnames)
+        self.collect = collect  # returns {label values: value} at scrape time, instead of inc/dec
+
+    def inc(self, values=(), amount: float = 1):
+        self.values[values] = self.values.get(values, 0) + amount
+
+    def dec(self, values=(), amount: float = 1):
+        self.inc(values, -amount)
+
+    def samples(self):
+        if self.collect is not None:
+            self.values = self.collect()
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = buckets
+
+    def observe(self, values, value: float):
+        series = self.values.get(values)
+        if series is None:
+            series = self.values[values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1  # the bucket whose bound is the first >= value
+        series[1] += value
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for values, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{self.labels(values + (bound,), names)} {cumulative}"
+            yield f"{self.name}_sum{self.labels(values)} {total}"
+            yield f"{self.name}_count{self.labels(values)} {cumulative}"
+
+
+registry = []
+
+request_duration = Histogram("http_request_duration_seconds", "Time to answer a request.",
+                             ("method", "route", "status"))
+requests_in_flight = Gauge("http_requests_in_flight", "Requests being answered.")
+request_queries = Histogram("http_request_db_queries", "Database queries run by one request.",
+                            ("method", "route"), QUERY_BUCKETS)
+request_db_time = Histogram("http_request_db_seconds", "Time one request spent waiting for the database.",
+                            ("method", "route"))
+request_rows = Histogram("http_request_db_rows", "Rows returned or changed by the queries of one request.",
+                         ("method", "route"), ROW_BUCKETS)
+queries_total = Counter("db_queries_total", "Database queries, including those run outside requests.")
+query_seconds_total = Counter("db_query_seconds_total", "Time spent waiting for database queries.")
+websocket_connections = Gauge("websocket_connections", "Open websockets.", ("route",))
+websocket_messages = Counter("websocket_messages_total", "Websocket messages.", ("route", "direction"))
+
+
+class RequestCost:
+    __slots__ = ("queries", "seconds", "rows")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+# cost of the request the current task is answering, None outside requests
+current_cost: ContextVar[Optional[RequestCost]] = ContextVar("current_cost", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["metrics_started"].pop()
+    queries_total.inc()
+    query_seconds_total.inc(amount=duration)
+    cost = current_cost.get()
+    if cost is not None:
+        rows = cursor.rowcount
+        if rows < 0:  # asyncpg reports no count for SELECT, its cursor holds the fetched rows
+            rows = len(getattr(cursor, "_rows", None) or ())
+        cost.queries += 1
+        cost.seconds += duration
+        cost.rows += rows
+
+
+def instrument_engine(engine):
+    """
+    Counts the queries of a (sync) engine, pass async_engine.sync_engine for the async one.
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+route_templates = {}  # endpoint function -> path of its route, filled on first use
+
+
+def route_template(app, scope) -> str:
+    """
+    Path of the matched route, e.g. /prof/{prof_id}, read from the endpoint the router put in the scope.
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED
+    if endpoint not in route_templates:
+        route_templates.update((route.endpoint, route.path) for route in app.routes if hasattr(route, "endpoint"))
+    return route_templates.get(endpoint, UNMATCHED)
+
+
+class MetricsMiddleware:
+    def __init__(self, app, root_app=None):
+        self.app = app
+        self.root_app = root_app  # the FastAPI application whose routes name the series
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def http(self, scope, receive, send):
+        status = 500  # unless a response starts, the request failed
+        cost = RequestCost()
+        token = current_cost.set(cost)
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            duration = time.perf_counter() - started
+            requests_in_flight.dec()
+            current_cost.reset(token)
+            route = route_template(self.root_app, scope)
+            request_duration.observe((scope["method"], route, status), duration)
+            request_queries.observe((scope["method"], route), cost.queries)
+            request_db_time.observe((scope["method"], route), cost.seconds)
+            request_rows.observe((scope["method"], route), cost.rows)
+
+    async def websocket(self, scope, receive, send):
+        accepted = False
+        route = None
+
+        async def counted_receive():
+            message = await receive()
+            if message["type"] == "websocket.receive":
+                websocket_messages.inc((route or route_template(self.root_app, scope), "received"))
+            return message
+
+        async def counted_send(message):
+            nonlocal accepted, route
+            if message["type"] == "websocket.accept":
+                accepted = True
+                route = route_template(self.root_app, scope)
+                websocket_connections.inc((route,))
+            elif message["type"] == "websocket.send":
+                websocket_messages.inc((route, "sent"))
+            await send(message)
+
+        try:
+            await self.app(scope, counted_receive, counted_send)
+        finally:
+            if accepted:
+                websocket_connections.dec((route,))
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
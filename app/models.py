@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, Boolean, ForeignKey, SmallInteger, text
-from sqlalchemy.dialects.postgresql import BYTEA
+from sqlalchemy import Column, Integer, BigInteger, Boolean, ForeignKey, SmallInteger, Index, DDL, event, func, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.sql.sqltypes import TIMESTAMP, VARCHAR, TEXT
 
 from .db.base import Base
@@ -11,16 +11,43 @@ class User(Base):
     # no documentation on whether nullable is False on default
     id = Column(Integer, primary_key=True, nullable=False)
 
-    email = Column(VARCHAR(30), unique=True, nullable=False)
+    email = Column(VARCHAR(40), unique=True, nullable=False)  # the length register accepts
     first_name = Column(VARCHAR(20), nullable=False)
     last_name = Column(VARCHAR(20), nullable=False)
-    pwd = Column(VARCHAR(30), nullable=False)
+    pwd = Column(VARCHAR(100), nullable=False)  # bcrypt hashes are 60 characters long
     permission = Column(Boolean, nullable=False, default=False)  # TODO admin permission, could be Enum
     comments = Column(Integer, nullable=False, default=0)
     reg_date = Column(TIMESTAMP(timezone=False), nullable=False, server_default=text('now()'))
     study_year = Column(SmallInteger, nullable=False)
-    # photo = bytes
-    photo = Column(BYTEA, nullable=True)
+    # the photo lives in user_photo_table, so loading a user never drags it along
+
+    __table_args__ = (
+        # search indexes, the expression must match the one used by app.search.trigram
+        Index("ix_user_table_name_trgm", func.lower(first_name + " " + last_name).label("name"),
+              postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_user_table_name_prefix", func.lower(first_name + " " + last_name).label("name"),
+              postgresql_ops={"name": "text_pattern_ops"}),
+        # login and registration compare emails case-insensitively
+        Index("ix_user_table_lower_email", func.lower(email)),
+    )
+
+
+class UserPhoto(Base):
+    __tablename__ = "user_photo_table"
+
+    user_id = Column(Integer, ForeignKey("user_table.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    size = Column(SmallInteger, primary_key=True, nullable=False, server_default=text("0"))  # 0 is the upload as sent
+
+    media_type = Column(VARCHAR(20), nullable=False)
+    content_hash = Column(VARCHAR(64), nullable=False)  # sha256 of the image, names its blob and is served as the ETag
+
+
+class Blob(Base):
+    __tablename__ = "blob_table"
+
+    # contents live in the blob store (app.blobs), here only the number of rows referring to them
+    content_hash = Column(VARCHAR(64), primary_key=True, nullable=False)
+    refcount = Column(Integer, nullable=False, server_default=text("0"))
 
 
 class Professor(Base):
@@ -33,6 +60,13 @@ class Professor(Base):
 
     # TODO FOREIGN KEY FOR SUBJECT????
 
+    __table_args__ = (
+        Index("ix_professor_table_name_trgm", func.lower(first_name + " " + last_name).label("name"),
+              postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_professor_table_name_prefix", func.lower(first_name + " " + last_name).label("name"),
+              postgresql_ops={"name": "text_pattern_ops"}),
+    )
+
 
 class Subject(Base):
     __tablename__ = "subject_table"
@@ -44,6 +78,19 @@ class Subject(Base):
 
     prof_id = Column(Integer, ForeignKey("professor_table.id", ondelete="CASCADE"), nullable=False,)
 
+    __table_args__ = (
+        Index("ix_subject_table_name_trgm", func.lower(name).label("name"),
+              postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_subject_table_code_trgm", func.lower(code).label("code"),
+              postgresql_using="gin", postgresql_ops={"code": "gin_trgm_ops"}),
+        Index("ix_subject_table_name_prefix", func.lower(name).label("name"),
+              postgresql_ops={"name": "text_pattern_ops"}),
+        Index("ix_subject_table_code_prefix", func.lower(code).label("code"),
+              postgresql_ops={"code": "text_pattern_ops"}),
+        # subjects guaranteed by a professor
+        Index("ix_subject_table_prof_id", prof_id),
+    )
+
 
 class Relation(Base):
     __tablename__ = "relation_table"
@@ -51,6 +98,11 @@ class Relation(Base):
     subj_id = Column(Integer, ForeignKey("subject_table.id", ondelete="CASCADE"), primary_key=True, nullable=False)
     prof_id = Column(Integer, ForeignKey("professor_table.id", ondelete="CASCADE"), primary_key=True, nullable=False)
 
+    __table_args__ = (
+        # the primary key starts with subj_id, this one serves joins from professors
+        Index("ix_relation_table_prof_id", prof_id),
+    )
+
 
 class SubjectReview(Base):
     __tablename__ = "subj_review_table"
@@ -64,6 +116,13 @@ class SubjectReview(Base):
     usability = Column(SmallInteger, nullable=False)
     prof_avg = Column(SmallInteger, nullable=False)
 
+    __table_args__ = (
+        # keyset pagination of a subject's reviews, newest first
+        Index("ix_subj_review_table_subj_id_review_date", subj_id, review_date, user_id),
+        # an author's reviews, read when the profile is deleted
+        Index("ix_subj_review_table_user_id_review_date", user_id, review_date),
+    )
+
 
 class ProfessorReview(Base):
     __tablename__ = "prof_review_table"
@@ -75,3 +134,43 @@ class ProfessorReview(Base):
     review_date = Column(TIMESTAMP(timezone=False), nullable=False, server_default=text('now()'))
     rating = Column(SmallInteger, nullable=False)
 
+    __table_args__ = (
+        # keyset pagination of a professor's reviews, newest first
+        Index("ix_prof_review_table_prof_id_review_date", prof_id, review_date, user_id),
+        # an author's reviews, read when the profile is deleted
+        Index("ix_prof_review_table_user_id_review_date", user_id, review_date),
+    )
+
+
+# Rating aggregates, kept in step with the review tables by the review handlers.
+# Ratings are 0 to 100, histogram bucket i counts ratings from 10 * i to 10 * i + 9, the last one includes 100.
+HISTOGRAM_BUCKETS = 10
+EMPTY_HISTOGRAM = "{" + ",".join("0" * HISTOGRAM_BUCKETS) + "}"
+
+
+class ProfessorStats(Base):
+    __tablename__ = "prof_stats_table"
+
+    prof_id = Column(Integer, ForeignKey("professor_table.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+
+    review_count = Column(Integer, nullable=False, server_default=text("0"))
+    rating_sum = Column(BigInteger, nullable=False, server_default=text("0"))
+    rating_histogram = Column(ARRAY(Integer), nullable=False, server_default=text(f"'{EMPTY_HISTOGRAM}'"))
+
+
+class SubjectStats(Base):
+    __tablename__ = "subj_stats_table"
+
+    subj_id = Column(Integer, ForeignKey("subject_table.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+
+    review_count = Column(Integer, nullable=False, server_default=text("0"))
+    difficulty_sum = Column(BigInteger, nullable=False, server_default=text("0"))
+    difficulty_histogram = Column(ARRAY(Integer), nullable=False, server_default=text(f"'{EMPTY_HISTOGRAM}'"))
+    usability_sum = Column(BigInteger, nullable=False, server_default=text("0"))
+    usability_histogram = Column(ARRAY(Integer), nullable=False, server_default=text(f"'{EMPTY_HISTOGRAM}'"))
+    prof_avg_sum = Column(BigInteger, nullable=False, server_default=text("0"))
+    prof_avg_histogram = Column(ARRAY(Integer), nullable=False, server_default=text(f"'{EMPTY_HISTOGRAM}'"))
+
+
+# trigram operator classes used by the search indexes
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
@@ -0,0 +1,90 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, Response
+from starlette.status import HTTP_400_BAD_REQUEST
+
+# the list stays the response body, the cursor of the following page travels in this header
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values) -> str:
+    """
+    Wraps JSON serializable keyset values into an opaque, url safe string.
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (ValueError, RecursionError):  # RecursionError for deeply nested JSON
+        raise invalid_cursor()
+
+
+def invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=HTTP_400_BAD_REQUEST,
+        detail="Invalid cursor.",
+    )
+
+
+def set_next_cursor(response: Response, values):
+    """
+    Publishes the cursor of the following page, nothing is set on the last page.
+    """
+    if values is not None:
+        response.headers[CURSOR_HEADER] = encode_cursor(values)
+
+
+def review_cursor(row):
+    """
+    Keyset of a review listing, ordered by review_date and the author's part of the primary key.
+    """
+    return [row.review_date.isoformat(), row.user_id]
+
+
+def decode_review_cursor(cursor: str):
+    try:
+        review_date, user_id = decode_cursor(cursor)
+        return datetime.fromisoformat(review_date), int(user_id)
+    except (TypeError, ValueError):
+        raise invalid_cursor()
+
+
+def search_digest(search_string: str) -> str:
+    return hashlib.sha1(search_string.encode()).hexdigest()[:12]
+
+
+def search_cursor(search_string: str, after):
+    """
+    Keyset of a search page: the last key of every entity type that has more results,
+    bound to the search string it was produced for.
+    """
+    if after is None:
+        return None
+    return {"q": search_digest(search_string), "after": after}
+
+
+def is_search_key(key) -> bool:
+    """
+    Whether key has the form of a key the searches produce: the entity id, preceded by at most two
+    ranking values, texts or numbers, e.g. [id], [score, id] or [0, text, id].
+    """
+    if not isinstance(key, list) or not 1 <= len(key) <= 3:
+        return False
+    *ranking, entity_id = key
+    return type(entity_id) is int and all(type(value) in (str, int, float) for value in ranking)
+
+
+def decode_search_cursor(cursor: str, search_string: str):
+    values = decode_cursor(cursor)
+    if not isinstance(values, dict) or values.get("q") != search_digest(search_string) \
+            or not isinstance(values.get("after"), dict) \
+            or not all(is_search_key(key) for key in values["after"].values()):
+        raise invalid_cursor()
+    return values["after"]
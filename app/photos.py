@@ -0,0 +1,93 @@
+"""
+Profile picture variants.
+
+An upload is stored as sent (size 0) together with downscaled copies for lists and avatars.
+Rendering happens once, at upload time, in a small worker pool so the event loop keeps serving.
+"""
+
+import asyncio
+import hashlib
+import io
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from .settings import settings
+
+ORIGINAL = 0
+PHOTO_SIZES = (64, 256)  # longest edge of the rendered variants, in pixels
+
+Variant = namedtuple("Variant", ["size", "media_type", "content_hash", "photo"])
+
+photo_executor = ThreadPoolExecutor(max_workers=settings.PHOTO_WORKERS, thread_name_prefix="photo")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def render_variants(data: bytes) -> list:
+    """
+    Returns the original and one re-encoded variant per entry of PHOTO_SIZES.
+    Images with transparency stay PNG, everything else becomes JPEG.
+    Raises an OSError subclass when the data is not an image Pillow can read
+    and ValueError when it is corrupt or would decode to more than PHOTO_MAX_PIXELS.
+    """
+    try:
+        Image.open(io.BytesIO(data)).verify()  # structure and checksums, without decoding pixels
+    except (SyntaxError, Image.DecompressionBombError) as error:  # how Pillow reports broken and huge files
+        raise ValueError(str(error)) from error
+
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if width * height > settings.PHOTO_MAX_PIXELS:
+        raise ValueError("Image is too large to decode.")
+    variants = [Variant(ORIGINAL, f"image/{image.format.lower()}", content_hash(data), data)]
+
+    # JPEG decodes straight at a reduced scale that still covers the largest variant
+    image.draft("RGB", (max(PHOTO_SIZES), max(PHOTO_SIZES)))
+    image.load()
+    transparent = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if transparent else "RGB")
+
+    for size in PHOTO_SIZES:
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        encoded = io.BytesIO()
+        if transparent:
+            resized.save(encoded, format="PNG", optimize=True)
+        else:
+            resized.save(encoded, format="JPEG", quality=85, optimize=True)
+        rendered = encoded.getvalue()
+        variants.append(Variant(size, "image/png" if transparent else "image/jpeg", content_hash(rendered), rendered))
+    return variants
+
+
+async def render_variants_async(data: bytes) -> list:
+    return await asyncio.get_running_loop().run_in_executor(photo_executor, render_variants, data)
+
+
+def pick_variant(sizes, requested):
+    """
+    Chooses the smallest stored variant at least as large as requested, the original when
+    nothing was requested or no variant is large enough.
+    """
+    if requested:
+        larger = sorted(size for size in sizes if size != ORIGINAL and size >= requested)
+        if larger:
+            return larger[0]
+    return ORIGINAL
+
+
+def etag(digest: str) -> str:
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, current: str) -> bool:
+    if not if_none_match:
+        return False
+    # weak comparison, as If-None-Match requires
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    candidates = [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
+    return "*" in candidates or current in candidates
@@ -0,0 +1,300 @@
+"""
+Cache of serialized responses of the read endpoints.
+
+Responses are grouped per entity: every entity key (see prof_key, subj_key, profile_key) holds
+the responses derived from that entity in separate fields, e.g. every page of a review listing.
+Writes drop whole keys, so one invalidation covers every page and limit. Entries also expire
+after RESPONSE_CACHE_TTL, which bounds staleness after changes made outside the API.
+
+A response read before an invalidation of its key is not stored after it: routes take a
+generation before querying and store skips the response when the key was invalidated since.
+A key is also not cached again for READ_YOUR_WRITES_SECONDS after this worker invalidated it,
+so a read replica still missing the write cannot put the old response back. Both only know the
+invalidations of this worker; with the redis backend, a response read while another worker
+invalidates its key can still be stored, RESPONSE_CACHE_TTL bounds how long it is served.
+Review pages past the first are not cached, so the fields of a key stay bounded by the limits
+a client can ask for.
+
+The store is pluggable: "memory" keeps a per-worker LRU, "redis" talks the Redis protocol
+to a server shared by all workers, "none" disables caching.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlparse
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from starlette.responses import Response
+
+from .cache import LRUCache
+from .serialization import dumps, project
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERY_SECONDS = 30  # responses whose queries took longer are not cached
+
+
+def prof_key(prof_id: int) -> str:
+    return f"prof:{prof_id}"
+
+
+def prof_reviews_key(prof_id: int) -> str:
+    return f"prof:{prof_id}:reviews"
+
+
+def subj_key(subj_id: int) -> str:
+    return f"subj:{subj_id}"
+
+
+def subj_reviews_key(subj_id: int) -> str:
+    return f"subj:{subj_id}:reviews"
+
+
+def profile_key(user_id: int) -> str:
+    return f"profile:{user_id}"
+
+
+class MemoryBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries = LRUCache("response", maxsize, ttl)  # key -> {field: value}
+
+    async def get(self, key: str, field: str) -> Optional[bytes]:
+        fields = self._entries.get(key)
+        return fields.get(field) if fields is not None else None
+
+    async def set(self, key: str, field: str, value: bytes, ttl: float):
+        fields = self._entries.get(key)
+        if fields is None:
+            fields = {}
+            self._entries.set(key, fields, ttl=ttl)
+        fields[field] = value
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend:
+    """
+    Minimal Redis protocol (RESP2) client: entity keys are hashes, fields are responses.
+    Connections are opened lazily and reused, at most pool_size at a time.
+    """
+
+    def __init__(self, url: str, pool_size: int, timeout: float):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.database = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    @staticmethod
+    def encode(*arguments) -> bytes:
+        parts = [b"*%d\r\n" % len(arguments)]
+        for argument in arguments:
+            if not isinstance(argument, bytes):
+                argument = str(argument).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(argument), argument))
+        return b"".join(parts)
+
+    @classmethod
+    async def read_reply(cls, reader: asyncio.StreamReader):
+        line = await reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            return None if length < 0 else (await reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [await cls.read_reply(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply {line!r}.")
+
+    @classmethod
+    async def read_replies(cls, reader: asyncio.StreamReader, count: int) -> list:
+        # one after the other, a StreamReader serves a single reader at a time
+        return [await cls.read_reply(reader) for _ in range(count)]
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.database:
+            setup.append(("SELECT", self.database))
+        if setup:
+            writer.write(b"".join(self.encode(*command) for command in setup))
+            for _ in setup:
+                await self.read_reply(reader)
+        return reader, writer
+
+    async def execute(self, *commands):
+        """
+        Sends the commands in one pipeline and returns their replies.
+        """
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(self._connect(), self.timeout)
+                reader, writer = connection
+                writer.write(b"".join(self.encode(*command) for command in commands))
+                replies = await asyncio.wait_for(self.read_replies(reader, len(commands)), self.timeout)
+            except BaseException:
+                if connection is not None:  # the stream may hold a partial reply, never reuse it
+                    connection[1].close()
+                raise
+            self._idle.append(connection)
+            return replies
+
+    async def get(self, key: str, field: str) -> Optional[bytes]:
+        (value,) = await self.execute(("HGET", key, field))
+        return value
+
+    async def set(self, key: str, field: str, value: bytes, ttl: float):
+        await self.execute(("HSET", key, field, value), ("PEXPIRE", key, int(ttl * 1000)))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.execute(("DEL", *keys))
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float, quiet_period: float = 0):
+        self.backend = backend
+        self.ttl = ttl
+        self.quiet_period = quiet_period
+        # invalidations are remembered this long, responses read from the database for longer are not cached
+        self.memory = max(quiet_period, MAX_QUERY_SECONDS)
+        self.routes = {}  # route name -> {"hits": n, "misses": n}
+        self._invalidated = OrderedDict()  # key -> time of its latest invalidation, oldest first
+
+    def generation(self) -> float:
+        """
+        Taken before the database is queried for a response and passed to store, which skips caching
+        the response when its key was invalidated meanwhile.
+        """
+        return time.monotonic()
+
+    def _forget_invalidations(self, now: float):
+        while self._invalidated and next(iter(self._invalidated.values())) <= now - self.memory:
+            self._invalidated.popitem(last=False)
+
+    def _cacheable(self, key: str, generation: float) -> bool:
+        now = time.monotonic()
+        if now - generation >= self.memory:  # an invalidation since then may be forgotten already
+            return False
+        invalidated = self._invalidated.get(key)
+        return invalidated is None or (invalidated < generation and now - invalidated >= self.quiet_period)
+
+    def _count(self, route: str, outcome: str):
+        counters = self.routes.setdefault(route, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    async def get(self, route: str, key: str, field: Optional[str]) -> Optional[Response]:
+        """
+        Returns the cached response or None. An unreachable store counts as a miss,
+        a field of None marks a response that is never cached.
+        """
+        if self.backend is None or field is None:
+            return None
+        try:
+            cached = await self.backend.get(key, field)
+        except Exception:
+            logger.warning("Response cache read failed.", exc_info=True)
+            cached = None
+        if cached is None:
+            self._count(route, "misses")
+            return None
+        self._count(route, "hits")
+        headers, body = cached.split(b"\n", 1)
+        return Response(content=body, media_type="application/json", headers=json.loads(headers))
+
+    async def store(self, key: str, field: Optional[str], generation: float, response_model, content,
+                    headers: dict = None) -> Response:
+        """
+        Serializes content the way the route's response_model would, caches it and returns the response.
+        """
+        body = dumps(jsonable_encoder(parse_obj_as(response_model, content)))
+        return await self._store(key, field, generation, body, headers)
+
+    async def store_rows(self, key: str, field: Optional[str], generation: float, model, rows,
+                         headers: dict = None) -> Response:
+        """
+        Like store for a response_model of List[model], for rows whose columns already have the
+        types of the model's fields: they are projected onto the model without validating them.
+        """
+        return await self._store(key, field, generation, dumps(project(rows, model)), headers)
+
+    async def _store(self, key: str, field: Optional[str], generation: float, body: bytes,
+                     headers: dict = None) -> Response:
+        headers = dict(headers or {})
+        if self.backend is not None and field is not None and self._cacheable(key, generation):
+            try:
+                await self.backend.set(key, field, json.dumps(headers).encode() + b"\n" + body, self.ttl)
+            except Exception:
+                logger.warning("Response cache write failed.", exc_info=True)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    async def invalidate(self, *keys: str):
+        """
+        Drops every cached response of the given entity keys, call it after the change is committed.
+        """
+        if self.backend is None or not keys:
+            return
+        now = time.monotonic()
+        self._forget_invalidations(now)
+        for key in keys:
+            self._invalidated[key] = now
+            self._invalidated.move_to_end(key)
+        try:
+            await self.backend.delete(*keys)
+        except Exception:
+            logger.error("Response cache invalidation failed, entries expire after %s s.", self.ttl, exc_info=True)
+
+    def statistics(self) -> dict:
+        routes = {}
+        for route, counters in self.routes.items():
+            lookups = counters["hits"] + counters["misses"]
+            routes[route] = dict(counters, hit_rate=round(counters["hits"] / lookups, 4) if lookups else None)
+        return {"backend": settings.RESPONSE_CACHE_BACKEND, "routes": routes,
+                "recently_invalidated": len(self._invalidated)}
+
+    async def close(self):
+        if isinstance(self.backend, RedisBackend):
+            await self.backend.close()
+
+
+def create_backend():
+    if settings.RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryBackend(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL)
+    if settings.RESPONSE_CACHE_BACKEND == "redis":
+        return RedisBackend(settings.RESPONSE_CACHE_URL, settings.RESPONSE_CACHE_POOL_SIZE,
+                            settings.RESPONSE_CACHE_TIMEOUT)
+    if settings.RESPONSE_CACHE_BACKEND == "none":
+        return None
+    raise ValueError(f"Unknown response cache backend {settings.RESPONSE_CACHE_BACKEND!r}.")
+
+
+response_cache = ResponseCache(create_backend(), settings.RESPONSE_CACHE_TTL, settings.READ_YOUR_WRITES_SECONDS)
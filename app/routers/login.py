@@ -5,16 +5,16 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.status import HTTP_200_OK
 
 from ..schemas.auth_schema import Token
-from ..db.database import create_connection
+from ..db.database import async_create_connection
 from ..settings import settings
 from ..security import auth
 from ..models import User
-from ..security.passwords import verify_password
+from ..security.passwords import verify_and_update_password
 
 router = APIRouter(
     prefix="/login",
@@ -24,9 +24,10 @@ router = APIRouter(
 
 @router.post("/", response_model=Token, status_code=HTTP_200_OK,
              summary="Simple login form with password verification and token creation.",
-             responses={403: {"description": "Incorrect credentials."}})
+             responses={403: {"description": "Incorrect credentials."},
+                        503: {"description": "Too many password checks in progress."}})
 async def login(form_data: OAuth2PasswordRequestForm = Depends(),
-                db: Session = Depends(create_connection)):
+                db: AsyncSession = Depends(async_create_connection)):
     """
         Input parameters:
         - **username**: user's email
@@ -38,19 +39,28 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(),
         - **token_type**: type of token
     """
 
-    user = db.query(User).filter(User.email == form_data.username).first()  # queries registered user
+    # emails differing only in case were registered before registration compared them case-insensitively,
+    # the one typed exactly wins
+    result = await db.execute(select(User).filter(func.lower(User.email) == form_data.username.lower())
+                              .order_by((User.email == form_data.username).desc(), User.id))
+    user = result.scalars().first()  # queries registered user
     if not user:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Incorrect username or password."
         )
 
-    if not verify_password(form_data.password, user.pwd):
+    verified, new_hash = await verify_and_update_password(form_data.password, user.pwd)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Incorrect username or password."
         )
 
+    if new_hash is not None:  # hashed with an outdated cost, replaced while the password is at hand
+        await db.execute(update(User).filter(User.id == user.id).values(pwd=new_hash))
+        await db.commit()
+
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"user_id": user.id}, expires_delta=access_token_expires
@@ -0,0 +1,114 @@
+from fastapi import APIRouter, Depends
+from starlette.status import HTTP_200_OK
+
+from ..cache import cache_statistics
+from ..connections import socket_manager
+from ..db.database import replica_set
+from ..db.init_db import pool_statistics
+from ..response_cache import response_cache
+from ..security import auth
+from ..security.passwords import hashing_pool
+
+# statistics name hosts and internals of the deployment, only admins may read them
+router = APIRouter(
+    prefix="/monitoring",
+    tags=["Monitoring"],
+    dependencies=[Depends(auth.get_current_admin)],
+    responses={401: {"description": "Not authorized to perform this action."},
+               403: {"description": "Permission denied."}}
+)
+
+
+@router.get("/pool", status_code=HTTP_200_OK,
+            summary="Retrieves live database connection pool statistics.")
+async def get_pool_statistics():
+    """
+        Response values, for the sync and the async pool and every read replica's pool:
+
+        - **size**: configured number of persistent connections
+        - **checked_in**: idle connections waiting in the pool
+        - **checked_out**: connections currently in use
+        - **overflow**: connections opened above the pool size
+        - **checkouts**: number of served checkouts
+        - **wait_avg_ms**: average time spent waiting for a connection
+        - **wait_max_ms**: longest time spent waiting for a connection
+        - **timeouts**: checkouts that gave up after the pool timeout
+    """
+    return pool_statistics()
+
+
+@router.get("/cache", status_code=HTTP_200_OK,
+            summary="Retrieves in-memory cache statistics.")
+async def get_cache_statistics():
+    """
+        Response values, for every cache by its name:
+
+        - **size**: number of cached entries
+        - **maxsize**: capacity of the cache
+        - **hits**: lookups answered from the cache
+        - **misses**: lookups that had to load the value
+        - **hit_rate**: share of hits among all lookups
+        - **evictions**: entries dropped to make room for new ones
+    """
+    return cache_statistics()
+
+
+@router.get("/hashing", status_code=HTTP_200_OK,
+            summary="Retrieves password hashing pool statistics.")
+async def get_hashing_statistics():
+    """
+        Response values:
+
+        - **workers**: threads running bcrypt
+        - **in_flight**: hash calls running or waiting
+        - **queue_depth**: hash calls waiting for a free thread
+        - **completed**: finished hash calls
+        - **rejected**: calls refused because the queue was full
+        - **wait_avg_ms**: average time a call waited for a thread
+        - **wait_max_ms**: longest time a call waited for a thread
+        - **run_avg_ms**: average duration of one bcrypt call
+    """
+    return hashing_pool.statistics()
+
+
+@router.get("/websockets", status_code=HTTP_200_OK,
+            summary="Retrieves open websocket statistics.")
+async def get_websocket_statistics():
+    """
+        Response values:
+
+        - **active**: open sockets of this worker
+        - **users**: users with at least one open socket
+        - **max_sockets**: limit of open sockets per worker
+        - **max_per_user**: limit of open sockets per user
+        - **opened**: sockets accepted so far
+        - **rejected**: sockets refused because of a limit
+        - **reaped_idle**: sockets closed after a period without searches
+        - **reaped_dead**: sockets closed because the client stopped answering pings
+    """
+    return socket_manager.statistics()
+
+
+@router.get("/response_cache", status_code=HTTP_200_OK,
+            summary="Retrieves response cache statistics per route.")
+async def get_response_cache_statistics():
+    """
+        Response values:
+
+        - **backend**: configured cache store
+        - **routes**: hits, misses and hit_rate of every cached route
+    """
+    return response_cache.statistics()
+
+
+@router.get("/replicas", status_code=HTTP_200_OK,
+            summary="Retrieves read replica health and routing statistics.")
+async def get_replica_statistics():
+    """
+        Response values:
+
+        - **replicas**: for every configured read replica its host, whether it is healthy,
+        lag_seconds measured by the last check, failed_checks and the reads routed to it
+        - **primary_reads**: reads served by the primary, after a client's write or without a healthy replica
+    """
+    return replica_set.statistics()
@@ -1,15 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from starlette.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_200_OK, \
     HTTP_403_FORBIDDEN
 
 from .profile import increment_comment, decrement_comment
-from ..schemas import prof_schema
-from ..db.database import create_connection
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from ..schemas import prof_schema, stats_schema
+from ..db.database import async_create_connection, async_read_connection
+from ..db.errors import violates_foreign_key
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, and_, select, update, delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
 from ..models import *
+from ..batch import any_id, batch_ids, group_by_id
+from ..response_cache import prof_key, prof_reviews_key, profile_key, response_cache
+from ..pagination import decode_review_cursor, review_cursor, set_next_cursor
 from ..security import auth
+from ..settings import settings
+from ..stats import apply_professor_review, distribution
 
 router = APIRouter(
     prefix="/prof",
@@ -18,12 +26,43 @@ router = APIRouter(
 )
 
 
+def prof_detail():
+    """
+    Rows of professors' profiles, one per taught subject.
+    """
+    return select(Professor.id,
+                  func.concat(Professor.first_name, " ", Professor.last_name).label("name"),
+                  Subject.id.label("subj_id"),
+                  Subject.name.label("subj_name"),
+                  Subject.code.label("code")) \
+        .join(Relation, Professor.id == Relation.prof_id) \
+        .join(Subject, Relation.subj_id == Subject.id)
+
+
+@router.get("/batch", response_model=prof_schema.GetProfBatch, status_code=HTTP_200_OK,
+            summary="Retrieves profiles of several professors.")
+async def get_prof_batch(db: AsyncSession = Depends(async_read_connection),
+                         ids: List[int] = Depends(batch_ids),
+                         user: auth.Principal = Depends(auth.get_current_user)):
+    """
+        Input parameters:
+        - **ids**: professors' ids, repeated for every professor, at most MAX_BATCH_SIZE of them
+
+        Response values:
+        - **items**: profile of every found professor keyed by its id, with the values of /prof/{prof_id}
+        - **missing**: requested ids without a profile
+    """
+
+    rows = (await db.execute(prof_detail().filter(any_id(Professor.id, ids)).order_by(Professor.id))).all()
+    return group_by_id(rows, ids)
+
+
 @router.get("/{prof_id}", response_model=List[prof_schema.GetProfId], status_code=HTTP_200_OK,
             summary="Retrieves professor's profile.",
             responses={404: {"description": "Professor was not found."}})
-def get_prof(db: Session = Depends(create_connection),
-             prof_id: Optional[int] = 0,
-             user: User = Depends(auth.get_current_user)):
+async def get_prof(db: AsyncSession = Depends(async_read_connection),
+                   prof_id: Optional[int] = 0,
+                   user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **prof_id**: professor's id
@@ -37,15 +76,12 @@ def get_prof(db: Session = Depends(create_connection),
         - **code**: short form of the subj_name, typically an acronym
     """
 
-    result = db.query(Professor.id,
-                      func.concat(Professor.first_name, " ", Professor.last_name).label("name"),
-                      Subject.id.label("subj_id"),
-                      Subject.name.label("subj_name"),
-                      Subject.code.label("code"))
+    cached = await response_cache.get("get_prof", prof_key(prof_id), "detail")
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
 
-    join_query = result.join(Relation, Professor.id == Relation.prof_id) \
-        .join(Subject, Relation.subj_id == Subject.id) \
-        .filter(Professor.id == prof_id).all()  # queried result needs to be joined accordingly
+    join_query = (await db.execute(prof_detail().filter(Professor.id == prof_id))).all()
 
     if len(join_query) == 0:
         raise HTTPException(
@@ -53,18 +89,62 @@ def get_prof(db: Session = Depends(create_connection),
             detail=f"Professor was not found."
         )
 
-    return join_query
+    return await response_cache.store_rows(prof_key(prof_id), "detail", generation, prof_schema.GetProfId,
+                                           join_query)
+
+
+@router.get("/{prof_id}/stats", response_model=stats_schema.GetProfIdStats, status_code=HTTP_200_OK,
+            summary="Retrieves rating statistics of a professor.",
+            responses={404: {"description": "Professor was not found."}})
+async def get_prof_stats(db: AsyncSession = Depends(async_read_connection),
+                         prof_id: Optional[int] = 0,
+                         user: auth.Principal = Depends(auth.get_current_user)):
+    """
+        Input parameters:
+        - **prof_id**: professor's id
+
+        Response values:
+        - **id**: primary key representing professor
+        - **review_count**: number of reviews of the professor
+        - **rating**: average rating (null without reviews) and histogram of ratings,
+        bucket i counts ratings from 10 * i to 10 * i + 9, the last bucket includes 100
+    """
+
+    stats = (await db.execute(select(ProfessorStats).filter(ProfessorStats.prof_id == prof_id))).scalars().first()
+
+    if stats is None:
+        if (await db.execute(select(Professor.id).filter(Professor.id == prof_id))).first() is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Professor was not found."
+            )
+        stats = ProfessorStats(prof_id=prof_id, review_count=0, rating_sum=0,
+                               rating_histogram=[0] * HISTOGRAM_BUCKETS)
+
+    return {
+        "id": stats.prof_id,
+        "review_count": stats.review_count,
+        "rating": distribution(stats.rating_sum, stats.rating_histogram, stats.review_count),
+    }
 
 
 @router.get("/{prof_id}/reviews", response_model=List[prof_schema.GetProfIdReviews], status_code=HTTP_200_OK,
             summary="Retrieves reviews for specific professor.",
             responses={404: {"description": "Professor review was not found."}})
-def get_prof_reviews(db: Session = Depends(create_connection),
-                     prof_id: Optional[int] = 0,
-                     user: User = Depends(auth.get_current_user)):
+async def get_prof_reviews(response: Response,
+                           db: AsyncSession = Depends(async_read_connection),
+                           prof_id: Optional[int] = 0,
+                           limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+                           cursor: Optional[str] = None,
+                           user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **prof_id**: professor's id
+        - **limit**: optional, maximal number of reviews on one page
+        - **cursor**: optional, value of the X-Next-Cursor header of the previous page
+
+        Reviews are ordered from the newest. When more reviews follow, the response carries
+        the cursor of the next page in the X-Next-Cursor header.
 
         Response values:
         - **id**: primary key representing professor
@@ -74,23 +154,43 @@ def get_prof_reviews(db: Session = Depends(create_connection),
         - **user_name**: full name of the author
     """
 
-    result = db.query(Professor.id,
-                      func.concat(Professor.first_name, " ", Professor.last_name).label("user_name"),
-                      ProfessorReview.message,
-                      ProfessorReview.rating,
-                      User.id.label("user_id"))
+    page = str(limit) if cursor is None else None  # first pages only, deeper ones are not cached
+    cached = await response_cache.get("get_prof_reviews", prof_reviews_key(prof_id), page)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
 
-    join_query = result.join(ProfessorReview, Professor.id == ProfessorReview.prof_id) \
+    result = select(Professor.id,
+                    func.concat(Professor.first_name, " ", Professor.last_name).label("user_name"),
+                    ProfessorReview.message,
+                    ProfessorReview.rating,
+                    ProfessorReview.review_date,
+                    User.id.label("user_id"))
+
+    result = result.join(ProfessorReview, Professor.id == ProfessorReview.prof_id) \
         .join(User, ProfessorReview.user_id == User.id) \
-        .filter(Professor.id == prof_id).all()
+        .filter(ProfessorReview.prof_id == prof_id)
 
-    if len(join_query) == 0:
+    if cursor is not None:  # keyset condition, served by ix_prof_review_table_prof_id_review_date
+        result = result.filter(tuple_(ProfessorReview.review_date, ProfessorReview.user_id)
+                               < tuple_(*decode_review_cursor(cursor)))
+
+    join_query = (await db.execute(result.order_by(ProfessorReview.review_date.desc(),
+                                                   ProfessorReview.user_id.desc())
+                                   .limit(limit + 1))).all()
+
+    if len(join_query) == 0 and cursor is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Professor review was not found."
         )
+
+    if len(join_query) > limit:
+        join_query = join_query[:limit]
+        set_next_cursor(response, review_cursor(join_query[-1]))
     # result = db.query(Subject).filter(Subject.id == {subj_id}).all()
-    return join_query
+    return await response_cache.store_rows(prof_reviews_key(prof_id), page, generation,
+                                           prof_schema.GetProfIdReviews, join_query, response.headers)
 
 
 def interval_exception(prof: prof_schema.PostProfId):
@@ -115,8 +215,8 @@ def interval_exception(prof: prof_schema.PostProfId):
              responses={404: {"description": "Professor was not found."},
                         403: {"description": "Interval is out of range."}})
 async def add_prof_review(prof: prof_schema.PostProfId,
-                          db: Session = Depends(create_connection),
-                          user: User = Depends(auth.get_current_user)):
+                          db: AsyncSession = Depends(async_create_connection),
+                          user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **message**: textual form of the review
@@ -132,28 +232,32 @@ async def add_prof_review(prof: prof_schema.PostProfId,
     """
     interval_exception(prof)
 
-    query = db.query(ProfessorReview).filter(and_(ProfessorReview.prof_id == prof.prof_id,
-                                                  ProfessorReview.user_id == user.id))
-    query_row = query.first()  # retrieve only first result
-    if query_row is not None:
-        raise HTTPException(
-            status_code=HTTP_400_BAD_REQUEST,
-            detail="Review already exists, modify your existing one.",
-        )
-
-    if len(db.query(Professor).filter(Professor.id == prof.prof_id).all()) == 0:
+    # an existing review is left untouched and returns no row, a missing professor fails the foreign key
+    statement = insert(ProfessorReview).values(user_id=user.id, **prof.dict()) \
+        .on_conflict_do_nothing(index_elements=[ProfessorReview.prof_id, ProfessorReview.user_id]) \
+        .returning(ProfessorReview.message, ProfessorReview.rating, ProfessorReview.user_id, ProfessorReview.prof_id)
+    try:
+        prof_review = (await db.execute(statement)).first()
+    except IntegrityError as error:
+        if not violates_foreign_key(error, ProfessorReview.prof_id):
+            raise
+        await db.rollback()
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND,
             detail="Professor was not found.",
         )
 
-    prof_review = ProfessorReview(user_id=user.id, **prof.dict())
-
-    db.add(prof_review)  # 3 essential methods that post new values into database
-    db.commit()
-    db.refresh(prof_review)
+    if prof_review is None:
+        await db.rollback()
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail="Review already exists, modify your existing one.",
+        )
 
-    increment_comment(db, user)
+    await apply_professor_review(db, prof.prof_id, new=prof_review)
+    await increment_comment(db, user.id)
+    await db.commit()
+    await response_cache.invalidate(prof_reviews_key(prof.prof_id), profile_key(user.id))
 
     return prof_review
 
@@ -163,8 +267,8 @@ async def add_prof_review(prof: prof_schema.PostProfId,
             responses={404: {"description": "Review was not found."},
                        403: {"description": "Interval is out of range."}})
 async def modify_prof_review(prof: prof_schema.PostProfId,
-                             db: Session = Depends(create_connection),
-                             user: User = Depends(auth.get_current_user)):
+                             db: AsyncSession = Depends(async_create_connection),
+                             user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **message**: textual form of the review
@@ -181,58 +285,60 @@ async def modify_prof_review(prof: prof_schema.PostProfId,
 
     interval_exception(prof)
 
-    prof_review = ProfessorReview(user_id=user.id, **prof.dict())
-
-    query = db.query(ProfessorReview).filter(and_(ProfessorReview.prof_id == prof_review.prof_id,
-                                                  ProfessorReview.user_id == user.id))
-
-    query_row = query.first()
-    if not query_row:
+    # the locked row before the update, its rating is taken out of the statistics
+    old = select(ProfessorReview.prof_id, ProfessorReview.user_id, ProfessorReview.rating) \
+        .filter(and_(ProfessorReview.prof_id == prof.prof_id, ProfessorReview.user_id == user.id)) \
+        .with_for_update().subquery("old")
+    statement = update(ProfessorReview) \
+        .filter(and_(ProfessorReview.prof_id == old.c.prof_id, ProfessorReview.user_id == old.c.user_id)) \
+        .values(message=prof.message, rating=prof.rating) \
+        .returning(old.c.rating) \
+        .execution_options(synchronize_session=False)
+
+    query_row = (await db.execute(statement)).first()
+    if query_row is None:
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND,
             detail="Review was not found.",
         )
 
-    if query_row.user_id != user.id:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authorized to perform this action."
-        )
-
-    updated_review = prof_schema.PostProfIdOut(user_id=user.id, **prof.dict())
-    query.update(updated_review.dict())
-    db.commit()
+    await apply_professor_review(db, prof.prof_id, old=query_row, new=prof)
+    await db.commit()
+    await response_cache.invalidate(prof_reviews_key(prof.prof_id))
 
-    return prof_review
+    return prof_schema.PostProfIdOut(user_id=user.id, **prof.dict())
 
 
 @router.delete("/delete_review", status_code=HTTP_200_OK,
                summary="Deletes user review.",
                responses={404: {"description": "Review was not found."}})
-def delete_review(uid: int, pid: int,
-                  db: Session = Depends(create_connection),
-                  user: User = Depends(auth.get_current_user)):
+async def delete_review(uid: int, pid: int,
+                        db: AsyncSession = Depends(async_create_connection),
+                        user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **uid**: id of the author
         - **pid**: id of the reviewed professor
     """
-    query = db.query(ProfessorReview).filter(and_(ProfessorReview.user_id == uid,
-                                                  ProfessorReview.prof_id == pid))
-    current_review = query.first()
-
     if uid != user.id and user.permission is False:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN,
             detail="Permission denied.",
         )
 
+    statement = delete(ProfessorReview).filter(and_(ProfessorReview.user_id == uid,
+                                                    ProfessorReview.prof_id == pid)) \
+        .returning(ProfessorReview.rating) \
+        .execution_options(synchronize_session=False)
+    current_review = (await db.execute(statement)).first()
+
     if current_review is None:
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND,
             detail="Review was not found.",
         )
-    decrement_comment(db, user)
 
-    db.delete(current_review)
-    db.commit()
+    await apply_professor_review(db, pid, old=current_review)
+    await decrement_comment(db, uid)
+    await db.commit()
+    await response_cache.invalidate(prof_reviews_key(pid), profile_key(uid))
@@ -1,17 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from starlette.status import HTTP_201_CREATED, HTTP_401_UNAUTHORIZED, \
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status, UploadFile, File
+from starlette.status import HTTP_201_CREATED, HTTP_304_NOT_MODIFIED, HTTP_401_UNAUTHORIZED, \
     HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_200_OK, HTTP_422_UNPROCESSABLE_ENTITY
-from starlette.responses import StreamingResponse, Response
+from starlette.responses import FileResponse, StreamingResponse, Response
 
 from ..schemas import profile_schema
-from ..db.database import create_connection
-from sqlalchemy.orm import Session, aliased
-from sqlalchemy import func, union, select, or_, alias, text
+from ..db.database import async_create_connection, async_read_connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, union, select, update, delete, or_, alias, text
+from sqlalchemy.dialects.postgresql import insert
 from typing import List, Optional
 from ..models import *
+from ..batch import any_id, batch_ids
 from ..security import auth
+from ..blobs import blob_store, collect_blobs, release_blobs, run_blocking, store_blobs
+from ..photos import ORIGINAL, etag, etag_matches, pick_variant, render_variants_async
+from ..response_cache import profile_key, prof_reviews_key, subj_reviews_key, response_cache
+from ..search.index import search_index
+from ..settings import settings
+from ..stats import remove_user_reviews
+from ..uploads import read_picture
 import io
-from PIL import Image
+import os
+from collections import Counter
 
 router = APIRouter(
     prefix="/profile",
@@ -20,27 +30,79 @@ router = APIRouter(
 )
 
 
-def increment_comment(db: Session, user: User):
-    user_query = db.query(User).filter(User.id == user.id)
-    user_comment = user_query.first().comments
-    user_query.update({"comments": user_comment + 1})
-    db.commit()
+async def increment_comment(db: AsyncSession, user_id: int):
+    """
+    Counts a posted review. The counter is updated in place, concurrent posts of one user queue
+    on the row lock instead of overwriting each other. Runs in the caller's transaction,
+    profile_key(user_id) is to be invalidated once it is committed.
+    """
+    await db.execute(update(User).filter(User.id == user_id).values(comments=User.comments + 1)
+                     .execution_options(synchronize_session=False))
+
 
+async def decrement_comment(db: AsyncSession, user_id: int):
+    """
+    Uncounts a deleted review, see increment_comment.
+    """
+    await db.execute(update(User).filter(User.id == user_id, User.comments > 0).values(comments=User.comments - 1)
+                     .execution_options(synchronize_session=False))
 
-def decrement_comment(db: Session, user: User):
-    user_query = db.query(User).filter(User.id == user.id)
-    user_comment = user_query.first().comments
-    if user_comment > 0:
-        user_query.update({"comments": user_comment - 1})
-        db.commit()
+
+async def remove_photos(db: AsyncSession, user_id: int):
+    """
+    Deletes the stored variants of a user's picture and releases their blobs.
+    Returns the released digests, to be collected once the transaction is committed.
+    Locks the user's row first, so concurrent writers of one user's picture take turns
+    instead of inserting the same variants twice.
+    """
+    locked = await db.execute(select(User.id).filter(User.id == user_id).with_for_update())
+    if locked.first() is None:  # deleted meanwhile
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND,
+            detail="Profile was not found.",
+        )
+    result = await db.execute(delete(UserPhoto).filter(UserPhoto.user_id == user_id)
+                              .returning(UserPhoto.content_hash))
+    released = result.scalars().all()
+    await release_blobs(db, released)
+    return released
+
+
+def profile_detail():
+    return select(User.id.label("id"),
+                  User.email.label("email"),
+                  func.concat(User.first_name, " ", User.last_name).label("name"),
+                  User.permission.label("permission"),
+                  User.comments.label("comments"),
+                  User.reg_date.label("reg_date"),
+                  User.study_year.label("study_year"))
+
+
+@router.get("/batch", response_model=profile_schema.GetProfileBatch, status_code=HTTP_200_OK,
+            summary="Retrieves several user profiles.")
+async def get_profile_batch(db: AsyncSession = Depends(async_read_connection),
+                            ids: List[int] = Depends(batch_ids),
+                            user: auth.Principal = Depends(auth.get_current_user)):
+    """
+        Input parameters:
+        - **ids**: identifiers of the users, repeated for every user, at most MAX_BATCH_SIZE of them
+
+        Response values:
+        - **items**: profile of every found user keyed by its id, with the values of /profile/{profile_id}
+        - **missing**: requested ids without a profile
+    """
+
+    rows = (await db.execute(profile_detail().filter(any_id(User.id, ids)))).all()
+    items = {row.id: row for row in rows}
+    return {"items": items, "missing": [id for id in ids if id not in items]}
 
 
 @router.get("/{profile_id}", response_model=List[profile_schema.GetProfileId], status_code=HTTP_200_OK,
             summary="Retrieves user profile.",
             responses={404: {"description": "Profile was not found."}})
-def get_profile(db: Session = Depends(create_connection),
-                profile_id: Optional[int] = 0,
-                user: User = Depends(auth.get_current_user)):
+async def get_profile(db: AsyncSession = Depends(async_read_connection),
+                      profile_id: Optional[int] = 0,
+                      user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **profile_id**: identifier of the user
@@ -56,73 +118,79 @@ def get_profile(db: Session = Depends(create_connection),
         - **study_year**: current year of study
     """
 
-    result = db.query(User.id.label("id"),
-                      User.email.label("email"),
-                      func.concat(User.first_name, " ", User.last_name).label("name"),
-                      User.permission.label("permission"),
-                      User.comments.label("comments"),
-                      User.reg_date.label("reg_date"),
-                      User.study_year.label("study_year"))
+    cached = await response_cache.get("get_profile", profile_key(profile_id), "detail")
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
 
-    filter_query = result.filter(User.id == profile_id).all()
+    filter_query = (await db.execute(profile_detail().filter(User.id == profile_id))).all()
 
     if len(filter_query) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Profile was not found."
         )
-    return filter_query
+    return await response_cache.store(profile_key(profile_id), "detail", generation,
+                                      List[profile_schema.GetProfileId], filter_query)
 
 
 @router.get("/{profile_id}/pic", status_code=HTTP_200_OK,
             summary="Retrieves user profile picture.",
-            responses={404: {"description": "Profile picture was not found."}})
-def get_profile_pic(db: Session = Depends(create_connection),
-                    profile_id: Optional[int] = 0,
-                    user: User = Depends(auth.get_current_user)):
+            responses={304: {"description": "Cached picture is still current."},
+                       404: {"description": "Profile picture was not found."}})
+async def get_profile_pic(request: Request,
+                          db: AsyncSession = Depends(async_read_connection),
+                          profile_id: Optional[int] = 0,
+                          size: Optional[int] = Query(None, ge=0),
+                          user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **profile_id**: id of the user
+        - **size**: optional, longest edge in pixels the client needs; the smallest pre-rendered
+        variant (64 or 256) at least that large is returned, the original upload when omitted or larger
+
+        The response carries an ETag, a request with a matching If-None-Match header gets 304 Not Modified.
 
         Response values:
         - binary form of profile picture
     """
 
-    result = db.query(User.photo.label("user_photo"))
-    filter_query = result.filter(User.id == profile_id).first()
+    result = select(UserPhoto.size, UserPhoto.media_type, UserPhoto.content_hash) \
+        .select_from(User).outerjoin(UserPhoto, User.id == UserPhoto.user_id)
+    filter_query = (await db.execute(result.filter(User.id == profile_id))).all()
 
-    if filter_query is None:
+    if len(filter_query) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Profile was not found."
         )
 
-    if filter_query[0] is None:
+    variants = {row.size: row for row in filter_query if row.size is not None}
+    if ORIGINAL not in variants:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Profile picture was not found."
         )
-    # image_type = magic.from_buffer(filter_query[0], mime=True)
-    image_type = Image.open(io.BytesIO(filter_query[0])).format.lower()
-    return Response(content=filter_query[0], media_type=f'image/{image_type}')
-
 
-def check_if_picture(file: UploadFile = File(...)):
-    # check_filetype
-    supported_files = ["image/jpeg", "image/jpg", "image/png"]
-    if file.content_type not in supported_files:
-        raise HTTPException(
-            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
-            detail="Unsupported file type.",
-        )
-    file_bytes = file.file.read()
-    size = len(file_bytes)
-    if size > 3 * 1024 * 1024:  # 3MB = 3*1024 KB = 3* 1024 * 1024
+    variant = variants[pick_variant(variants, size)]
+    headers = {
+        "ETag": etag(variant.content_hash),
+        "Cache-Control": f"private, max-age={settings.PHOTO_CACHE_MAX_AGE}",
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        path = blob_store.path(variant.content_hash)
+        if path is not None:  # streamed from disk, without reading it into memory first
+            return FileResponse(path, stat_result=os.stat(path), media_type=variant.media_type, headers=headers)
+        photo = await run_blocking(blob_store.read, variant.content_hash)
+    except FileNotFoundError:  # replaced or deleted in the meantime
         raise HTTPException(
-            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
-            detail="Selected file is too large.",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Profile picture was not found."
         )
-    return file_bytes
+    return Response(content=photo, media_type=variant.media_type, headers=headers)
 
 
 @router.put("/pic", status_code=HTTP_200_OK,
@@ -130,10 +198,10 @@ def check_if_picture(file: UploadFile = File(...)):
             responses={404: {"description": "Profile was not found."},
                        422: {"description": "Unprocessable file."}})
 async def add_profile_pic(file: UploadFile = File(...),
-                          db: Session = Depends(create_connection),
-                          user: User = Depends(auth.get_current_user)):
-    query = db.query(User).filter(User.id == user.id)
-    query_row = query.first()
+                          db: AsyncSession = Depends(async_create_connection),
+                          user: auth.Principal = Depends(auth.get_current_user)):
+    query = select(User).filter(User.id == user.id)
+    query_row = (await db.execute(query)).scalars().first()
 
     if not query_row:
         raise HTTPException(
@@ -147,19 +215,34 @@ async def add_profile_pic(file: UploadFile = File(...),
             detail="Not authorized to perform this action."
         )
 
-    file_bytes = check_if_picture(file)
-    query.update({"photo": file_bytes})
-    db.commit()
-    return StreamingResponse(io.BytesIO(file_bytes), media_type=file.content_type)
+    file_bytes, media_type = await read_picture(file)
+    try:
+        variants = await render_variants_async(file_bytes)
+    except (OSError, ValueError):  # unreadable, corrupt or oversized image
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Unsupported file type.",
+        )
+
+    released = await remove_photos(db, user.id)
+    # small pictures render identical variants, every row referring to a blob counts
+    await store_blobs(db, {variant.content_hash: variant.photo for variant in variants},
+                      Counter(variant.content_hash for variant in variants))
+    await db.execute(insert(UserPhoto), [{"user_id": user.id, "size": variant.size,
+                                          "media_type": variant.media_type,
+                                          "content_hash": variant.content_hash} for variant in variants])
+    await db.commit()
+    await collect_blobs(db, released)
+    return StreamingResponse(io.BytesIO(file_bytes), media_type=media_type)
 
 
 @router.delete("/", status_code=HTTP_200_OK,
                summary="Deletes user profile.",
                responses={404: {"description": "Profile was not found"}})
-def delete_user_profile(db: Session = Depends(create_connection),
-                        user: User = Depends(auth.get_current_user)):
-    query = db.query(User).filter(User.id == user.id)
-    current_user = query.first()
+async def delete_user_profile(db: AsyncSession = Depends(async_create_connection),
+                              user: auth.Principal = Depends(auth.get_current_user)):
+    query = select(User).filter(User.id == user.id)
+    current_user = (await db.execute(query)).scalars().first()
 
     if current_user is None:
         raise HTTPException(
@@ -173,23 +256,30 @@ def delete_user_profile(db: Session = Depends(create_connection),
             detail="Not authorized to perform this action."
         )
 
-    db.delete(current_user)
-    db.commit()
+    prof_ids, subj_ids = await remove_user_reviews(db, current_user.id)  # reviews go away by cascade
+    released = await remove_photos(db, current_user.id)
+    await db.delete(current_user)
+    await db.commit()
+    await response_cache.invalidate(profile_key(current_user.id),
+                                    *map(prof_reviews_key, prof_ids), *map(subj_reviews_key, subj_ids))
+    await collect_blobs(db, released)
+    auth.invalidate_principal(current_user.id)
+    search_index.remove_user(current_user.id)
 
 
 @router.put("/delete_pic", status_code=HTTP_200_OK, response_model=profile_schema.PutProfilePic,
             summary="Deletes current profile picture. **This API call was marked as DELETE in first doc.**",
             responses={404: {"description": "Profile was not found"}})
-def delete_profile_pic(db: Session = Depends(create_connection),
-                       user: User = Depends(auth.get_current_user)):
+async def delete_profile_pic(db: AsyncSession = Depends(async_create_connection),
+                             user: auth.Principal = Depends(auth.get_current_user)):
     """
         Response values:
 
         - **photo**: empty photo value
     """
 
-    query = db.query(User).filter(User.id == user.id)
-    query_row = query.first()
+    query = select(User).filter(User.id == user.id)
+    query_row = (await db.execute(query)).scalars().first()
 
     if not query_row:
         raise HTTPException(
@@ -203,7 +293,8 @@ def delete_profile_pic(db: Session = Depends(create_connection),
             detail="Not authorized to perform this action."
         )
 
-    query.update({"photo": None})
-    db.commit()
+    released = await remove_photos(db, user.id)
+    await db.commit()
+    await collect_blobs(db, released)
 
     return {"photo": None}
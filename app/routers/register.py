@@ -2,10 +2,11 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from starlette.status import HTTP_201_CREATED, HTTP_403_FORBIDDEN
 from ..models import User
 from ..schemas.register_login_schema import PostRegister, UserRegister
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from ..security.passwords import get_password_hash
-from ..db.database import create_connection
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..security.passwords import hash_password
+from ..db.database import async_create_connection
+from ..search.index import search_index
 import re
 
 rx_email = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
@@ -16,8 +17,9 @@ router = APIRouter(
 )
 
 
-def check_email_is_taken(mail: str, db: Session = Depends(create_connection)):
-    retval = db.query(User).filter(User.email == mail).first()
+async def check_email_is_taken(mail: str, db: AsyncSession = Depends(async_create_connection)):
+    result = await db.execute(select(User).filter(func.lower(User.email) == mail.lower()))
+    retval = result.scalars().first()
     if retval is None:
         return False
     return True
@@ -57,8 +59,9 @@ def check_study_year(study_year: int):
 
 @router.post("/", status_code=HTTP_201_CREATED, response_model=PostRegister,
              summary="Registers new user.",
-             responses={403: {"description": "Invalid credentials."}})
-async def register(user: UserRegister, db: Session = Depends(create_connection)):
+             responses={403: {"description": "Invalid credentials."},
+                        503: {"description": "Too many password checks in progress."}})
+async def register(user: UserRegister, db: AsyncSession = Depends(async_create_connection)):
     """
         Input parameters:
         - **email**: user's email
@@ -82,8 +85,6 @@ async def register(user: UserRegister, db: Session = Depends(create_connection))
             status_code=HTTP_403_FORBIDDEN,
             detail="Incorrect password.",
         )
-    else:
-        user.pwd = get_password_hash(user.pwd)  # if the password is correct, create hash from user's password
 
     if await check_email_validity(user.email):
         raise HTTPException(
@@ -91,7 +92,7 @@ async def register(user: UserRegister, db: Session = Depends(create_connection))
             detail="Incorrect email form.",
         )
 
-    if check_email_is_taken(user.email, db):
+    if await check_email_is_taken(user.email, db):
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN,
             detail="Email already taken.",
@@ -128,9 +129,13 @@ async def register(user: UserRegister, db: Session = Depends(create_connection))
     )
     """
 
+    # hashed once every check passed, off the event loop
+    user.pwd = await hash_password(user.pwd)
+
     registered_user = User(**user.dict())  # wrap json into the model object
     db.add(registered_user)
-    db.commit()
-    db.refresh(registered_user)
+    await db.commit()
+    await db.refresh(registered_user)
+    search_index.add_user(registered_user)
 
     return registered_user
@@ -1,19 +1,26 @@
-import json
+import asyncio
+import logging
 
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, WebSocket
 from starlette.responses import JSONResponse
 from starlette.status import HTTP_200_OK
 from starlette.websockets import WebSocketDisconnect
 
+from ..connections import Connection, socket_manager
 from ..schemas import search_schema
-from ..db.database import create_connection, async_create_connection
-from sqlalchemy.orm import Session
+from ..search import trigram
+from ..search.index import search_index
+from ..settings import settings
+from ..db.database import async_read_connection, async_session, read_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import func, union, select, or_, alias, text
 from typing import List, Optional
 from ..models import *
-
-from ..db.init_db import engine
+from ..pagination import decode_search_cursor, invalid_cursor, search_cursor, set_next_cursor
 from ..security import auth
+from ..serialization import FastJSONResponse
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/search",
@@ -23,14 +30,34 @@ router = APIRouter(
 )
 
 
+async def find(db: AsyncSession, search_string: str, limit: int, after=None):
+    """
+    Answers a search from the in-memory index, the database is queried only by the "database"
+    backend or to rebuild an index that is not loaded. Returns the page and the keys of the next one.
+    """
+    if settings.SEARCH_BACKEND == "database":
+        return await trigram.search(db, search_string, limit, after)
+
+    await search_index.ensure_ready(db)
+    return search_index.search(search_string, limit, after)
+
+
 @router.get("/", response_model=List[search_schema.GetSearch], status_code=HTTP_200_OK,
             summary="Looks up any profile.")
-def get_search(db: Session = Depends(create_connection),
-               search_string: Optional[str] = "",
-               user: User = Depends(auth.get_current_user)):
+async def get_search(response: Response,
+                     db: AsyncSession = Depends(async_read_connection),
+                     search_string: Optional[str] = "",
+                     limit: int = Query(settings.SEARCH_LIMIT_PER_TYPE, ge=1, le=settings.MAX_PAGE_SIZE),
+                     cursor: Optional[str] = None,
+                     user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **search_string**: optional, defines keyword to search for
+        - **limit**: optional, maximal number of subjects, professors and users on one page
+        - **cursor**: optional, value of the X-Next-Cursor header of the previous page
+
+        When more results follow, the response carries the cursor of the next page
+        in the X-Next-Cursor header.
 
         Response values:
 
@@ -39,51 +66,60 @@ def get_search(db: Session = Depends(create_connection),
         - **id**: unique identifier for given entity
     """
 
-    # search_string = '%' + search_string + '%'
-    con = engine.connect()
-    rs = con.execute(text(f"""select name, code, id from (
-                               select *,
-                                      row_number() over (partition by pointer) as rn
-                               from (
-                                        select *
-                                        from (
-                                                 (select s.name as name, s.code as code, s.id, 'subj' as pointer
-                                                  from subject_table s)
-                                                 union
-                                                 (select concat(p.first_name, ' ', p.last_name) as name,
-                                                         'PROF'                                 as code,
-                                                         p.id,
-                                                         'prof'                                 as pointer
-                                                  from professor_table p)
-                                                 union
-                                                 (select concat(u.first_name, ' ', u.last_name) as name,
-                                                         'USER'                                 as code,
-                                                         u.id,
-                                                         'user'                                 as pointer
-                                                  from user_table u)
-                                             ) as search
-                                        where case
-                                                  when '{search_string}' = 'default_value'
-                                                      then lower(search.code) like '%'
-                                                  else lower(search.name) like lower('%{search_string}%') or
-                                                       lower(search.code) like lower('%{search_string}%') end
-                                    ) as tmp
-                               order by rn, pointer
-                           ) as tmp2;"""))  # direct sql select into database
-    data = rs.fetchall()
-
-    if not data:
+    after = decode_search_cursor(cursor, search_string) if cursor is not None else None
+    try:
+        data, next_after = await find(db, search_string, limit, after)
+    except (TypeError, ValueError, ArithmeticError):
+        if after is None:
+            raise
+        raise invalid_cursor()  # keys of a different shape than this search produces
+
+    if not data and cursor is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"There was an error querying desired data."
         )
-    return data
+    set_next_cursor(response, search_cursor(search_string, next_after))
+    # name, code and id dictionaries built by the search itself, returned without validating them again
+    return FastJSONResponse(data, headers=dict(response.headers))
+
+
+async def answer_search(connection: Connection, search_string: str):
+    """
+    Runs one search of a socket after the debounce window. A newer search string cancels it,
+    while waiting or while querying, in which case the database query is cancelled as well.
+    Queries run on a read replica, unless the user wrote lately.
+    """
+    await asyncio.sleep(settings.SEARCH_DEBOUNCE_SECONDS)
+    try:
+        # a connection is checked out only if a query runs
+        async with read_session(connection.websocket.headers.get("authorization")) as db:
+            data, _ = await find(db, search_string, settings.SEARCH_LIMIT_PER_TYPE)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Search over websocket failed.")
+        return
+
+    if len(data) == 0:
+        await connection.send_json({"status_code": 404,
+                                    "message": "There was an error querying desired data."})
+    else:
+        await connection.send_json({"status_code": 200,
+                                    "message": data})
 
 
 @router.websocket("/wb")
 async def get_search_wb(websocket: WebSocket,
                         ):
     """
+        Every received text is a search string, answered once no newer one arrived within
+        the debounce window. A newer search string cancels the unanswered previous one.
+
+        The server sends {"type": "ping"} regularly, clients answer with {"type": "pong"}.
+        Sockets that stop answering or stop searching are closed, as are sockets above
+        the per worker or per user limit, after a message with status_code 429.
+
         - **name**: full name of professor, user or object
         - **code**: shortcut for name
         - **id**: unique identifier for given entity
@@ -91,61 +127,33 @@ async def get_search_wb(websocket: WebSocket,
 
     await websocket.accept()
     token = websocket.headers["authorization"]
-    db = await async_create_connection()
     try:
-        user: User = await auth.async_get_current_user(token=token, db=db)
-        if db:
-            db.close()
+        async with async_session() as db:
+            user: auth.Principal = await auth.get_current_user(token=token, db=db)
     except HTTPException:
         await websocket.send_json({"status_code": 403,
                                    "message": "Authorization failed."})
         await websocket.close()
         return
 
-    con = engine.connect()
+    connection = await socket_manager.connect(websocket, user.id)
+    if connection is None:
+        return
+
+    heartbeat = asyncio.create_task(socket_manager.keep_alive(connection))
+    searching: Optional[asyncio.Task] = None
     try:
         while True:
             search_string = await websocket.receive_text()
-        # search_string = '%' + search_string + '%'
-            rs = con.execute(text(f"""select name, code, id from (
-                                       select *,
-                                              row_number() over (partition by pointer) as rn
-                                       from (
-                                                select *
-                                                from (
-                                                         (select s.name as name, s.code as code, s.id, 'subj' as pointer
-                                                          from subject_table s)
-                                                         union
-                                                         (select concat(p.first_name, ' ', p.last_name) as name,
-                                                                 'PROF'                                 as code,
-                                                                 p.id,
-                                                                 'prof'                                 as pointer
-                                                          from professor_table p)
-                                                         union
-                                                         (select concat(u.first_name, ' ', u.last_name) as name,
-                                                                 'USER'                                 as code,
-                                                                 u.id,
-                                                                 'user'                                 as pointer
-                                                          from user_table u)
-                                                     ) as search
-                                                where case
-                                                          when '{search_string}' = 'default_value'
-                                                              then lower(search.code) like '%'
-                                                          else lower(search.name) like lower('%{search_string}%') or
-                                                               lower(search.code) like lower('%{search_string}%') end
-                                            ) as tmp
-                                       order by rn, pointer
-                                   ) as tmp2
-                                   limit 1000;"""))  # direct sql select into database
-            data = rs.fetchall()
-            if len(data) == 0:
-                await websocket.send_json({"status_code": 404,
-                                           "message": "There was an error querying desired data."})
-            else:
-                items = []
-                for row in data:
-                    items.append({"name": row[0], "code": row[1], "id": row[2]})
-                await websocket.send_json({"status_code": 200,
-                                           "message": json.dumps(items, indent=2)})
+            if connection.is_pong(search_string):
+                continue
+            if searching is not None:
+                searching.cancel()  # its results would be stale
+            searching = asyncio.create_task(answer_search(connection, search_string))
     except WebSocketDisconnect:
-        print("disconnect from websocket")
+        logger.debug("Search websocket of user %s disconnected.", user.id)
+    finally:
+        heartbeat.cancel()
+        if searching is not None:
+            searching.cancel()
+        socket_manager.disconnect(connection)
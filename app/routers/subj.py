@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from starlette.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, \
     HTTP_200_OK, HTTP_403_FORBIDDEN
 
 from .profile import increment_comment, decrement_comment
-from ..schemas import subj_schema
-from ..db.database import create_connection
-from sqlalchemy.orm import Session, aliased
-from sqlalchemy import func, union, select, or_, alias, text, and_
+from ..schemas import subj_schema, stats_schema
+from ..db.database import async_create_connection, async_read_connection
+from ..db.errors import violates_foreign_key
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy import func, union, select, update, delete, or_, alias, text, and_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
 from ..models import *
+from ..batch import any_id, batch_ids, group_by_id
+from ..response_cache import profile_key, subj_key, subj_reviews_key, response_cache
+from ..pagination import decode_review_cursor, review_cursor, set_next_cursor
 from ..security import auth
+from ..settings import settings
+from ..stats import apply_subject_review, distribution
 
 router = APIRouter(
     prefix="/subj",
@@ -18,12 +27,45 @@ router = APIRouter(
 )
 
 
+def subject_detail():
+    """
+    Rows of subjects' profiles, one per teacher.
+    """
+    Professor1 = aliased(Professor)
+    Professor2 = aliased(Professor)
+
+    return select(Subject.id, Subject.name,
+                  func.concat(Professor1.first_name, " ", Professor1.last_name).label("teachers"),
+                  func.concat(Professor2.first_name, " ", Professor2.last_name).label("garant")) \
+        .join(Relation, Subject.id == Relation.subj_id) \
+        .join(Professor1, Relation.prof_id == Professor1.id) \
+        .join(Professor2, Subject.prof_id == Professor2.id)
+
+
+@router.get("/batch", response_model=subj_schema.GetSubjectBatch, status_code=HTTP_200_OK,
+            summary="Retrieves profiles of several subjects.")
+async def get_subject_batch(db: AsyncSession = Depends(async_read_connection),
+                            ids: List[int] = Depends(batch_ids),
+                            user: auth.Principal = Depends(auth.get_current_user)):
+    """
+        Input parameters:
+        - **ids**: subjects' ids, repeated for every subject, at most MAX_BATCH_SIZE of them
+
+        Response values:
+        - **items**: profile of every found subject keyed by its id, with the values of /subj/{subj_id}
+        - **missing**: requested ids without a profile
+    """
+
+    rows = (await db.execute(subject_detail().filter(any_id(Subject.id, ids)).order_by(Subject.id))).all()
+    return group_by_id(rows, ids)
+
+
 @router.get("/{subj_id}", response_model=List[subj_schema.GetSubjectId], status_code=HTTP_200_OK,
             summary="Retrieves subject's profile.",
             responses={404: {"description": "Subject review was not found."}})
-def get_subject(db: Session = Depends(create_connection),
-                subj_id: Optional[int] = 0,
-                user: User = Depends(auth.get_current_user)):
+async def get_subject(db: AsyncSession = Depends(async_read_connection),
+                      subj_id: Optional[int] = 0,
+                      user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **subj_id**: id of the subject
@@ -35,17 +77,12 @@ def get_subject(db: Session = Depends(create_connection),
         - **garant**: boss of this subject
     """
 
-    Professor1 = aliased(Professor)
-    Professor2 = aliased(Professor)
+    cached = await response_cache.get("get_subject", subj_key(subj_id), "detail")
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
 
-    result = db.query(Subject.id, Subject.name,
-                      func.concat(Professor1.first_name, " ", Professor1.last_name).label("teachers"),
-                      func.concat(Professor2.first_name, " ", Professor2.last_name).label("garant"))
-
-    join_query = result.join(Relation, Subject.id == Relation.subj_id) \
-        .join(Professor1, Relation.prof_id == Professor1.id) \
-        .join(Professor2, Subject.prof_id == Professor2.id) \
-        .filter(Subject.id == subj_id).all()
+    join_query = (await db.execute(subject_detail().filter(Subject.id == subj_id))).all()
 
     if len(join_query) == 0:
         raise HTTPException(
@@ -54,18 +91,67 @@ def get_subject(db: Session = Depends(create_connection),
         )
 
     # result = db.query(Subject).filter(Subject.id == {subj_id}).all()
-    return join_query
+    return await response_cache.store_rows(subj_key(subj_id), "detail", generation, subj_schema.GetSubjectId,
+                                           join_query)
+
+
+@router.get("/{subj_id}/stats", response_model=stats_schema.GetSubjectIdStats, status_code=HTTP_200_OK,
+            summary="Retrieves rating statistics of a subject.",
+            responses={404: {"description": "Subject was not found."}})
+async def get_subject_stats(db: AsyncSession = Depends(async_read_connection),
+                            subj_id: Optional[int] = 0,
+                            user: auth.Principal = Depends(auth.get_current_user)):
+    """
+        Input parameters:
+        - **subj_id**: id of the subject
+
+        Response values:
+        - **id**: primary key representing subject
+        - **review_count**: number of reviews of the subject
+        - **difficulty**, **usability**, **prof_avg**: average (null without reviews) and histogram
+        of the evaluation, bucket i counts values from 10 * i to 10 * i + 9, the last bucket includes 100
+    """
+
+    stats = (await db.execute(select(SubjectStats).filter(SubjectStats.subj_id == subj_id))).scalars().first()
+
+    if stats is None:
+        if (await db.execute(select(Subject.id).filter(Subject.id == subj_id))).first() is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Subject was not found."
+            )
+        empty = [0] * HISTOGRAM_BUCKETS
+        stats = SubjectStats(subj_id=subj_id, review_count=0,
+                             difficulty_sum=0, difficulty_histogram=empty,
+                             usability_sum=0, usability_histogram=empty,
+                             prof_avg_sum=0, prof_avg_histogram=empty)
+
+    return {
+        "id": stats.subj_id,
+        "review_count": stats.review_count,
+        "difficulty": distribution(stats.difficulty_sum, stats.difficulty_histogram, stats.review_count),
+        "usability": distribution(stats.usability_sum, stats.usability_histogram, stats.review_count),
+        "prof_avg": distribution(stats.prof_avg_sum, stats.prof_avg_histogram, stats.review_count),
+    }
 
 
 @router.get("/{subj_id}/reviews", response_model=List[subj_schema.GetSubjectIdReviews],
             status_code=HTTP_200_OK, summary="Retrieves reviews for specific subject.",
             responses={404: {"description": "Subject review was not found."}})
-def get_subject_reviews(db: Session = Depends(create_connection),
-                        subj_id: Optional[int] = 0,
-                        user: User = Depends(auth.get_current_user)):
+async def get_subject_reviews(response: Response,
+                              db: AsyncSession = Depends(async_read_connection),
+                              subj_id: Optional[int] = 0,
+                              limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+                              cursor: Optional[str] = None,
+                              user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **subj_id**: id of the subject
+        - **limit**: optional, maximal number of reviews on one page
+        - **cursor**: optional, value of the X-Next-Cursor header of the previous page
+
+        Reviews are ordered from the newest. When more reviews follow, the response carries
+        the cursor of the next page in the X-Next-Cursor header.
 
         Response values:
 
@@ -78,25 +164,45 @@ def get_subject_reviews(db: Session = Depends(create_connection),
         - **user_id**: author's id
     """
 
-    result = db.query(Subject.id,
-                      SubjectReview.message,
-                      SubjectReview.prof_avg,
-                      SubjectReview.usability,
-                      SubjectReview.difficulty,
-                      func.concat(User.first_name, " ", User.last_name).label("user_name"),
-                      User.id.label("user_id"))
-
-    join_query = result.join(SubjectReview, Subject.id == SubjectReview.subj_id) \
+    page = str(limit) if cursor is None else None  # first pages only, deeper ones are not cached
+    cached = await response_cache.get("get_subject_reviews", subj_reviews_key(subj_id), page)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
+
+    result = select(Subject.id,
+                    SubjectReview.message,
+                    SubjectReview.prof_avg,
+                    SubjectReview.usability,
+                    SubjectReview.difficulty,
+                    func.concat(User.first_name, " ", User.last_name).label("user_name"),
+                    SubjectReview.review_date,
+                    User.id.label("user_id"))
+
+    result = result.join(SubjectReview, Subject.id == SubjectReview.subj_id) \
         .join(User, SubjectReview.user_id == User.id) \
-        .filter(Subject.id == subj_id).all()
+        .filter(SubjectReview.subj_id == subj_id)
 
-    if len(join_query) == 0:
+    if cursor is not None:  # keyset condition, served by ix_subj_review_table_subj_id_review_date
+        result = result.filter(tuple_(SubjectReview.review_date, SubjectReview.user_id)
+                               < tuple_(*decode_review_cursor(cursor)))
+
+    join_query = (await db.execute(result.order_by(SubjectReview.review_date.desc(),
+                                                   SubjectReview.user_id.desc())
+                                   .limit(limit + 1))).all()
+
+    if len(join_query) == 0 and cursor is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Subject review was not found."
         )
+
+    if len(join_query) > limit:
+        join_query = join_query[:limit]
+        set_next_cursor(response, review_cursor(join_query[-1]))
     # result = db.query(Subject).filter(Subject.id == {subj_id}).all()
-    return join_query
+    return await response_cache.store_rows(subj_reviews_key(subj_id), page, generation,
+                                           subj_schema.GetSubjectIdReviews, join_query, response.headers)
 
 
 def interval_exception(subj: subj_schema.PostSubjectId):
@@ -133,8 +239,8 @@ def interval_exception(subj: subj_schema.PostSubjectId):
              responses={404: {"description": "Subject review was not found."},
                         403: {"description": "Interval is out of range."}})
 async def add_subj_review(subj: subj_schema.PostSubjectId,
-                          db: Session = Depends(create_connection),
-                          user: User = Depends(auth.get_current_user)):
+                          db: AsyncSession = Depends(async_create_connection),
+                          user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **message**: textual form of the review
@@ -155,27 +261,33 @@ async def add_subj_review(subj: subj_schema.PostSubjectId,
 
     interval_exception(subj)
 
-    query = db.query(SubjectReview).filter(and_(SubjectReview.subj_id == subj.subj_id,
-                                                SubjectReview.user_id == user.id))
-    if query.first() is not None:
-        raise HTTPException(
-            status_code=HTTP_400_BAD_REQUEST,
-            detail="Review already exists, modify your existing one.",
-        )
-
-    if len(db.query(Subject).filter(Subject.id == subj.subj_id).all()) == 0:
+    # an existing review is left untouched and returns no row, a missing subject fails the foreign key
+    statement = insert(SubjectReview).values(user_id=user.id, **subj.dict()) \
+        .on_conflict_do_nothing(index_elements=[SubjectReview.subj_id, SubjectReview.user_id]) \
+        .returning(SubjectReview.message, SubjectReview.difficulty, SubjectReview.usability,
+                   SubjectReview.prof_avg, SubjectReview.user_id, SubjectReview.subj_id)
+    try:
+        subj_review = (await db.execute(statement)).first()
+    except IntegrityError as error:
+        if not violates_foreign_key(error, SubjectReview.subj_id):
+            raise
+        await db.rollback()
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND,
             detail="Subject was not found.",
         )
 
-    subj_review = SubjectReview(user_id=user.id, **subj.dict())
-
-    db.add(subj_review)  # 3 essential methods that post new values into database
-    db.commit()
-    db.refresh(subj_review)
+    if subj_review is None:
+        await db.rollback()
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail="Review already exists, modify your existing one.",
+        )
 
-    increment_comment(db, user)
+    await apply_subject_review(db, subj.subj_id, new=subj_review)
+    await increment_comment(db, user.id)
+    await db.commit()
+    await response_cache.invalidate(subj_reviews_key(subj.subj_id), profile_key(user.id))
 
     return subj_review
 
@@ -185,8 +297,8 @@ async def add_subj_review(subj: subj_schema.PostSubjectId,
             responses={404: {"description": "Subject review was not found."},
                        403: {"description": "Interval is out of range."}})
 async def modify_subj_review(subj: subj_schema.PostSubjectId,
-                             db: Session = Depends(create_connection),
-                             user: User = Depends(auth.get_current_user)):
+                             db: AsyncSession = Depends(async_create_connection),
+                             user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **message**: textual form of the review
@@ -207,60 +319,62 @@ async def modify_subj_review(subj: subj_schema.PostSubjectId,
 
     interval_exception(subj)
 
-    subj_review = SubjectReview(user_id=user.id, **subj.dict())
-
-    query = db.query(SubjectReview).filter(and_(SubjectReview.subj_id == subj_review.subj_id,
-                                                SubjectReview.user_id == user.id))
-
-    query_row = query.first()
-    if not query_row:
+    # the locked row before the update, its values are taken out of the statistics
+    old = select(SubjectReview.subj_id, SubjectReview.user_id,
+                 SubjectReview.difficulty, SubjectReview.usability, SubjectReview.prof_avg) \
+        .filter(and_(SubjectReview.subj_id == subj.subj_id, SubjectReview.user_id == user.id)) \
+        .with_for_update().subquery("old")
+    statement = update(SubjectReview) \
+        .filter(and_(SubjectReview.subj_id == old.c.subj_id, SubjectReview.user_id == old.c.user_id)) \
+        .values(message=subj.message, difficulty=subj.difficulty, usability=subj.usability,
+                prof_avg=subj.prof_avg) \
+        .returning(old.c.difficulty, old.c.usability, old.c.prof_avg) \
+        .execution_options(synchronize_session=False)
+
+    query_row = (await db.execute(statement)).first()
+    if query_row is None:
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND,
             detail="Review was not found.",
         )
 
-    if query_row.user_id != user.id:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authorized to perform this action."
-        )
-
-    updated_review = subj_schema.PostSubjectIdOut(user_id=user.id, **subj.dict())
-    query.update(updated_review.dict())
-    query.update(subj.dict())
-    db.commit()
+    await apply_subject_review(db, subj.subj_id, old=query_row, new=subj)
+    await db.commit()
+    await response_cache.invalidate(subj_reviews_key(subj.subj_id))
 
-    return subj_review
+    return subj_schema.PostSubjectIdOut(user_id=user.id, **subj.dict())
 
 
 @router.delete("/delete_review", status_code=HTTP_200_OK,
                summary="Deletes user review.",
                responses={404: {"description": "Review was not found."}})
-def delete_review(uid: int, sid: int,
-                  db: Session = Depends(create_connection),
-                  user: User = Depends(auth.get_current_user)):
+async def delete_review(uid: int, sid: int,
+                        db: AsyncSession = Depends(async_create_connection),
+                        user: auth.Principal = Depends(auth.get_current_user)):
     """
         Input parameters:
         - **uid**: id of the author
         - **sid**: id of the reviewed subject
     """
-    query = db.query(SubjectReview).filter(and_(SubjectReview.user_id == uid,
-                                                SubjectReview.subj_id == sid))
-    current_review = query.first()
-
     if uid != user.id and user.permission is False:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN,
             detail="Permission denied.",
         )
 
+    statement = delete(SubjectReview).filter(and_(SubjectReview.user_id == uid,
+                                                  SubjectReview.subj_id == sid)) \
+        .returning(SubjectReview.difficulty, SubjectReview.usability, SubjectReview.prof_avg) \
+        .execution_options(synchronize_session=False)
+    current_review = (await db.execute(statement)).first()
+
     if current_review is None:
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND,
             detail="Review was not found.",
         )
 
-    decrement_comment(db, user)
-
-    db.delete(current_review)
-    db.commit()
+    await apply_subject_review(db, sid, old=current_review)
+    await decrement_comment(db, uid)
+    await db.commit()
+    await response_cache.invalidate(subj_reviews_key(sid), profile_key(uid))
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Dict, List
 
 
 class GetProfId(BaseModel):
@@ -9,6 +10,11 @@ class GetProfId(BaseModel):
     code: str
 
 
+class GetProfBatch(BaseModel):
+    items: Dict[int, List[GetProfId]]
+    missing: List[int]
+
+
 class GetProfIdReviews(BaseModel):
     id: int
     message: str
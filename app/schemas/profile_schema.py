@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime, date
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class GetProfileId(BaseModel):
@@ -13,6 +13,11 @@ class GetProfileId(BaseModel):
     study_year: int
 
 
+class GetProfileBatch(BaseModel):
+    items: Dict[int, GetProfileId]
+    missing: List[int]
+
+
 class GetProfileIdPic(BaseModel):
     user_photo: bytes
 
@@ -0,0 +1,22 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class RatingDistribution(BaseModel):
+    average: Optional[float]
+    histogram: List[int]
+
+
+class GetProfIdStats(BaseModel):
+    id: int
+    review_count: int
+    rating: RatingDistribution
+
+
+class GetSubjectIdStats(BaseModel):
+    id: int
+    review_count: int
+    difficulty: RatingDistribution
+    usability: RatingDistribution
+    prof_avg: RatingDistribution
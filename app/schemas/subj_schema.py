@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Dict, List
 
 
 class GetSubjectId(BaseModel):
@@ -8,6 +9,11 @@ class GetSubjectId(BaseModel):
     garant: str
 
 
+class GetSubjectBatch(BaseModel):
+    items: Dict[int, List[GetSubjectId]]
+    missing: List[int]
+
+
 class GetSubjectIdReviews(BaseModel):
     id: int
     message: str
@@ -0,0 +1,297 @@
+import asyncio
+import bisect
+import heapq
+import logging
+from collections import namedtuple
+
+from sqlalchemy import select, literal, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.database import async_session
+from ..models import Professor, Subject, User
+from .trigram import DEFAULT_VALUE, TRIGRAM_LENGTH, normalize
+
+logger = logging.getLogger(__name__)
+
+# same ordering of entity types as "order by rn, pointer" in the database search
+POINTERS = ("prof", "subj", "user")
+
+# above this many candidates of one type, matches are not scored one by one
+MAX_SCORED_CANDIDATES = 2000
+
+Entry = namedtuple("Entry", ["name", "code", "id", "pointer", "texts"])
+
+# the same (name, code, id) tuples get_search has always returned, tagged with their entity type
+entity_query = union_all(
+    select(Subject.name, Subject.code, Subject.id, literal("subj")),
+    select(Professor.first_name + " " + Professor.last_name, literal("PROF"), Professor.id, literal("prof")),
+    select(User.first_name + " " + User.last_name, literal("USER"), User.id, literal("user")),
+)
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + TRIGRAM_LENGTH] for i in range(len(text) - TRIGRAM_LENGTH + 1)}
+
+
+class SearchIndex:
+    """
+    In-process autocomplete index over subjects, professors and users.
+
+    Terms of at least three characters are looked up through trigram postings and matched as substrings,
+    shorter terms are matched as a prefix through sorted lists, mirroring app.search.trigram.
+    Reads never touch the database, writes are applied incrementally by the routers and a full rebuild
+    from the database is used at startup, periodically and whenever the index is not loaded.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._entries = {}  # (pointer, id) -> Entry
+        self._postings = {pointer: {} for pointer in POINTERS}  # trigram -> set of ids
+        self._prefixes = {pointer: [] for pointer in POINTERS}  # sorted (normalized text, id)
+        self._ids = {pointer: [] for pointer in POINTERS}  # sorted ids
+        self._pending = None  # changes made while a rebuild is running, replayed after it
+        self._lock = None  # created lazily, so it belongs to the loop of the running server
+        self._refresh_task = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        index = cls()
+        for name, code, entity_id, pointer in rows:
+            index._insert(name, code, entity_id, pointer, keep_sorted=False)
+        for pointer in POINTERS:
+            index._prefixes[pointer].sort()
+            index._ids[pointer].sort()
+        index.ready = True
+        return index
+
+    def _insert(self, name: str, code: str, entity_id: int, pointer: str, keep_sorted: bool = True):
+        insert = bisect.insort if keep_sorted else list.append
+        key = (pointer, entity_id)
+        texts = (normalize(name), normalize(code)) if pointer == "subj" else (normalize(name),)
+        self._entries[key] = Entry(name, code, entity_id, pointer, texts)
+        for text in texts:
+            for gram in trigrams(text):
+                self._postings[pointer].setdefault(gram, set()).add(entity_id)
+            insert(self._prefixes[pointer], (text, entity_id))
+        insert(self._ids[pointer], entity_id)
+
+    def _delete(self, pointer: str, entity_id: int):
+        entry = self._entries.pop((pointer, entity_id), None)
+        if entry is None:
+            return
+        for text in entry.texts:
+            postings = self._postings[pointer]
+            for gram in trigrams(text):
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.discard(entity_id)
+                    if not ids:
+                        del postings[gram]
+            prefixes = self._prefixes[pointer]
+            position = bisect.bisect_left(prefixes, (text, entity_id))
+            if position < len(prefixes) and prefixes[position] == (text, entity_id):
+                del prefixes[position]
+        ids = self._ids[pointer]
+        position = bisect.bisect_left(ids, entity_id)
+        if position < len(ids) and ids[position] == entity_id:
+            del ids[position]
+
+    def add(self, pointer: str, entity_id: int, name: str, code: str):
+        """
+        Inserts or replaces one entity.
+        """
+        self._delete(pointer, entity_id)
+        self._insert(name, code, entity_id, pointer)
+        if self._pending is not None:
+            self._pending.append((self.add, (pointer, entity_id, name, code)))
+
+    def remove(self, pointer: str, entity_id: int):
+        self._delete(pointer, entity_id)
+        if self._pending is not None:
+            self._pending.append((self.remove, (pointer, entity_id)))
+
+    def add_user(self, user: User):
+        self.add("user", user.id, f"{user.first_name} {user.last_name}", "USER")
+
+    def remove_user(self, user_id: int):
+        self.remove("user", user_id)
+
+    # Every lookup below returns (key, id) pairs in ranking order, starting after the key "after".
+    # Keys are tuples that order the same way as the ranking, so a page continues where the previous ended.
+
+    def _listed(self, pointer: str, after, count: int):
+        ids = self._ids[pointer]
+        start = bisect.bisect_right(ids, after[0]) if after else 0
+        return [((entity_id,), entity_id) for entity_id in ids[start:start + count]]
+
+    def _prefixed(self, pointer: str, term: str, after, count: int):
+        prefixes = self._prefixes[pointer]
+        found = []
+        position = bisect.bisect_right(prefixes, tuple(after)) if after else bisect.bisect_left(prefixes, (term,))
+        while position < len(prefixes) and len(found) < count:
+            text, entity_id = prefixes[position]
+            if not text.startswith(term):
+                break
+            # a subject whose name and code both match is listed once, under the smaller text
+            if not any(other < text and other.startswith(term) for other in self._entries[(pointer, entity_id)].texts):
+                found.append(((text, entity_id), entity_id))
+            position += 1
+        return found
+
+    def _scored(self, pointer: str, term: str, after, count: int):
+        """
+        Ranks substring matches by a prefix bonus and by how much of the text the term covers
+        (a cheap stand-in for trigram similarity), ties broken by id.
+        """
+        postings = self._postings[pointer]
+        smallest, *others = sorted((postings.get(gram, set()) for gram in trigrams(term)), key=len)
+        candidates = smallest.intersection(*others) if others else smallest
+
+        if len(candidates) > MAX_SCORED_CANDIDATES:
+            return self._common(pointer, term, candidates, after, count)
+
+        scored = []
+        for entity_id in candidates:
+            matching = [text for text in self._entries[(pointer, entity_id)].texts if term in text]
+            if not matching:
+                continue
+            score = max(len(term) / len(text) for text in matching)
+            if any(text.startswith(term) for text in matching):
+                score += 1
+            key = (-score, entity_id)
+            if after is None or key > tuple(after):
+                scored.append((key, entity_id))
+        return heapq.nsmallest(count, scored)
+
+    def _common(self, pointer: str, term: str, candidates: set, after, count: int):
+        """
+        Ranks a very common term without scoring every candidate: prefix matches first,
+        then the remaining matches in id order. Candidates are dense here, so the scan stops early.
+        """
+        found = []
+        if after is None or (len(after) == 3 and after[0] == 0):
+            found = [((0,) + key, entity_id)
+                     for key, entity_id in self._prefixed(pointer, term, after[1:] if after else None, count)]
+            after = None
+
+        ids = self._ids[pointer]
+        position = bisect.bisect_right(ids, after[-1]) if after else 0
+        while position < len(ids) and len(found) < count:
+            entity_id = ids[position]
+            position += 1
+            if entity_id not in candidates:
+                continue
+            texts = self._entries[(pointer, entity_id)].texts
+            if any(term in text for text in texts) and not any(text.startswith(term) for text in texts):
+                found.append(((1, entity_id), entity_id))
+        return found
+
+    def search(self, search_string: str, limit: int, after=None):
+        """
+        Returns name, code and id dictionaries in the same order as the database search together with
+        the keys to continue from, or None when the index has not been loaded yet.
+
+        At most limit entities of every type are returned. "after" maps entity types to the last key of
+        the previous page, types missing from it are exhausted. The returned keys have the same form,
+        None means there are no further results.
+        """
+        if not self.ready:
+            return None
+
+        term = normalize(search_string)
+        match_all = search_string == DEFAULT_VALUE or term == ""
+
+        found = {}
+        for pointer in POINTERS:
+            if after is not None and pointer not in after:
+                continue
+            start = after[pointer] if after is not None else None
+            # professors and users are coded as PROF and USER, a term matching the code lists the whole group
+            if match_all or (pointer != "subj" and term in pointer):
+                found[pointer] = self._listed(pointer, start, limit + 1)
+            elif len(term) < TRIGRAM_LENGTH:
+                found[pointer] = self._prefixed(pointer, term, start, limit + 1)
+            else:
+                found[pointer] = self._scored(pointer, term, start, limit + 1)
+
+        next_after = {pointer: list(keyed[limit - 1][0]) for pointer, keyed in found.items() if len(keyed) > limit}
+
+        items = []
+        for rank in range(min(max((len(keyed) for keyed in found.values()), default=0), limit)):
+            for pointer in POINTERS:
+                if pointer in found and rank < len(found[pointer]):
+                    entry = self._entries[(pointer, found[pointer][rank][1])]
+                    items.append({"name": entry.name, "code": entry.code, "id": entry.id})
+        return items, next_after or None
+
+    def _swap(self, fresh: "SearchIndex"):
+        self._entries = fresh._entries
+        self._postings = fresh._postings
+        self._prefixes = fresh._prefixes
+        self._ids = fresh._ids
+        self.ready = True
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _rebuild(self, db: AsyncSession):
+        self._pending = []
+        try:
+            rows = (await db.execute(entity_query)).all()
+            fresh = await asyncio.get_running_loop().run_in_executor(None, SearchIndex.from_rows, rows)
+            pending, self._pending = self._pending, None
+            self._swap(fresh)
+            for change, arguments in pending:
+                change(*arguments)
+        finally:
+            self._pending = None
+
+    async def rebuild(self, db: AsyncSession):
+        """
+        Reloads the whole index from the database. The structures are built in a worker thread,
+        changes made in the meantime are replayed on top of the fresh index.
+        """
+        async with self._get_lock():
+            await self._rebuild(db)
+
+    async def ensure_ready(self, db: AsyncSession):
+        """
+        Falls back to a full rebuild when the index is not loaded, e.g. when the startup load failed.
+        Concurrent callers wait for a single rebuild.
+        """
+        if not self.ready:
+            async with self._get_lock():
+                if not self.ready:
+                    await self._rebuild(db)
+
+    async def _refresh_periodically(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with async_session() as db:
+                    await self.rebuild(db)
+            except Exception:
+                logger.exception("Search index refresh failed, serving the previous index.")
+
+    async def start(self, refresh_interval: int):
+        """
+        Loads the index and, with a positive interval, keeps rebuilding it to pick up
+        changes made by other workers or directly in the database.
+        """
+        try:
+            async with async_session() as db:
+                await self.rebuild(db)
+        except Exception:
+            logger.exception("Search index could not be loaded, it will be rebuilt on the first search.")
+        if refresh_interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically(refresh_interval))
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+search_index = SearchIndex()
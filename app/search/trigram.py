@@ -0,0 +1,148 @@
+from decimal import Decimal
+from functools import lru_cache
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# magic search string used by the front-end to list every entity
+DEFAULT_VALUE = "default_value"
+
+# terms shorter than a trigram cannot use the GIN indexes, they are matched as a prefix via the btree indexes
+TRIGRAM_LENGTH = 3
+
+# The lower(...) expressions must stay identical to the index expressions declared in app.models.
+SUBJECT_FILTER = "lower(s.name) like :pattern or lower(s.code) like :pattern"
+SUBJECT_SCORE = "greatest(similarity(lower(s.name), :term), similarity(lower(s.code), :term)) " \
+                "+ case when lower(s.name) like :prefix or lower(s.code) like :prefix then 1 else 0 end"
+PROFESSOR_FILTER = "lower(p.first_name || ' ' || p.last_name) like :pattern"
+PROFESSOR_SCORE = "similarity(lower(p.first_name || ' ' || p.last_name), :term) " \
+                  "+ case when lower(p.first_name || ' ' || p.last_name) like :prefix then 1 else 0 end"
+USER_FILTER = "lower(u.first_name || ' ' || u.last_name) like :pattern"
+USER_SCORE = "similarity(lower(u.first_name || ' ' || u.last_name), :term) " \
+             "+ case when lower(u.first_name || ' ' || u.last_name) like :prefix then 1 else 0 end"
+
+
+# what a branch does on a page: start from the best match, continue after a key, or stay out (exhausted)
+START, AFTER, SKIP = "start", "after", "skip"
+
+POINTER_ALIASES = {"prof": "p", "subj": "s", "user": "u"}
+
+
+def branch(columns: str, table: str, alias: str, match_everything: bool, where: str, score: str,
+           state: str) -> str:
+    """
+    Renders one limited per-type select. When the whole type matches, rows are taken in primary key
+    order instead of scoring every row of the table. The score is rounded, so it survives the trip
+    through a cursor unchanged and can be compared for equality.
+    """
+    if match_everything:
+        where, score = "true", "0"
+        if state == AFTER:
+            where = f"{alias}.id > :after_id_{alias}"
+    else:
+        score = f"round(({score})::numeric, 6)"
+        if state == AFTER:
+            where = f"({where}) and ({score} < :after_score_{alias} " \
+                    f"or ({score} = :after_score_{alias} and {alias}.id > :after_id_{alias}))"
+    return f"""(select {columns}, {score} as score
+                from {table} {alias}
+                where {where}
+                order by score desc, {alias}.id
+                limit :limit)"""
+
+
+@lru_cache(maxsize=None)
+def search_query(match_all: bool, match_prof: bool, match_user: bool, states: tuple = (START, START, START)):
+    """
+    Returns the search statement for the given combination of flags and per-type page states
+    (professors, subjects, users).
+
+    Filters are chosen here rather than with "or :flag" in SQL, so the planner always sees a plain
+    indexable predicate, also in generic plans of prepared statements. Every branch is limited on
+    its own, so the cost of a search is bounded by the limit and not by the size of the tables.
+    """
+    prof_state, subj_state, user_state = states
+    branches = []
+    if subj_state != SKIP:
+        branches.append(branch("s.name as name, s.code as code, s.id as id, 'subj' as pointer",
+                               "subject_table", "s", match_all, SUBJECT_FILTER, SUBJECT_SCORE, subj_state))
+    if prof_state != SKIP:
+        branches.append(branch("p.first_name || ' ' || p.last_name as name, 'PROF' as code, p.id as id, "
+                               "'prof' as pointer",
+                               "professor_table", "p", match_all or match_prof, PROFESSOR_FILTER, PROFESSOR_SCORE,
+                               prof_state))
+    if user_state != SKIP:
+        branches.append(branch("u.first_name || ' ' || u.last_name as name, 'USER' as code, u.id as id, "
+                               "'user' as pointer",
+                               "user_table", "u", match_all or match_user, USER_FILTER, USER_SCORE, user_state))
+
+    return text(f"""
+        select name, code, id, pointer, score, rn from (
+            select name, code, id, pointer, score,
+                   row_number() over (partition by pointer order by score desc, id) as rn
+            from ({" union all ".join(branches)}) as search
+        ) as ranked
+        order by rn, pointer""")
+
+
+def normalize(search_string: str) -> str:
+    """
+    Lower-cases the search string and collapses whitespace, the same way the indexed columns are compared.
+    """
+    return " ".join(search_string.lower().split())
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search(db: AsyncSession, search_string: str, limit: int, after=None):
+    """
+    Returns name, code and id dictionaries ordered by relevance and interleaved by entity type,
+    at most limit rows per type, together with the keys to continue from (see SearchIndex.search).
+    The search string is only ever passed as a bound parameter.
+    """
+    term = normalize(search_string)
+    escaped = escape_like(term)
+    match_all = search_string == DEFAULT_VALUE or term == ""
+    # professors and users are coded as PROF and USER, a term matching the code lists the whole group
+    match_prof = term in "prof"
+    match_user = term in "user"
+    listed = {"prof": match_all or match_prof, "subj": match_all, "user": match_all or match_user}
+
+    parameters = {
+        "term": term,
+        "pattern": f"%{escaped}%" if len(term) >= TRIGRAM_LENGTH else f"{escaped}%",
+        "prefix": f"{escaped}%",
+        "limit": limit + 1,  # one more row tells whether another page follows
+    }
+    states = []
+    for pointer in ("prof", "subj", "user"):
+        if after is None:
+            states.append(START)
+        elif pointer not in after:
+            states.append(SKIP)
+        else:
+            alias = POINTER_ALIASES[pointer]
+            if listed[pointer]:
+                (entity_id,) = after[pointer]
+            else:
+                score, entity_id = after[pointer]
+                parameters[f"after_score_{alias}"] = Decimal(score)
+            parameters[f"after_id_{alias}"] = int(entity_id)
+            states.append(AFTER)
+
+    if all(state == SKIP for state in states):
+        return [], None
+
+    rows = (await db.execute(search_query(match_all, match_prof, match_user, tuple(states)), parameters)).all()
+
+    items, last_keys, more = [], {}, set()
+    for row in rows:
+        if row.rn > limit:
+            more.add(row.pointer)
+            continue
+        items.append({"name": row.name, "code": row.code, "id": row.id})
+        last_keys[row.pointer] = [row.id] if listed[row.pointer] else [str(row.score), row.id]
+    next_after = {pointer: key for pointer, key in last_keys.items() if pointer in more}
+    return items, next_after or None
@@ -6,13 +6,18 @@ from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from collections import namedtuple
+import hashlib
+import time
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import User
+from app.cache import LRUCache
 
 from app.schemas.auth_schema import TokenData
 from app.schemas.profile_schema import GetProfileId
 from app.settings import settings
-from app.db.database import create_connection
+from app.db.database import async_create_connection
 
 
 # to get a string like this run:
@@ -23,6 +28,22 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# the part of the user row route handlers work with
+Principal = namedtuple("Principal", ["id", "first_name", "last_name", "permission"])
+
+principal_cache = LRUCache("principal", settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
+
+# verified claims by sha256 of the token, spares the signature check for tokens seen before
+claims_cache = LRUCache("token", settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def invalidate_principal(user_id: int):
+    """
+    Drops the cached principal of a user, called after a change to the user's row is committed.
+    Other workers see the change once their entry expires.
+    """
+    principal_cache.pop(user_id)
+
 
 def create_access_token(data: dict, expires_delta: timedelta):
     """
@@ -49,6 +70,14 @@ def check_token_validity(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    digest = hashlib.sha256(token.encode()).digest() if isinstance(token, str) else None
+    cached = claims_cache.get(digest) if digest is not None else None
+    if cached is not None:
+        token_data, expires = cached
+        if expires is None or expires > time.time():
+            return token_data
+        claims_cache.pop(digest)  # expired, decoded again below to fail exactly like before
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("user_id")
@@ -58,14 +87,20 @@ def check_token_validity(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
 
+    # only verified tokens are remembered, and never beyond their expiration
+    expires = payload.get("exp")
+    ttl = settings.TOKEN_CACHE_TTL if expires is None else min(settings.TOKEN_CACHE_TTL, expires - time.time())
+    if digest is not None and ttl > 0:
+        claims_cache.set(digest, (token_data, expires), ttl=ttl)
+
     # return GetProfileId(**jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])).user_id  # TODO still needs some attribute to be returned
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme),
-                     db: Session = Depends(create_connection)):
+async def get_current_user(token: str = Depends(oauth2_scheme),
+                           db: AsyncSession = Depends(async_create_connection)):
     """
-    Returns user's id using token and database
+    Returns the authenticated user's principal, the database is only asked on a cache miss.
     """
     token = check_token_validity(token)
     if not token:
@@ -74,31 +109,32 @@ def get_current_user(token: str = Depends(oauth2_scheme),
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = db.query(User).filter(User.id == token.data).first()
-    if user is None:
+    user_id = int(token.data)
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    generation = principal_cache.generation
+    result = await db.execute(select(User.id, User.first_name, User.last_name, User.permission)
+                              .filter(User.id == user_id))
+    row = result.first()
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found",
         )
-    return user
+    principal = Principal(*row)
+    principal_cache.set(user_id, principal, generation)
+    return principal
 
 
-async def async_get_current_user(token: str,
-                     db: Session):
+async def get_current_admin(user: Principal = Depends(get_current_user)):
     """
-    Returns user's id using token and database
+    Returns the authenticated user's principal, refuses users without admin permission.
     """
-    token = check_token_validity(token)
-    if not token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(User).filter(User.id == token.data).first()
-    if user is None:
+    if not user.permission:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Profile not found",
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied.",
         )
-    return user
\ No newline at end of file
+    return user
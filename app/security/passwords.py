@@ -2,10 +2,22 @@
 # https://fastapi.tiangolo.com/tutorial/security/oauth2-jwt/
 
 
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
+from fastapi import HTTPException
 from passlib.context import CryptContext
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+from app.settings import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# hashes made with a different cost are reported by needs_update and replaced on the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+                           bcrypt__min_desired_rounds=settings.BCRYPT_ROUNDS,
+                           bcrypt__max_desired_rounds=settings.BCRYPT_ROUNDS)
 
 
 def generate_salt() -> str:
@@ -18,3 +30,79 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+class HashingPool:
+    """
+    Runs bcrypt on a few dedicated threads, so a burst of logins neither blocks the event loop
+    nor takes over the default executor. Requests beyond max_queue waiting calls are refused
+    right away instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    async def run(self, function, *arguments):
+        if self.queue_depth() >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again later.",
+            )
+
+        def timed():
+            started = time.perf_counter()
+            return started, function(*arguments), time.perf_counter()
+
+        submitted = time.perf_counter()
+        self.in_flight += 1
+        try:
+            started, result, finished = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.in_flight -= 1
+
+        self.completed += 1
+        self.wait_total += started - submitted
+        self.wait_max = max(self.wait_max, started - submitted)
+        self.run_total += finished - started
+        return result
+
+    def statistics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth(),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_avg_ms": round(self.wait_total / self.completed * 1000, 3) if self.completed else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "run_avg_ms": round(self.run_total / self.completed * 1000, 3) if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+hashing_pool = HashingPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """
+    Returns whether the password matches and, when the stored hash is outdated, its replacement.
+    """
+    return await hashing_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    return await hashing_pool.run(pwd_context.hash, password)
@@ -0,0 +1,42 @@
+"""
+Fast JSON encoding of responses.
+
+FastJSONResponse, the application's default response class, encodes with orjson and produces
+the same bytes as the stdlib encoder FastAPI used before for the values the routes return.
+Lists of database rows whose columns already have the types of the response model skip
+pydantic altogether: project() picks the model's fields out of every row, in the model's
+order, and dumps() encodes the result, see ResponseCache.store_rows.
+
+Benchmark: python -m benchmarks.serialization
+"""
+
+from operator import itemgetter
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+def dumps(content) -> bytes:
+    # dictionaries keyed by id, as the batch endpoints return, are encoded with string keys like json.dumps does
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def project(rows, model) -> list:
+    """
+    Dictionaries holding the fields of model taken from rows by column name. Columns the model
+    does not declare, like the keyset columns of a page, are left out, as validation would.
+    """
+    if not rows:
+        return []
+    names = tuple(model.__fields__)
+    columns = list(rows[0]._fields)
+    positions = [columns.index(name) for name in names]
+    if len(positions) == 1:
+        return [{names[0]: row[positions[0]]} for row in rows]
+    values = itemgetter(*positions)
+    return [dict(zip(names, values(row))) for row in rows]
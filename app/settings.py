@@ -10,6 +10,50 @@ class Settings(BaseSettings):
     ALGORITHM: str
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    BCRYPT_ROUNDS: int = 12  # cost of new password hashes, older hashes are upgraded at login
+    PASSWORD_HASH_WORKERS: int = 2  # threads running bcrypt
+    PASSWORD_HASH_QUEUE: int = 64  # waiting hash calls beyond which logins are refused with 503
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800  # seconds, -1 disables recycling
+    DB_POOL_TIMEOUT: float = 30  # seconds to wait for a free connection before failing
+    DB_REPLICA_URLS: str = ""  # comma separated postgresql:// DSNs of read replicas, empty reads from the primary
+    DB_REPLICA_CHECK_SECONDS: float = 5  # interval and timeout of replica health checks
+    DB_REPLICA_MAX_LAG_SECONDS: float = 2  # replicas further behind are skipped, keep below READ_YOUR_WRITES_SECONDS
+    READ_YOUR_WRITES_SECONDS: float = 5  # a client reads from the primary this long after its last write
+    PAGE_SIZE: int = 50  # default number of reviews per page
+    MAX_PAGE_SIZE: int = 200
+    MAX_BATCH_SIZE: int = 300  # ids accepted by one batch request
+    SEARCH_LIMIT_PER_TYPE: int = 50  # maximum of subjects, professors and users returned by one search
+    SEARCH_BACKEND: str = "index"  # "index" answers from memory, "database" runs the trigram query
+    SEARCH_INDEX_REFRESH_SECONDS: int = 300  # full index rebuild interval, 0 disables it
+    SEARCH_DEBOUNCE_SECONDS: float = 0.15  # websocket searches wait this long for a newer keystroke
+    RESPONSE_CACHE_BACKEND: str = "memory"  # "memory" per worker, "redis" shared, "none" disables it
+    RESPONSE_CACHE_URL: str = "redis://localhost:6379/0"
+    RESPONSE_CACHE_SIZE: int = 5000  # entities kept by the memory backend
+    RESPONSE_CACHE_TTL: float = 300  # seconds, bounds staleness of changes made outside the API
+    RESPONSE_CACHE_POOL_SIZE: int = 4  # connections to redis per worker
+    RESPONSE_CACHE_TIMEOUT: float = 0.5  # seconds before a redis call counts as a miss
+    WS_MAX_SOCKETS: int = 1000  # open websockets per worker
+    WS_MAX_SOCKETS_PER_USER: int = 5
+    WS_PING_INTERVAL: float = 20  # seconds between heartbeat pings
+    WS_PONG_TIMEOUT: float = 20  # seconds a client may take to answer a ping
+    WS_IDLE_TIMEOUT: float = 300  # seconds without a search before a socket is closed
+    PRINCIPAL_CACHE_SIZE: int = 10000  # authenticated users kept in memory, 0 disables the cache
+    PRINCIPAL_CACHE_TTL: float = 60  # seconds, bounds staleness of changes made by other workers
+    TOKEN_CACHE_SIZE: int = 10000  # verified tokens kept in memory, 0 disables the cache
+    TOKEN_CACHE_TTL: float = 300  # seconds, entries never outlive the token's exp
+    PHOTO_WORKERS: int = 2  # threads rendering picture variants
+    MAX_PHOTO_BYTES: int = 3 * 1024 * 1024  # largest accepted picture upload
+    PHOTO_MAX_PIXELS: int = 25_000_000  # larger pictures are refused before they are decoded
+    PHOTO_CACHE_MAX_AGE: int = 86400  # seconds clients may reuse a picture before revalidating it
+    BLOB_BACKEND: str = "local"  # storage of image contents, see app.blobs
+    BLOB_ROOT: str = "blobs"  # directory of the local backend, shared by all workers
+    METRICS_ENABLED: bool = True  # request and query metrics served at /metrics
+    SLOW_QUERY_SECONDS: float = 0.5  # statements running longer are logged, 0 disables the log
+    SLOW_QUERY_EXPLAIN_RATE: float = 0.1  # share of slow SELECTs run again under EXPLAIN ANALYZE
+    REPEATED_QUERY_THRESHOLD: int = 10  # statements repeated more often by one request are logged, 0 disables it
 
     class Config:
         env_file = '.env'
@@ -0,0 +1,139 @@
+"""
+Rating aggregates of professors and subjects.
+
+Every review handler applies the change it makes to prof_stats_table or subj_stats_table inside
+the transaction that writes the review, so reading the statistics of an entity is a single row lookup.
+app.db.recompute_stats rebuilds the aggregates from the review tables when they drift.
+"""
+
+from typing import Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import HISTOGRAM_BUCKETS, ProfessorReview, SubjectReview
+
+PROFESSOR_DIMENSIONS = ("rating",)
+SUBJECT_DIMENSIONS = ("difficulty", "usability", "prof_avg")
+
+
+def bucket(value: int) -> int:
+    return min(value // 10, HISTOGRAM_BUCKETS - 1)
+
+
+def merge_statement(table: str, key: str, dimensions):
+    """
+    Adds a delta to the aggregates of one entity, creating its row on the first review.
+    Histograms are added element by element.
+    """
+    columns = ["review_count"]
+    for dimension in dimensions:
+        columns += [f"{dimension}_sum", f"{dimension}_histogram"]
+
+    merged = []
+    for column in columns:
+        if column.endswith("_histogram"):
+            merged.append(f"{column} = array(select a + b from unnest(s.{column}, excluded.{column}) "
+                          f"with ordinality as h(a, b, i) order by i)")
+        else:
+            merged.append(f"{column} = s.{column} + excluded.{column}")
+
+    return text(f"insert into {table} as s ({key}, {', '.join(columns)}) "
+                f"values (:{key}, {', '.join(':' + column for column in columns)}) "
+                f"on conflict ({key}) do update set {', '.join(merged)}")
+
+
+def recompute_statement(table: str, key: str, entity_table: str, review_table: str, dimensions):
+    """
+    Replaces the aggregates of every entity with values computed from its reviews.
+    """
+    columns = ["review_count"]
+    computed = [f"count(r.{key})"]
+    for dimension in dimensions:
+        columns += [f"{dimension}_sum", f"{dimension}_histogram"]
+        computed += [f"coalesce(sum(r.{dimension}), 0)",
+                     "array[" + ", ".join(f"count(r.{dimension}) filter "
+                                          f"(where least(r.{dimension} / 10, {HISTOGRAM_BUCKETS - 1}) = {i})"
+                                          for i in range(HISTOGRAM_BUCKETS)) + "]::integer[]"]
+
+    return text(f"insert into {table} ({key}, {', '.join(columns)}) "
+                f"select e.id, {', '.join(computed)} "
+                f"from {entity_table} e left join {review_table} r on r.{key} = e.id group by e.id "
+                f"on conflict ({key}) do update set "
+                f"{', '.join(f'{column} = excluded.{column}' for column in columns)}")
+
+
+merge_professor_stats = merge_statement("prof_stats_table", "prof_id", PROFESSOR_DIMENSIONS)
+merge_subject_stats = merge_statement("subj_stats_table", "subj_id", SUBJECT_DIMENSIONS)
+
+recompute_professor_stats = recompute_statement("prof_stats_table", "prof_id", "professor_table",
+                                                "prof_review_table", PROFESSOR_DIMENSIONS)
+recompute_subject_stats = recompute_statement("subj_stats_table", "subj_id", "subject_table",
+                                              "subj_review_table", SUBJECT_DIMENSIONS)
+
+
+def review_delta(old, new, dimensions) -> Optional[dict]:
+    """
+    Difference of the aggregates when the review old is replaced by new, either of them may be None.
+    Returns None when nothing changes, e.g. when only the message of a review was edited.
+    """
+    delta = {"review_count": (new is not None) - (old is not None)}
+    changed = delta["review_count"] != 0
+    for dimension in dimensions:
+        total = 0
+        histogram = [0] * HISTOGRAM_BUCKETS
+        for review, sign in ((old, -1), (new, 1)):
+            if review is not None:
+                value = getattr(review, dimension)
+                total += sign * value
+                histogram[bucket(value)] += sign
+        delta[f"{dimension}_sum"] = total
+        delta[f"{dimension}_histogram"] = histogram
+        changed = changed or any(histogram)
+    return delta if changed else None
+
+
+async def apply_professor_review(db: AsyncSession, prof_id: int, old=None, new=None):
+    """
+    Records that the review old of a professor was replaced by new (None for an added or deleted review).
+    Runs in the caller's transaction, which is committed together with the review.
+    """
+    delta = review_delta(old, new, PROFESSOR_DIMENSIONS)
+    if delta is not None:
+        await db.execute(merge_professor_stats, {"prof_id": prof_id, **delta})
+
+
+async def apply_subject_review(db: AsyncSession, subj_id: int, old=None, new=None):
+    """
+    Records that the review old of a subject was replaced by new (None for an added or deleted review).
+    Runs in the caller's transaction, which is committed together with the review.
+    """
+    delta = review_delta(old, new, SUBJECT_DIMENSIONS)
+    if delta is not None:
+        await db.execute(merge_subject_stats, {"subj_id": subj_id, **delta})
+
+
+async def remove_user_reviews(db: AsyncSession, user_id: int):
+    """
+    Takes out the reviews of a user, which are deleted by cascade together with the profile.
+    Rows are updated in key order, the same order concurrent removals lock them in.
+    Returns the ids of the reviewed professors and subjects.
+    """
+    prof_reviews = (await db.execute(select(ProfessorReview).filter(ProfessorReview.user_id == user_id)
+                                     .order_by(ProfessorReview.prof_id))).scalars().all()
+    for review in prof_reviews:
+        await apply_professor_review(db, review.prof_id, old=review)
+
+    subj_reviews = (await db.execute(select(SubjectReview).filter(SubjectReview.user_id == user_id)
+                                     .order_by(SubjectReview.subj_id))).scalars().all()
+    for review in subj_reviews:
+        await apply_subject_review(db, review.subj_id, old=review)
+
+    return [review.prof_id for review in prof_reviews], [review.subj_id for review in subj_reviews]
+
+
+def distribution(total: int, histogram, count: int) -> dict:
+    return {
+        "average": total / count if count else None,
+        "histogram": list(histogram),
+    }
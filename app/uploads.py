@@ -0,0 +1,120 @@
+"""
+Bounded reading of uploaded pictures.
+
+UploadLimitMiddleware refuses request bodies above the limit of their route while they are
+still arriving, so an oversized upload is never spooled as a whole. read_picture then reads
+the parsed file in chunks and recognizes the format by its magic bytes, not by the
+content type the client claims.
+"""
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+
+from .settings import settings
+
+CHUNK_SIZE = 64 * 1024
+
+# multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+}
+
+
+def too_large() -> HTTPException:
+    return HTTPException(
+        status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Selected file is too large.",
+    )
+
+
+def unsupported() -> HTTPException:
+    return HTTPException(
+        status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Unsupported file type.",
+    )
+
+
+def sniff(head: bytes):
+    for signature, media_type in SIGNATURES.items():
+        if head.startswith(signature):
+            return media_type
+    return None
+
+
+async def read_picture(file: UploadFile):
+    """
+    Returns the bytes and the media type of an uploaded JPEG or PNG, stops reading
+    as soon as the file is known to be unsupported or larger than MAX_PHOTO_BYTES.
+    """
+    head = await file.read(CHUNK_SIZE)
+    media_type = sniff(head)
+    if media_type is None:
+        raise unsupported()
+
+    chunks = [head]
+    size = len(head)
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > settings.MAX_PHOTO_BYTES:
+            raise too_large()
+        chunks.append(chunk)
+    return b"".join(chunks), media_type
+
+
+class UploadLimitMiddleware:
+    """
+    Caps the request body of selected routes, keyed by (method, path).
+
+    A body announced as too large is refused before it is read. A body that turns out too large
+    while streaming is cut off: the client gets the refusal and the route sees a disconnect,
+    whatever it answers to that is dropped.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        refusal = JSONResponse({"detail": too_large().detail}, status_code=HTTP_422_UNPROCESSABLE_ENTITY)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            await refusal(scope, receive, send)
+            return
+
+        received = 0
+        refused = False
+
+        async def limited_receive():
+            nonlocal received, refused
+            if refused:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    refused = True
+                    await refusal(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not refused:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+
+def upload_limits() -> dict:
+    return {("PUT", "/profile/pic"): settings.MAX_PHOTO_BYTES + MULTIPART_OVERHEAD}
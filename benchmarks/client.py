@@ -0,0 +1,170 @@
+"""
+HTTP clients the benchmarks drive the service with.
+
+HttpClient keeps one HTTP/1.1 connection to a running server, like a mobile client would.
+AsgiClient calls the application in the same process, which leaves out the network and
+the server, so a measurement shows the cost of the route itself.
+"""
+
+import asyncio
+import io
+import json
+import random
+import uuid
+from typing import NamedTuple
+from urllib.parse import urlencode
+
+import h11
+
+
+class Response(NamedTuple):
+    status: int
+    headers: dict  # lower case names
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class HttpClient:
+    def __init__(self, host: str, port: int, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._connection = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._connection = h11.Connection(h11.CLIENT)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = self._connection = None
+
+    async def request(self, method: str, path: str, headers: dict = None, body: bytes = b"") -> Response:
+        """
+        Sends one request over the kept connection, reconnecting when the server closed it.
+        """
+        if self._connection is None:
+            await self._connect()
+        try:
+            return await asyncio.wait_for(self._exchange(method, path, headers or {}, body), self.timeout)
+        except BaseException:
+            await self.close()  # a half read response makes the connection unusable
+            raise
+
+    async def _exchange(self, method: str, path: str, headers: dict, body: bytes) -> Response:
+        connection = self._connection
+        fields = [("Host", f"{self.host}:{self.port}"), ("Content-Length", str(len(body)))] + list(headers.items())
+        data = connection.send(h11.Request(method=method, target=path, headers=fields))
+        if body:
+            data += connection.send(h11.Data(data=body))
+        data += connection.send(h11.EndOfMessage())
+        self._writer.write(data)
+        await self._writer.drain()
+
+        response = None
+        chunks = []
+        while True:
+            event = connection.next_event()
+            if event is h11.NEED_DATA:
+                connection.receive_data(await self._reader.read(65536))
+            elif isinstance(event, h11.Response):
+                response = event
+            elif isinstance(event, h11.Data):
+                chunks.append(event.data)
+            elif isinstance(event, h11.EndOfMessage):
+                break
+            elif isinstance(event, h11.ConnectionClosed):
+                raise ConnectionError("Server closed the connection.")
+
+        if connection.our_state is h11.MUST_CLOSE or connection.their_state is h11.MUST_CLOSE:
+            await self.close()
+        else:
+            connection.start_next_cycle()
+        headers = {name.decode().lower(): value.decode() for name, value in response.headers}
+        return Response(response.status_code, headers, b"".join(chunks))
+
+
+class AsgiClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def startup(self):
+        await self.app.router.startup()
+
+    async def shutdown(self):
+        await self.app.router.shutdown()
+
+    async def request(self, method: str, path: str, headers: dict = None, body: bytes = b"") -> Response:
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(name.lower().encode(), value.encode()) for name, value in
+                        dict(headers or {}, **{"content-length": str(len(body))}).items()],
+            "client": ("127.0.0.1", 50000),
+            "server": ("benchmark", 80),
+        }
+        received = False
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Future()  # the client never disconnects, streaming responses cancel this wait
+
+        start = {}
+        chunks = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        headers = {name.decode().lower(): value.decode() for name, value in start.get("headers", [])}
+        return Response(start["status"], headers, b"".join(chunks))
+
+
+def json_body(data) -> tuple:
+    return {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+def form_body(data: dict) -> tuple:
+    return {"Content-Type": "application/x-www-form-urlencoded"}, urlencode(data).encode()
+
+
+def multipart_body(field: str, filename: str, content_type: str, data: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: {content_type}\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return {"Content-Type": f"multipart/form-data; boundary={boundary}"}, body
+
+
+def sample_picture(width: int = 800, height: int = 600, seed: int = 0) -> bytes:
+    """
+    A JPEG photo-like enough to compress the way camera pictures do: a gradient with noise.
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    picture = Image.merge("RGB", (gradient, noise, gradient.rotate(rng.choice((90, 180, 270)))))
+    output = io.BytesIO()
+    picture.save(output, "JPEG", quality=85)
+    return output.getvalue()
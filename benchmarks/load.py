@@ -0,0 +1,233 @@
+"""
+Multi-user load generator for a running server.
+
+Every virtual user keeps its own HTTP connection and search websocket, like the mobile client,
+and repeats operations drawn from MIX: logging in, searching over HTTP and the websocket,
+reading professors, subjects and reviews, writing reviews and uploading and downloading
+pictures. Point it at a server using a local Postgres that stands in for production and holds
+professors and subjects, e.g. loaded by python -m app.db.seed. Users bench0@bench.test,
+bench1@... are registered on the first run.
+
+Throughput and latency percentiles are reported per operation and in total, measured after
+the ramp-up. Websocket searches include the server's debounce window.
+
+Usage: python -m benchmarks.load [--url http://127.0.0.1:8000] [--users 50] [--duration 60]
+                                 [--baseline benchmarks/load_baseline.json [--save-baseline]]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlparse
+
+import websockets
+
+from . import report
+from .client import HttpClient, sample_picture
+from .workload import Visitor, benchmark_email, discover, sign_in
+
+# relative frequency of the operations a virtual user picks from
+MIX = {
+    "login": 2,
+    "search http": 15,
+    "search websocket": 15,
+    "read professor": 12,
+    "read subject": 8,
+    "read reviews": 20,
+    "write review": 8,
+    "upload picture": 3,
+    "download picture": 12,
+}
+
+SETUP_CONCURRENCY = 8
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.window_start = None
+
+    def record(self, name: str, started: float, ok: bool):
+        if self.window_start is None or started < self.window_start:
+            return
+        if ok:
+            self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        else:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self.latencies.setdefault(name, [])
+
+    def results(self, elapsed: float) -> dict:
+        results = {name: report.summarize(latencies, self.errors.get(name, 0), elapsed)
+                   for name, latencies in sorted(self.latencies.items())}
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        results["total"] = report.summarize(everything, sum(self.errors.values()), elapsed)
+        return results
+
+
+class VirtualUser:
+    def __init__(self, visitor: Visitor, catalog, picture: bytes, websocket_url: str,
+                 rng: random.Random, recorder: Recorder, pictures: list):
+        self.visitor = visitor
+        self.catalog = catalog
+        self.picture = picture
+        self.websocket_url = websocket_url
+        self.rng = rng
+        self.recorder = recorder
+        self.pictures = pictures  # ids of users with a picture, shared by all virtual users
+        self.websocket = None
+
+    async def timed(self, name: str, call):
+        started = time.perf_counter()
+        try:
+            response = await call
+            ok = response.status < 400
+        except Exception:  # a refused connection or a timeout is a failed operation, not the end of the run
+            ok = False
+        self.recorder.record(name, started, ok)
+
+    async def login(self):
+        await self.timed("POST /login/", self.visitor.login())
+
+    async def search_http(self):
+        await self.timed("GET /search/", self.visitor.search(self.rng.choice(self.catalog.terms)))
+
+    async def search_websocket(self):
+        started = time.perf_counter()
+        try:
+            if self.websocket is None or self.websocket.closed:
+                self.websocket = await websockets.connect(self.websocket_url,
+                                                          extra_headers={"authorization": self.visitor.token})
+            await self.websocket.send(self.rng.choice(self.catalog.terms))
+            while True:
+                message = json.loads(await self.websocket.recv())
+                if message.get("type") == "ping":
+                    await self.websocket.send(json.dumps({"type": "pong"}))
+                    continue
+                ok = message.get("status_code") in (200, 404)
+                break
+        except Exception:
+            ok = False
+            self.websocket = None
+        self.recorder.record("search websocket", started, ok)
+
+    async def read_professor(self):
+        prof_id = self.rng.choice(self.catalog.prof_ids)
+        await self.timed("GET /prof/{prof_id}", self.visitor.get(f"/prof/{prof_id}"))
+
+    async def read_subject(self):
+        subj_id = self.rng.choice(self.catalog.subj_ids)
+        await self.timed("GET /subj/{subj_id}", self.visitor.get(f"/subj/{subj_id}"))
+
+    async def read_reviews(self):
+        if self.rng.random() < 0.5:
+            prof_id = self.rng.choice(self.catalog.prof_ids)
+            await self.timed("GET /prof/{prof_id}/reviews", self.visitor.get(f"/prof/{prof_id}/reviews"))
+        else:
+            subj_id = self.rng.choice(self.catalog.subj_ids)
+            await self.timed("GET /subj/{subj_id}/reviews", self.visitor.get(f"/subj/{subj_id}/reviews"))
+
+    async def write_review(self):
+        kind = self.rng.choice(("prof", "subj"))
+        entity_id = self.rng.choice(self.catalog.prof_ids if kind == "prof" else self.catalog.subj_ids)
+        await self.timed(f"POST /{kind}/", self.visitor.write_review(kind, entity_id, self.rng))
+        await self.timed(f"PUT /{kind}/", self.visitor.write_review(kind, entity_id, self.rng, "PUT"))
+        await self.timed(f"DELETE /{kind}/delete_review", self.visitor.delete_review(kind, entity_id))
+
+    async def upload_picture(self):
+        await self.timed("PUT /profile/pic", self.visitor.upload_picture(self.picture))
+
+    async def download_picture(self):
+        user_id = self.rng.choice(self.pictures)
+        size = self.rng.choice((None, 64, 256))
+        await self.timed("GET /profile/{profile_id}/pic", self.visitor.download_picture(user_id, size))
+
+    async def run(self, deadline: float, think: float):
+        operations = {
+            "login": self.login,
+            "search http": self.search_http,
+            "search websocket": self.search_websocket,
+            "read professor": self.read_professor,
+            "read subject": self.read_subject,
+            "read reviews": self.read_reviews,
+            "write review": self.write_review,
+            "upload picture": self.upload_picture,
+            "download picture": self.download_picture,
+        }
+        names = list(MIX)
+        weights = [MIX[name] for name in names]
+        try:
+            while time.perf_counter() < deadline:
+                await operations[self.rng.choices(names, weights)[0]]()
+                if think:
+                    await asyncio.sleep(self.rng.expovariate(1 / think))
+        finally:
+            if self.websocket is not None:
+                await self.websocket.close()
+            await self.visitor.client.close()
+
+
+async def prepare(host: str, port: int, users: int, picture: bytes):
+    """
+    Signs every user in and gives each a picture, a few at a time so bcrypt is not flooded.
+    """
+    slots = asyncio.Semaphore(SETUP_CONCURRENCY)
+
+    async def prepare_one(index: int) -> Visitor:
+        async with slots:
+            visitor = await sign_in(HttpClient(host, port), benchmark_email(index))
+            response = await visitor.upload_picture(picture)
+            if response.status >= 400:
+                raise RuntimeError(f"Picture upload failed: {response.status} {response.body!r}")
+            return visitor
+
+    return await asyncio.gather(*(prepare_one(index) for index in range(users)))
+
+
+async def run(arguments) -> dict:
+    url = urlparse(arguments.url)
+    host, port = url.hostname, url.port or 80
+    websocket_url = f"{'wss' if url.scheme == 'https' else 'ws'}://{host}:{port}/search/wb"
+    picture = sample_picture(seed=arguments.seed)
+
+    visitors = await prepare(host, port, arguments.users, picture)
+    catalog = await discover(visitors[0])
+    pictures = [visitor.user_id for visitor in visitors]
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    recorder.window_start = started + arguments.ramp_up
+    deadline = recorder.window_start + arguments.duration
+    rng = random.Random(arguments.seed)
+
+    async def start(index: int, visitor: Visitor):
+        await asyncio.sleep(arguments.ramp_up * index / len(visitors))
+        user = VirtualUser(visitor, catalog, picture, websocket_url, random.Random(rng.random()),
+                           recorder, pictures)
+        await user.run(deadline, arguments.think)
+
+    await asyncio.gather(*(start(index, visitor) for index, visitor in enumerate(visitors)))
+    return recorder.results(time.perf_counter() - recorder.window_start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="address of the running server")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds measured after the ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=0,
+                        help="mean pause between a user's operations in seconds, 0 runs them back to back")
+    parser.add_argument("--seed", type=int, default=0)
+    report.add_arguments(parser)
+    arguments = parser.parse_args()
+
+    results = asyncio.run(run(arguments))
+    raise SystemExit(report.finish(results, arguments.output, arguments.baseline,
+                                   arguments.save_baseline, arguments.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Micro-benchmarks of every route handler and of the authentication dependency.
+
+Routes are called in process through AsgiClient, one call at a time, so a latency is the cost
+of the route and its queries without the network or the server in front. The database is the
+one configured in .env: run it against a local Postgres standing in for production, holding
+professors and subjects, e.g. loaded by python -m app.db.seed. The benchmark signs in as
+bench0@bench.test, registering it if needed.
+
+Usage: python -m benchmarks.micro [--iterations 200] [--filter prof] [--no-response-cache]
+                                  [--baseline benchmarks/micro_baseline.json [--save-baseline]]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from app.main import app
+from app.db.database import async_session
+from app.response_cache import response_cache
+from app.routers.search import find
+from app.security import auth
+from app.settings import settings
+
+from . import report
+from .client import AsgiClient, sample_picture
+from .workload import Visitor, benchmark_email, discover, sign_in
+
+
+class Case:
+    """
+    Steps run in order once per iteration, each step is measured on its own. A step returns
+    a Response, whose status tells success, or anything else, which counts as success.
+    """
+
+    def __init__(self, *steps):
+        self.steps = steps  # (name, coroutine function) pairs
+
+
+def ok(result) -> bool:
+    return getattr(result, "status", 200) < 400
+
+
+def build_cases(client: AsgiClient, visitor: Visitor, catalog, picture: bytes, rng: random.Random) -> list:
+    prof_id, subj_id = catalog.prof_ids[0], catalog.subj_ids[0]
+    prof_batch = "&".join(f"ids={id}" for id in catalog.prof_ids[:settings.MAX_BATCH_SIZE])
+    subj_batch = "&".join(f"ids={id}" for id in catalog.subj_ids[:settings.MAX_BATCH_SIZE])
+    token = visitor.token
+
+    async def check_token_cached():
+        return auth.check_token_validity(token)
+
+    async def check_token_uncached():
+        auth.claims_cache.clear()
+        return auth.check_token_validity(token)
+
+    async def current_user_cached():
+        async with async_session() as db:
+            return await auth.get_current_user(token, db)
+
+    async def current_user_uncached():
+        auth.claims_cache.clear()
+        auth.principal_cache.clear()
+        async with async_session() as db:
+            return await auth.get_current_user(token, db)
+
+    async def websocket_search():  # the work the socket does per message, after the debounce
+        async with async_session() as db:
+            return await find(db, rng.choice(catalog.terms), settings.SEARCH_LIMIT_PER_TYPE)
+
+    async def picture_etag_match():
+        current = await visitor.download_picture(visitor.user_id)
+        return await client.request("GET", f"/profile/{visitor.user_id}/pic",
+                                    visitor.headers({"If-None-Match": current.headers.get("etag", "")}))
+
+    newcomer = Visitor(client, "")
+
+    async def register():
+        newcomer.email = f"m{uuid.uuid4().hex[:12]}@bench.test"
+        return await newcomer.register()
+
+    cases = [
+        Case(("auth.check_token_validity cached", check_token_cached)),
+        Case(("auth.check_token_validity uncached", check_token_uncached)),
+        Case(("auth.get_current_user cached", current_user_cached)),
+        Case(("auth.get_current_user uncached", current_user_uncached)),
+        Case(("GET /", lambda: client.request("GET", "/"))),
+        Case(("POST /login/", visitor.login)),
+        Case(("POST /register/", register), ("POST /login/ (new user)", newcomer.login),
+             ("DELETE /profile/", newcomer.delete_profile)),
+        Case(("GET /search/", lambda: visitor.search(rng.choice(catalog.terms)))),
+        Case(("websocket search", websocket_search)),
+        Case(("GET /prof/{prof_id}", lambda: visitor.get(f"/prof/{prof_id}"))),
+        Case(("GET /prof/{prof_id}/stats", lambda: visitor.get(f"/prof/{prof_id}/stats"))),
+        Case(("GET /prof/{prof_id}/reviews", lambda: visitor.get(f"/prof/{prof_id}/reviews"))),
+        Case(("GET /prof/batch", lambda: visitor.get(f"/prof/batch?{prof_batch}"))),
+        Case(("POST /prof/", lambda: visitor.write_review("prof", prof_id, rng)),
+             ("PUT /prof/", lambda: visitor.write_review("prof", prof_id, rng, "PUT")),
+             ("DELETE /prof/delete_review", lambda: visitor.delete_review("prof", prof_id))),
+        Case(("GET /subj/{subj_id}", lambda: visitor.get(f"/subj/{subj_id}"))),
+        Case(("GET /subj/{subj_id}/stats", lambda: visitor.get(f"/subj/{subj_id}/stats"))),
+        Case(("GET /subj/{subj_id}/reviews", lambda: visitor.get(f"/subj/{subj_id}/reviews"))),
+        Case(("GET /subj/batch", lambda: visitor.get(f"/subj/batch?{subj_batch}"))),
+        Case(("POST /subj/", lambda: visitor.write_review("subj", subj_id, rng)),
+             ("PUT /subj/", lambda: visitor.write_review("subj", subj_id, rng, "PUT")),
+             ("DELETE /subj/delete_review", lambda: visitor.delete_review("subj", subj_id))),
+        Case(("GET /profile/{profile_id}", lambda: visitor.get(f"/profile/{visitor.user_id}"))),
+        Case(("GET /profile/batch", lambda: visitor.get(f"/profile/batch?ids={visitor.user_id}"))),
+        Case(("PUT /profile/pic", lambda: visitor.upload_picture(picture)),
+             ("GET /profile/{profile_id}/pic", lambda: visitor.download_picture(visitor.user_id)),
+             ("GET /profile/{profile_id}/pic?size=64", lambda: visitor.download_picture(visitor.user_id, 64)),
+             ("GET /profile/{profile_id}/pic etag match", picture_etag_match),
+             ("PUT /profile/delete_pic", visitor.delete_picture)),
+    ]
+    cases += [Case((f"GET {path}", lambda path=path: visitor.get(path)))
+              for path in ("/monitoring/pool", "/monitoring/cache", "/monitoring/hashing",
+                           "/monitoring/websockets", "/monitoring/response_cache")]
+    return cases
+
+
+async def measure(case: Case, iterations: int, warmup: int, results: dict):
+    timings = {name: [] for name, _ in case.steps}
+    errors = {name: 0 for name, _ in case.steps}
+    elapsed = {name: 0.0 for name, _ in case.steps}
+    for iteration in range(warmup + iterations):
+        for name, step in case.steps:
+            started = time.perf_counter()
+            result = await step()
+            duration = time.perf_counter() - started
+            if iteration < warmup:
+                continue
+            elapsed[name] += duration
+            if ok(result):
+                timings[name].append(duration)
+            else:
+                errors[name] += 1
+    for name, _ in case.steps:
+        results[name] = report.summarize(timings[name], errors[name], elapsed[name])
+
+
+async def run(arguments) -> dict:
+    if arguments.no_response_cache:
+        response_cache.backend = None
+    client = AsgiClient(app)
+    await client.startup()
+    try:
+        visitor = await sign_in(client, benchmark_email(0))
+        catalog = await discover(visitor)
+        rng = random.Random(arguments.seed)
+        results = {}
+        for case in build_cases(client, visitor, catalog, sample_picture(seed=arguments.seed), rng):
+            if arguments.filter and not any(arguments.filter in name for name, _ in case.steps):
+                continue
+            await measure(case, arguments.iterations, arguments.warmup, results)
+        return results
+    finally:
+        await client.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200, help="measured calls per route")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured calls per route before measuring")
+    parser.add_argument("--filter", help="only run the cases with a step whose name contains this text")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="measure the read routes without their response cache")
+    report.add_arguments(parser)
+    arguments = parser.parse_args()
+
+    results = asyncio.run(run(arguments))
+    raise SystemExit(report.finish(results, arguments.output, arguments.baseline,
+                                   arguments.save_baseline, arguments.tolerance))
+
+
+if __name__ == "__main__":
+    main()
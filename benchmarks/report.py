@@ -0,0 +1,110 @@
+"""
+Summaries of benchmark runs and their comparison with a stored baseline.
+
+A result file maps every measured operation to its count, errors, throughput (operations
+per second) and latency percentiles in milliseconds. A baseline is a result file saved
+from an earlier run on the same machine and dataset.
+"""
+
+import json
+import math
+from typing import Dict, List
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    """
+    Latencies are seconds of the successful calls, elapsed is the wall time they were measured in.
+    """
+    ordered = sorted(latencies)
+    summary = {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput": round(len(ordered) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(percentile(ordered, p) * 1000, 3)
+    summary["max_ms"] = round(ordered[-1] * 1000, 3) if ordered else 0.0
+    return summary
+
+
+def print_table(results: Dict[str, dict]):
+    columns = ["count", "errors", "throughput"] + [f"p{p}_ms" for p in PERCENTILES] + ["max_ms"]
+    width = max([len(name) for name in results] + [9])
+    print(f"{'operation':<{width}}" + "".join(f"{column:>12}" for column in columns))
+    for name, summary in results.items():
+        print(f"{name:<{width}}" + "".join(f"{summary.get(column, ''):>12}" for column in columns))
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Lists the operations whose throughput dropped or whose p95 latency grew by more than
+    the tolerance (0.2 is 20 %) against the baseline, and those that started failing.
+    Operations missing from either side are not compared.
+    """
+    regressions = []
+    for name, summary in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if before["throughput"] and summary["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {summary['throughput']}/s, baseline {before['throughput']}/s")
+        if before["p95_ms"] and summary["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {summary['p95_ms']} ms, baseline {before['p95_ms']} ms")
+        if summary["errors"] and not before["errors"]:
+            regressions.append(f"{name}: {summary['errors']} errors, none in the baseline")
+    return regressions
+
+
+def load(path: str) -> Dict[str, dict]:
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path: str, results: Dict[str, dict]):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def finish(results: Dict[str, dict], output: str = None, baseline: str = None,
+           save_baseline: bool = False, tolerance: float = 0.2) -> int:
+    """
+    Prints the results, writes them where asked and checks them against the baseline.
+    Returns the exit status: 1 when a regression was found, 0 otherwise.
+    """
+    print_table(results)
+    if output:
+        save(output, results)
+    if baseline and save_baseline:
+        save(baseline, results)
+        print(f"Baseline saved to {baseline}.")
+        return 0
+    if baseline:
+        regressions = compare(results, load(baseline), tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regression against {baseline} (tolerance {tolerance:.0%}).")
+    return 0
+
+
+def add_arguments(parser):
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="baseline JSON file to compare the results with")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative throughput drop and p95 growth, default 0.2")
@@ -0,0 +1,108 @@
+"""
+Serialization benchmark of the list responses: review pages and search results.
+
+Every case encodes the same page twice: "validated" is the path responses took before,
+pydantic validation through the response model, jsonable_encoder and the stdlib encoder,
+"fast" is the current one, rows projected onto the model and encoded by orjson (see
+app.serialization). Both must produce the same bytes, the run fails otherwise. Rows are
+real SQLAlchemy rows, read from an in-memory SQLite database, so no server is needed.
+
+Usage: python -m benchmarks.serialization [--rows 200] [--iterations 500]
+                                          [--baseline benchmarks/serialization_baseline.json [--save-baseline]]
+"""
+
+import argparse
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from sqlalchemy import create_engine, text
+from starlette.responses import JSONResponse
+
+from app.schemas import prof_schema, search_schema, subj_schema
+from app.serialization import dumps, project
+
+from . import report
+
+PAGE_ROWS = 200  # MAX_PAGE_SIZE, the longest page a client can ask for
+
+# columns in the order the review queries select them, review_date is only used for the cursor
+PROF_REVIEWS = """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows)
+    SELECT 7 AS id, 'Reviewer ' || i AS user_name, 'Clear lectures, fair exams, review number ' || i AS message,
+           i % 101 AS rating, '2022-05-01 12:00:00' AS review_date, 1000 + i AS user_id
+    FROM n
+"""
+SUBJ_REVIEWS = """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows)
+    SELECT 7 AS id, 'Demanding but useful, review číslo ' || i AS message, i % 101 AS prof_avg,
+           (i * 7) % 101 AS usability, (i * 13) % 101 AS difficulty, 'Reviewer ' || i AS user_name,
+           '2022-05-01 12:00:00' AS review_date, 1000 + i AS user_id
+    FROM n
+"""
+
+
+def validated(response_model, content) -> bytes:
+    return JSONResponse(jsonable_encoder(parse_obj_as(response_model, content))).body
+
+
+def build_cases(rows: int) -> dict:
+    """
+    Maps every case name to its validated and fast encoder, each called without arguments.
+    """
+    with create_engine("sqlite://").connect() as connection:
+        prof_rows = connection.execute(text(PROF_REVIEWS), {"rows": rows}).all()
+        subj_rows = connection.execute(text(SUBJ_REVIEWS), {"rows": rows}).all()
+    # three entity types interleaved, as the search returns them
+    found = [{"name": f"Entity {i}", "code": ("PROF", "MTAA", "USER")[i % 3], "id": i} for i in range(rows)]
+
+    return {
+        "prof reviews": (lambda: validated(List[prof_schema.GetProfIdReviews], prof_rows),
+                         lambda: dumps(project(prof_rows, prof_schema.GetProfIdReviews))),
+        "subj reviews": (lambda: validated(List[subj_schema.GetSubjectIdReviews], subj_rows),
+                         lambda: dumps(project(subj_rows, subj_schema.GetSubjectIdReviews))),
+        "search": (lambda: validated(List[search_schema.GetSearch], found),
+                   lambda: dumps(found)),
+    }
+
+
+def measure(encode, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        encode()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        encode()
+        timings.append(time.perf_counter() - call_started)
+    return report.summarize(timings, 0, time.perf_counter() - started)
+
+
+def run(arguments) -> dict:
+    results = {}
+    for name, (slow, fast) in build_cases(arguments.rows).items():
+        if slow() != fast():
+            raise SystemExit(f"{name}: the fast path encodes a different body than the validated one.")
+        results[f"{name} validated"] = measure(slow, arguments.iterations, arguments.warmup)
+        results[f"{name} fast"] = measure(fast, arguments.iterations, arguments.warmup)
+        print(f"{name}: {results[f'{name} validated']['p50_ms'] / results[f'{name} fast']['p50_ms']:.1f}x "
+              f"faster at the median for {arguments.rows} rows")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=PAGE_ROWS, help="rows in every encoded page")
+    parser.add_argument("--iterations", type=int, default=500, help="measured encodings per case")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured encodings per case before measuring")
+    report.add_arguments(parser)
+    arguments = parser.parse_args()
+
+    results = run(arguments)
+    raise SystemExit(report.finish(results, arguments.output, arguments.baseline,
+                                   arguments.save_baseline, arguments.tolerance))
+
+
+if __name__ == "__main__":
+    main()
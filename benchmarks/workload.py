@@ -0,0 +1,142 @@
+"""
+What a benchmark user does: signing in, finding professors and subjects, reading and writing
+reviews and exchanging pictures, each call mapped onto the public API.
+"""
+
+import base64
+import json
+import random
+from typing import List, NamedTuple
+from urllib.parse import quote
+
+from .client import Response, form_body, json_body, multipart_body
+
+PASSWORD = "benchmark"
+
+# every professor carries this code in search results, subjects have their own codes
+PROFESSOR_CODE = "PROF"
+USER_CODE = "USER"
+MATCH_ALL = "default_value"
+
+DISCOVERY_LIMIT = 200
+
+# id field and scores of a review, by router
+REVIEWS = {
+    "prof": ("prof_id", ("rating",)),
+    "subj": ("subj_id", ("difficulty", "usability", "prof_avg")),
+}
+
+
+class Catalog(NamedTuple):
+    prof_ids: List[int]
+    subj_ids: List[int]
+    terms: List[str]  # search strings that find something
+
+
+def benchmark_email(index: int) -> str:
+    return f"bench{index}@bench.test"
+
+
+def token_user_id(token: str) -> int:
+    """
+    The user id claim of an access token, read without verifying the signature.
+    """
+    payload = token.split(".")[1]
+    return int(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["user_id"])
+
+
+class Visitor:
+    """
+    One benchmark user talking to the service through a client.
+    """
+
+    def __init__(self, client, email: str, password: str = PASSWORD):
+        self.client = client
+        self.email = email
+        self.password = password
+        self.token = None
+        self.user_id = None
+
+    def headers(self, extra: dict = None) -> dict:
+        return dict(extra or {}, Authorization=f"Bearer {self.token}")
+
+    async def register(self) -> Response:
+        """
+        Creates the account, an account left from an earlier run is reused.
+        """
+        headers, body = json_body({"email": self.email, "first_name": "Bench", "last_name": "User",
+                                   "study_year": 1, "pwd": self.password})
+        response = await self.client.request("POST", "/register/", headers, body)
+        if response.status not in (201, 403):
+            raise RuntimeError(f"Registration of {self.email} failed: {response.status} {response.body!r}")
+        return response
+
+    async def login(self) -> Response:
+        headers, body = form_body({"username": self.email, "password": self.password})
+        response = await self.client.request("POST", "/login/", headers, body)
+        if response.status == 200:
+            self.token = response.json()["access_token"]
+            self.user_id = token_user_id(self.token)
+        return response
+
+    async def get(self, path: str) -> Response:
+        return await self.client.request("GET", path, self.headers())
+
+    async def search(self, term: str) -> Response:
+        return await self.get(f"/search/?search_string={quote(term)}")
+
+    async def write_review(self, kind: str, entity_id: int, rng: random.Random, method: str = "POST") -> Response:
+        """
+        Adds (POST) or modifies (PUT) the user's review of a professor (kind "prof") or a subject ("subj").
+        """
+        key, scores = REVIEWS[kind]
+        review = {"message": "Benchmark review.", key: entity_id}
+        review.update({score: rng.randint(0, 100) for score in scores})
+        headers, body = json_body(review)
+        return await self.client.request(method, f"/{kind}/", self.headers(headers), body)
+
+    async def delete_review(self, kind: str, entity_id: int) -> Response:
+        parameter = "pid" if kind == "prof" else "sid"
+        return await self.client.request("DELETE", f"/{kind}/delete_review?uid={self.user_id}&{parameter}={entity_id}",
+                                         self.headers())
+
+    async def upload_picture(self, picture: bytes) -> Response:
+        headers, body = multipart_body("file", "picture.jpg", "image/jpeg", picture)
+        return await self.client.request("PUT", "/profile/pic", self.headers(headers), body)
+
+    async def download_picture(self, user_id: int, size: int = None) -> Response:
+        return await self.get(f"/profile/{user_id}/pic" + (f"?size={size}" if size is not None else ""))
+
+    async def delete_picture(self) -> Response:
+        return await self.client.request("PUT", "/profile/delete_pic", self.headers())
+
+    async def delete_profile(self) -> Response:
+        return await self.client.request("DELETE", "/profile/", self.headers())
+
+
+async def sign_in(client, email: str) -> Visitor:
+    visitor = Visitor(client, email)
+    response = await visitor.login()
+    if response.status != 200:
+        await visitor.register()
+        response = await visitor.login()
+    if response.status != 200:
+        raise RuntimeError(f"Login of {email} failed: {response.status} {response.body!r}")
+    return visitor
+
+
+async def discover(visitor: Visitor) -> Catalog:
+    """
+    Finds professors and subjects to work with through the search, so any dataset will do.
+    """
+    professors = await visitor.get(f"/search/?search_string={PROFESSOR_CODE}&limit={DISCOVERY_LIMIT}")
+    everything = await visitor.get(f"/search/?search_string={MATCH_ALL}&limit={DISCOVERY_LIMIT}")
+    found = (professors.json() if professors.status == 200 else []) + \
+            (everything.json() if everything.status == 200 else [])
+
+    prof_ids = sorted({item["id"] for item in found if item["code"] == PROFESSOR_CODE})
+    subj_ids = sorted({item["id"] for item in found if item["code"] not in (PROFESSOR_CODE, USER_CODE)})
+    terms = sorted({item["name"][:3] for item in found if len(item["name"]) >= 3})
+    if not prof_ids or not subj_ids:
+        raise RuntimeError("The database holds no professors or subjects, seed it first.")
+    return Catalog(prof_ids, subj_ids, terms or [MATCH_ALL])
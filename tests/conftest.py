@@ -0,0 +1,55 @@
+"""
+Tests run with: python -m pytest
+
+Settings come from the environment or .env like for the server, the defaults below only let the
+tests that need no database import the application. Tests using the client fixture run the
+migrations on DB_NAME and are skipped when the server cannot be reached. Blobs go to a
+temporary directory unless BLOB_ROOT is set.
+"""
+
+import os
+import tempfile
+import uuid
+
+import pytest
+from jose import jwt
+
+for name, value in {"DB_USERNAME": "postgres", "DB_PASSWORD": "postgres", "DB_HOST": "localhost",
+                    "DB_PORT": "5432", "DB_NAME": "mtaa_test", "ALGORITHM": "HS256",
+                    "SECRET_KEY": "test", "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+                    "BCRYPT_ROUNDS": "4", "BLOB_ROOT": tempfile.mkdtemp(prefix="mtaa-blobs-")}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from sqlalchemy.exc import OperationalError
+
+    from app.db.create_schema import create_schema
+    from app.db.init_db import engine
+    from app.main import app
+
+    try:
+        engine.connect().close()
+    except OperationalError as error:
+        pytest.skip(f"No database to test against: {error}")
+    create_schema()
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def sign_up(client):
+    """
+    Registers a new user and returns the Authorization header and id of that user.
+    """
+    def sign_up():
+        email = f"{uuid.uuid4().hex[:16]}@test.sk"
+        response = client.post("/register/", json={"email": email, "first_name": "Test", "last_name": "User",
+                                                   "study_year": 1, "pwd": "password"})
+        assert response.status_code == 201, response.text
+        token = client.post("/login/", data={"username": email, "password": "password"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}, jwt.get_unverified_claims(token)["user_id"]
+
+    return sign_up
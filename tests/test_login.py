@@ -0,0 +1,16 @@
+import uuid
+
+
+def register(client, email: str):
+    return client.post("/register/", json={"email": email, "first_name": "Test", "last_name": "User",
+                                           "study_year": 1, "pwd": "password"})
+
+
+def test_emails_compare_case_insensitively(client):
+    email = f"{uuid.uuid4().hex[:16]}@Test.sk"
+    assert register(client, email).status_code == 201
+
+    response = client.post("/login/", data={"username": email.lower(), "password": "password"})
+    assert response.status_code == 200, response.text
+    response = register(client, email.upper())
+    assert response.status_code == 403 and response.json()["detail"] == "Email already taken."
@@ -0,0 +1,19 @@
+from sqlalchemy import update
+
+from app.db.init_db import engine
+from app.models import User
+
+ENDPOINTS = ["/monitoring/pool", "/monitoring/cache", "/monitoring/hashing", "/monitoring/websockets",
+             "/monitoring/response_cache", "/monitoring/replicas"]
+
+
+def test_monitoring_requires_admin(client, sign_up):
+    headers, _ = sign_up()
+    admin_headers, admin_id = sign_up()
+    with engine.begin() as connection:  # before the admin's first request, its principal is not cached yet
+        connection.execute(update(User).filter(User.id == admin_id).values(permission=True))
+
+    for endpoint in ENDPOINTS:
+        assert client.get(endpoint).status_code == 401, endpoint
+        assert client.get(endpoint, headers=headers).status_code == 403, endpoint
+        assert client.get(endpoint, headers=admin_headers).status_code == 200, endpoint
@@ -0,0 +1,43 @@
+import base64
+
+import pytest
+from fastapi import HTTPException
+
+from app.pagination import decode_search_cursor, encode_cursor, search_cursor
+from app.search import index
+from app.search.index import SearchIndex
+
+ROWS = [(f"Subject {i}", f"S{i}", i, "subj") for i in range(1, 6)] + \
+       [(f"Professor {i}", "PROF", i, "prof") for i in range(1, 6)] + \
+       [(f"User {i}", "USER", i, "user") for i in range(1, 6)]
+
+
+@pytest.mark.parametrize("key", [[], [1, 2, 3, 4], ["1"], [1.5], [True], [None, 1], [[1], 1], {"id": 1}, "1"])
+def test_malformed_search_cursor_is_rejected(key):
+    cursor = encode_cursor({"q": search_cursor("sub", {})["q"], "after": {"subj": key}})
+    with pytest.raises(HTTPException) as raised:
+        decode_search_cursor(cursor, "sub")
+    assert raised.value.status_code == 400
+
+
+def test_deeply_nested_cursor_is_rejected():
+    with pytest.raises(HTTPException) as raised:
+        decode_search_cursor(base64.urlsafe_b64encode(b"[" * 5000).decode(), "sub")
+    assert raised.value.status_code == 400
+
+
+@pytest.mark.parametrize("scored_candidates", [index.MAX_SCORED_CANDIDATES, 0])
+@pytest.mark.parametrize("search_string", ["", "p", "sub", "prof", "ubjec"])
+@pytest.mark.parametrize("key", [[3], [0], [-1.5, 3], ["subject 3", 3], [0, "subject 3", 3], [1, 3]])
+def test_search_keys_of_another_shape_fail_as_invalid_cursors(monkeypatch, scored_candidates, search_string, key):
+    """
+    A well formed key of a different search either continues some page or fails with one of
+    the errors get_search answers with 400, never with an IndexError.
+    """
+    monkeypatch.setattr(index, "MAX_SCORED_CANDIDATES", scored_candidates)
+    after = decode_search_cursor(encode_cursor(search_cursor(search_string, {"subj": key, "prof": key})),
+                                 search_string)
+    try:
+        SearchIndex.from_rows(ROWS).search(search_string, 2, after)
+    except (TypeError, ValueError, ArithmeticError):
+        pass
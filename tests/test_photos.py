@@ -0,0 +1,64 @@
+import io
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from sqlalchemy import select
+
+from app.db.init_db import engine
+from app.models import Blob, UserPhoto
+
+
+def small_picture() -> bytes:
+    """
+    A picture no larger than the smallest variant, so the 64 and 256 px variants are identical.
+    Its pixels are random, no earlier upload shares its blobs.
+    """
+    output = io.BytesIO()
+    Image.frombytes("RGB", (32, 32), os.urandom(32 * 32 * 3)).save(output, "PNG")
+    return output.getvalue()
+
+
+def upload(client, headers, picture: bytes):
+    response = client.put("/profile/pic", headers=headers, files={"file": ("picture.png", picture, "image/png")})
+    assert response.status_code == 200, response.text
+
+
+def test_small_picture_uploaded_twice_stays_readable(client, sign_up):
+    headers, user_id = sign_up()
+    picture = small_picture()
+    upload(client, headers, picture)
+    upload(client, headers, picture)
+
+    for size in (None, 64, 256):
+        response = client.get(f"/profile/{user_id}/pic", headers=headers, params={"size": size} if size else {})
+        assert response.status_code == 200, size
+
+
+def test_picture_shared_by_two_users_outlives_one_delete(client, sign_up):
+    (first, first_id), (second, second_id) = sign_up(), sign_up()
+    picture = small_picture()
+    upload(client, first, picture)
+    upload(client, second, picture)
+
+    assert client.put("/profile/delete_pic", headers=first).status_code == 200
+    for size in (None, 64):
+        response = client.get(f"/profile/{second_id}/pic", headers=second, params={"size": size} if size else {})
+        assert response.status_code == 200, size
+    assert client.get(f"/profile/{first_id}/pic", headers=first).status_code == 404
+
+
+def test_concurrent_uploads_of_one_user(client, sign_up):
+    headers, user_id = sign_up()
+    pictures = [small_picture() for _ in range(6)]
+    with ThreadPoolExecutor(len(pictures)) as executor:
+        list(executor.map(lambda picture: upload(client, headers, picture), pictures))
+
+    with engine.connect() as connection:
+        digests = connection.execute(select(UserPhoto.content_hash).filter(UserPhoto.user_id == user_id)).scalars()
+        references = Counter(digests)
+        refcounts = dict(connection.execute(select(Blob.content_hash, Blob.refcount)
+                                            .filter(Blob.content_hash.in_(references))).all())
+    assert len(references) == 2  # the last upload's variants, 64 and 256 px are identical
+    assert refcounts == references
@@ -0,0 +1,20 @@
+import pytest
+
+from app.db.query_log import explainable
+
+
+@pytest.mark.parametrize("statement, expected", [
+    ("SELECT id FROM user_table WHERE id = $1", True),
+    ("  select id from user_table where id = $1", True),
+    ("SELECT id FROM user_table WHERE id = $1 FOR UPDATE", False),
+    ("SELECT id FROM user_table WHERE id = $1 for no key update", False),
+    ("SELECT id FROM user_table WHERE id = $1 FOR SHARE", False),
+    ("SELECT id FROM user_table WHERE id = $1\nFOR KEY SHARE", False),
+    ("UPDATE user_table SET comments = comments + 1 WHERE id = $1", False),
+])
+def test_explainable(statement, expected):
+    assert explainable(statement, executemany=False) is expected
+
+
+def test_executemany_is_not_explainable():
+    assert explainable("SELECT 1", executemany=True) is False
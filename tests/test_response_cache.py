@@ -0,0 +1,93 @@
+import asyncio
+
+from app.response_cache import MemoryBackend, RedisBackend, ResponseCache, response_cache
+from app.settings import settings
+
+
+class RespStandIn:
+    """
+    Local server answering HGET, HSET, PEXPIRE and DEL in the Redis protocol, enough for RedisBackend.
+    Replies are written one at a time, so pipelined commands arrive at the client in pieces.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.connections = 0
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                command = await RedisBackend.read_reply(reader)
+                writer.write(self.answer(*command))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+    def answer(self, name: bytes, key: bytes, *arguments) -> bytes:
+        if name == b"HGET":
+            value = self.hashes.get(key, {}).get(arguments[0])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"HSET":
+            fields = self.hashes.setdefault(key, {})
+            added = arguments[0] not in fields
+            fields[arguments[0]] = arguments[1]
+            return b":%d\r\n" % added
+        if name == b"PEXPIRE":
+            return b":%d\r\n" % (key in self.hashes)
+        if name == b"DEL":
+            return b":%d\r\n" % sum(self.hashes.pop(name, None) is not None for name in (key, *arguments))
+        return b"-ERR unknown command\r\n"
+
+
+def test_redis_backend_round_trips_through_a_resp_server():
+    async def run():
+        stand_in = RespStandIn()
+        server = await asyncio.start_server(stand_in.serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backend = RedisBackend(f"redis://127.0.0.1:{port}/0", pool_size=2, timeout=2)
+        try:
+            for page in range(3):
+                await backend.set("prof:1:reviews", str(page), b"body %d" % page, ttl=60)
+            assert [await backend.get("prof:1:reviews", str(page)) for page in range(3)] == [b"body 0", b"body 1",
+                                                                                               b"body 2"]
+            await backend.delete("prof:1:reviews")
+            assert await backend.get("prof:1:reviews", "0") is None
+            assert stand_in.connections == 1  # no command failed and dropped its connection
+        finally:
+            await backend.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+
+
+def cached_body(cache: ResponseCache, key: str, field: str):
+    cached = asyncio.run(cache.get("route", key, field))
+    return cached.body if cached is not None else None
+
+
+def test_response_read_before_an_invalidation_is_not_stored():
+    cache = ResponseCache(MemoryBackend(100, 60), ttl=60)
+    generation = cache.generation()
+    asyncio.run(cache.invalidate("prof:1"))  # a write committed while the response was read
+    asyncio.run(cache._store("prof:1", "detail", generation, b"[]"))
+    assert cached_body(cache, "prof:1", "detail") is None
+
+    asyncio.run(cache._store("prof:1", "detail", cache.generation(), b"[]"))
+    assert cached_body(cache, "prof:1", "detail") == b"[]"
+
+
+def test_invalidated_key_is_not_cached_during_the_quiet_period():
+    assert response_cache.quiet_period == settings.READ_YOUR_WRITES_SECONDS  # with or without replicas
+    cache = ResponseCache(MemoryBackend(100, 60), ttl=60, quiet_period=60)
+    asyncio.run(cache.invalidate("prof:1"))
+    asyncio.run(cache._store("prof:1", "detail", cache.generation(), b"[]"))
+    assert cached_body(cache, "prof:1", "detail") is None
+
+
+def test_uncached_field_is_never_stored():
+    cache = ResponseCache(MemoryBackend(100, 60), ttl=60)
+    asyncio.run(cache._store("prof:1:reviews", None, cache.generation(), b"[]"))
+    assert asyncio.run(cache.get("route", "prof:1:reviews", None)) is None
+    assert asyncio.run(cache.backend.get("prof:1:reviews", None)) is None